@@ -1,56 +1,2847 @@
 
+import os
 import socket
+import sys
 import threading
+import time
+
+PORT = 56789
+SINGLETON_HOST = '127.0.0.1'
+# Local socket for the single-instance handoff, inside a directory only this user
+# can enter; TCP on PORT is the fallback
+if hasattr(socket, "AF_UNIX") and hasattr(os, "getuid"):
+    SINGLETON_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or "/tmp",
+                                    f"notepd-{os.getuid()}", "instance.sock")
+else:
+    SINGLETON_SOCKET = None
+MAX_FRAME = 64 * 1024
+
+def local_socket_path(create=False):
+    # SINGLETON_SOCKET, or None when its directory could have been planted by
+    # someone else: it must be a real directory of ours that nobody else can open
+    if not SINGLETON_SOCKET:
+        return None
+    import stat
+    directory = os.path.dirname(SINGLETON_SOCKET)
+    if create:
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+    return SINGLETON_SOCKET
+
+def encode_frame(message):
+    data = message.encode("utf-8")
+    return len(data).to_bytes(4, "big") + data
+
+def parse_open_target(arg):
+    # Accepts "path", "path:line" and "path:line:col"
+    path, line, col = arg, None, None
+    if not os.path.exists(arg):
+        parts = arg.split(":")
+        numbers = []
+        while len(parts) > 1 and len(numbers) < 2 and parts[-1].isdigit():
+            numbers.insert(0, int(parts.pop()))
+            if os.path.exists(":".join(parts)):
+                break
+        if numbers:
+            path = ":".join(parts)
+            line = numbers[0]
+            col = numbers[1] if len(numbers) > 1 else 1
+    return os.path.abspath(path), line, col
+
+def format_open_command(path, line=None, col=None):
+    if line is None:
+        return f"OPEN {path}"
+    return f"OPEN {path} {line}:{col or 1}"
+
+def parse_command(message):
+    if message == "SHOW":
+        return "SHOW", None
+    if message.startswith("OPEN "):
+        body = message[5:]
+        head, _, tail = body.rpartition(" ")
+        if head and tail.count(":") == 1 and tail.replace(":", "").isdigit():
+            line, col = tail.split(":")
+            return "OPEN", (head, int(line), int(col))
+        return "OPEN", (body, None, None)
+    return None, None
+
+def notify_existing_instance(args=()):
+    frames = [encode_frame("SHOW")]
+    for arg in args:
+        if not arg.startswith("--"):
+            frames.append(encode_frame(format_open_command(*parse_open_target(arg))))
+    payload = b"".join(frames)
+    connectors = [lambda: socket.create_connection((SINGLETON_HOST, PORT), timeout=1)]
+    local_path = local_socket_path()
+    if local_path and os.path.exists(local_path):
+        def connect_local():
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(1)
+            try:
+                s.connect(local_path)
+            except OSError:
+                s.close()
+                raise
+            return s
+        connectors.insert(0, connect_local)
+    for connect in connectors:
+        try:
+            with connect() as s:
+                s.sendall(payload)
+            return True
+        except Exception:
+            continue
+    return False
+
+# A second launch only hands over to the running instance, so it exits before
+# any of the GUI modules are imported
+if __name__ == "__main__" and notify_existing_instance(sys.argv[1:]):
+    sys.exit()
+
+
+class StartupProfile:
+    # Phase timings in the same layout as `python -X importtime`
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.stack = []
+        self.rows = []
+
+    def begin(self, name):
+        if self.enabled:
+            self.stack.append([name, time.perf_counter(), 0.0, len(self.rows)])
+            self.rows.append(None)
+
+    def end(self):
+        if not self.enabled or not self.stack:
+            return
+        name, started, children, row = self.stack.pop()
+        total = time.perf_counter() - started
+        self.rows[row] = (len(self.stack), name, total - children, total)
+        if self.stack:
+            self.stack[-1][2] += total
+
+    def phase(self, name):
+        profile = self
+
+        class Phase:
+            def __enter__(self):
+                profile.begin(name)
+
+            def __exit__(self, *exc):
+                profile.end()
+        return Phase()
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("startup time: self [us] | cumulative | phase", file=sys.stderr)
+        for depth, name, own, total in filter(None, self.rows):
+            print(f"startup time: {own * 1e6:9.0f} | {total * 1e6:10.0f} | {'  ' * depth}{name}", file=sys.stderr)
+        print(f"startup time: ready after {(time.perf_counter() - self.origin) * 1e3:.1f} ms", file=sys.stderr)
+
+
+STARTUP = StartupProfile("--profile-startup" in sys.argv or bool(os.environ.get("NOTEPD_PROFILE_STARTUP")))
+
+STARTUP.begin("imports")
+import codecs
+import fnmatch
+import functools
+import hashlib
+import io
+import json
+import queue
+import re
+import tempfile
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+import tkinter as tk
+from tkinter import font, ttk
+from pathlib import Path
+STARTUP.end()
+
+
+### ================= Configuration & Constants ================== ###
+
+APP_NAME = "Notepd"
+CONFIG_DIR = os.path.join(os.environ.get("APPDATA", os.path.expanduser("~")), APP_NAME)
+CONFIG_PATH = os.path.join(CONFIG_DIR, "config.json")
+
+
+LIGHTGRAY_BG = "#424242"
+MIDGRAY_BG = "#333333"
+DARKGRAY_BG = "#212121"
+LIGHT_TEXT = "#DEDEDE"
+BUTTON_ACTIVE = "#393939"
+GUTTER_TEXT = "#858585"
+
+LOAD_FIRST_CHUNK = 16 * 1024      # small first read so the first screen shows up right away
+LOAD_CHUNK_SIZE = 256 * 1024      # bytes read and decoded per worker step
+LOAD_QUEUE_DEPTH = 8              # decoded chunks buffered ahead of the UI
+LOAD_FRAME_BUDGET = 0.015         # seconds of inserting per UI tick
+LOAD_POLL_MS = 1
+
+LARGE_FILE_THRESHOLD_MB = 256     # files at least this big open in the read-only mmap viewer
+LARGE_INDEX_BLOCK = 1024 * 1024   # newline counts are kept per block of this many bytes
+LARGE_RENDER_LIMIT = 256 * 1024   # most bytes rendered into the widget at once
+LARGE_SEARCH_CHUNK = 4 * 1024 * 1024
+LARGE_SEARCH_OVERLAP = 4096
+
+WATCH_POLL_INTERVAL = 0.5         # seconds between stat polls when inotify is unavailable
+WATCH_SAFETY_INTERVAL = 5.0       # stat anyway this often even with inotify
+
+PIECE_MERGE_LIMIT = 4096          # inserted runs up to this long merge as more is typed after them
+PIECE_SLICE_MIN = 64 * 1024       # pieces left holding a quarter of a string this big get their own copy
+SNAPSHOT_CHUNK = 1024 * 1024      # characters per chunk when a snapshot is streamed out
+
+UNDO_LIMIT_MB = 32                # undo history kept per document before the oldest steps go
+UNDO_RECORD_COST = 96             # rough bytes per undo record on top of its text
+UNDO_DIFF_MIN = 4096              # replacements this long are stored as a line diff
+
+TAB_MEMORY_MB = 64                # characters kept in inactive tab widgets before the oldest are evicted
+TAB_TITLE_LIMIT = 28
+
+RELAYOUT_DELAY_MS = 150           # quiet period after zoom, font or wrap changes before the text is laid out again
+
+CONFIG_SAVE_DELAY_MS = 750        # quiet period before pending config changes are written
+IPC_BATCH_WINDOW = 0.05           # seconds to gather a burst of open requests into one batch
+
+SEARCH_SLICE = 1024 * 1024        # characters scanned per step of a background search
+SEARCH_DEBOUNCE_MS = 200
+VISIBLE_MATCH_LIMIT = 2000        # highlight-all tags at most this many hits per screen
+REGEX_TIME_BUDGET = 10.0          # seconds a regex scan may run before it is killed
+
+FILE_SEARCH_CHUNK = 4 * 1024 * 1024   # bytes read from a file per step of Find in Files
+FILE_SEARCH_SNIFF = 8192          # leading bytes checked for NUL to skip binaries
+FILE_SEARCH_OVERLAP = 64 * 1024   # longest match found across a cut in a very long line
+FILE_SEARCH_BATCH_FILES = 64      # files handed to a pool worker at once...
+FILE_SEARCH_BATCH_BYTES = 16 * 1024 * 1024  # ...or fewer once they add up to this
+FILE_SEARCH_INFLIGHT = 4          # batches queued per worker while the walk continues
+FILE_SEARCH_FILE_HITS = 1000      # lines listed per file
+FILE_SEARCH_MAX_HITS = 50000      # the search stops once the list holds this many
+FILE_SEARCH_PREVIEW = 200
+FILE_SEARCH_POLL_MS = 50
+FILE_SEARCH_EXCLUDE = ".git; .hg; .svn; node_modules; __pycache__; *.pyc"
+
+HIGHLIGHT_MARGIN = 40             # lines tokenized above and below the viewport
+HIGHLIGHT_STATE_SLICE = 2000      # lines re-lexed per idle step while carry-over state settles
+HIGHLIGHT_CLEAN_LIMIT = 20000     # remembered tagged lines before far-away ones are forgotten
+HIGHLIGHT_COLORS = {
+    "hl_keyword": "#569CD6",
+    "hl_string": "#CE9178",
+    "hl_comment": "#6A9955",
+    "hl_number": "#B5CEA8",
+    "hl_key": "#9CDCFE",
+    "hl_literal": "#C586C0",
+    "hl_section": "#DCDCAA",
+    "hl_error": "#F44747",
+    "hl_warning": "#D7BA7D",
+    "hl_info": "#4FC1FF",
+    "hl_debug": "#808080",
+}
+
+RECOVERY_DIR = os.path.join(CONFIG_DIR, "recovery")
+RECOVERY_FLUSH_MS = 300           # edits are batched this long before they reach the journal
+RECOVERY_COMPACT_BYTES = 1024 * 1024  # journals are never compacted below this size
+
+INSTRUMENT_PATH = os.path.join(CONFIG_DIR, "instrument.jsonl")
+INSTRUMENT_HEARTBEAT_MS = 50
+INSTRUMENT_STALL_MS = 250         # a heartbeat this late counts as a stall
+INSTRUMENT_SLOW_MS = 16           # handler calls at least this long are logged individually
+INSTRUMENT_LOG_BYTES = 2 * 1024 * 1024
+INSTRUMENT_LOG_BACKUPS = 3
+
+FONTS = [
+    "Arial", "Calibri", "Comic Sans", "Courier New", "Garamond",
+    "Georgia", "Helvetica", "Roboto", "Segoe UI", "Times New Roman", "Verdana"
+]
+
+
+### ====================== Instrumentation ======================= ###
+
+def callback_name(func):
+    func = getattr(func, "__func__", func)
+    name = getattr(func, "__qualname__", None) or repr(func)
+    code = getattr(func, "__code__", None)
+    if code is not None and name.endswith("<lambda>"):
+        name = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name
+
+
+class Instrumentation:
+    # Opt-in timing of every Python callback Tk calls (bindings, menu commands,
+    # after jobs) plus a heartbeat that catches mainloop stalls while they happen.
+    # Records go to a rotating JSON-lines file, written on a logging thread
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.running = []
+        self.stats = {}
+        self.last_beat = None
+        self.stall_logged = False
+        self.stopped = threading.Event()
+        self.local = threading.local()
+
+    def install(self, root):
+        if not self.enabled:
+            return
+        import logging
+        import logging.handlers
+        import traceback
+        self.traceback = traceback
+        try:
+            os.makedirs(CONFIG_DIR, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                INSTRUMENT_PATH, maxBytes=INSTRUMENT_LOG_BYTES, backupCount=INSTRUMENT_LOG_BACKUPS, encoding="utf-8")
+        except OSError as e:
+            print("Instrumentation disabled:", e)
+            self.enabled = False
+            return
+        records = queue.Queue()
+        self.listener = logging.handlers.QueueListener(records, handler)
+        self.listener.start()
+        self.logger = logging.getLogger("notepd.instrument")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(logging.handlers.QueueHandler(records))
+        self.root = root
+        self.main_thread = threading.main_thread().ident
+
+        register = tk.Misc._register
+        after = tk.Misc.after
+        instrument = self
+
+        def _register(widget, func, subst=None, needcleanup=1):
+            if not getattr(instrument.local, "in_after", False):
+                func = instrument.timed(func)
+            return register(widget, func, subst, needcleanup)
+
+        def _after(widget, ms, func=None, *args):
+            # after registers its own callit closure, which would hide the real
+            # callback's name; time func itself and leave callit alone
+            if func is not None and func != instrument._beat:
+                func = instrument.timed(func)
+            instrument.local.in_after = True
+            try:
+                return after(widget, ms, func, *args)
+            finally:
+                instrument.local.in_after = False
+        tk.Misc._register = _register
+        tk.Misc.after = _after
+
+        self.log("start", pid=os.getpid(), argv=sys.argv[1:])
+        self._beat()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def log(self, event, **fields):
+        fields["event"] = event
+        fields["ts"] = round(time.time(), 3)
+        self.logger.info(json.dumps(fields))
+
+    def timed(self, func):
+        name = callback_name(func)
+
+        def wrapper(*args):
+            self.running.append(name)
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                self.running.pop()
+                count, total, worst = self.stats.get(name, (0, 0.0, 0.0))
+                self.stats[name] = (count + 1, total + elapsed, max(worst, elapsed))
+                if elapsed >= INSTRUMENT_SLOW_MS:
+                    self.log("handler", name=name, ms=round(elapsed, 2), depth=len(self.running))
+        functools.update_wrapper(wrapper, func, updated=())
+        return wrapper
+
+    def _beat(self):
+        now = time.monotonic()
+        if self.last_beat is not None and self.stall_logged:
+            self.log("stall_end", ms=round((now - self.last_beat) * 1000, 1))
+        self.stall_logged = False
+        self.last_beat = now
+        if not self.stopped.is_set():
+            self.root.after(INSTRUMENT_HEARTBEAT_MS, self._beat)
+
+    def _watch(self):
+        # The heartbeat itself cannot run during a stall, so a watchdog thread grabs
+        # the main thread's stack while it is still stuck
+        while not self.stopped.wait(INSTRUMENT_STALL_MS / 4000):
+            late = (time.monotonic() - self.last_beat) * 1000 - INSTRUMENT_HEARTBEAT_MS
+            if late < INSTRUMENT_STALL_MS or self.stall_logged:
+                continue
+            self.stall_logged = True
+            frame = sys._current_frames().get(self.main_thread)
+            stack = self.traceback.format_stack(frame) if frame is not None else []
+            self.log("stall", ms=round(late, 1), handlers=list(self.running),
+                     stack=[line.rstrip() for line in stack])
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.stopped.set()
+        summary = sorted(self.stats.items(), key=lambda item: -item[1][1])
+        self.log("summary", handlers=[
+            {"name": name, "calls": count, "total_ms": round(total, 1), "max_ms": round(worst, 1)}
+            for name, (count, total, worst) in summary
+        ])
+        self.listener.stop()
+
+
+INSTRUMENT = Instrumentation("--instrument" in sys.argv or bool(os.environ.get("NOTEPD_INSTRUMENT")))
+
+
+### ===================== Background Loading ===================== ###
+
+def content_digest(text):
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+COMPRESSION_MAGIC = (("gzip", b"\x1f\x8b"), ("bz2", b"BZh"), ("xz", b"\xfd7zXZ\x00"))
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+
+def compression_of(head):
+    for name, magic in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def detect_compression(path):
+    # By magic bytes, so a renamed archive still opens as one
+    try:
+        with open(path, "rb") as file:
+            return compression_of(file.read(6))
+    except OSError:
+        return None
+
+
+def target_compression(path):
+    # An existing file keeps its format; a new one goes by its suffix
+    if os.path.exists(path):
+        return detect_compression(path)
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def open_compressed(file, compression, mode="rb", name=""):
+    # Wraps an open binary file and leaves it open when closed
+    if compression == "gzip":
+        import gzip
+        return gzip.GzipFile(filename=name, mode=mode, fileobj=file)
+    if compression == "bz2":
+        import bz2
+        return bz2.BZ2File(file, mode)
+    import lzma
+    return lzma.LZMAFile(file, mode)
+
+
+def compression_note(compression, packed, expanded):
+    mb = 1024 * 1024
+    return f"{compression}, {packed / mb:,.1f} MB on disk, {expanded / mb:,.1f} MB expanded"
+
+
+class ChunkedFileReader:
+    def __init__(self, path, encoding="utf-8", compression=None):
+        self.path = path
+        self.encoding = encoding
+        self.compression = compression
+        self.total = os.path.getsize(path)
+        self.read_bytes = 0
+        self.expanded = 0
+        self.stat = None
+        self.digest = hashlib.blake2b(digest_size=16)
+        self.chunks = queue.Queue(maxsize=LOAD_QUEUE_DEPTH)
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self):
+        if not self.total:
+            return 100
+        return min(100, self.read_bytes * 100 // self.total)
+
+    def _run(self):
+        # Same newline translation as open(..., "r"), but fed incrementally
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(self.encoding)(), translate=True)
+        try:
+            with open(self.path, "rb") as raw:
+                # Compressed files are expanded chunk by chunk; read_bytes still
+                # counts the bytes of the file itself
+                file = open_compressed(raw, self.compression) if self.compression else raw
+                size = LOAD_FIRST_CHUNK
+                while not self.cancelled.is_set():
+                    data = file.read(size)
+                    size = LOAD_CHUNK_SIZE
+                    text = decoder.decode(data, final=not data)
+                    self.read_bytes = raw.tell()
+                    self.expanded += len(data)
+                    if text:
+                        self.digest.update(text.encode("utf-8", "surrogatepass"))
+                        self._put(("data", text))
+                    if not data:
+                        break
+                self.stat = os.fstat(raw.fileno())
+            self._put(("done", None))
+        except Exception as e:
+            self._put(("error", e))
+
+    def _put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+### ===================== Background Saving ====================== ###
+
+# os.umask can only be read by setting it, so it is read once at import
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def atomic_write(path, text, encoding="utf-8", newline=None, compression=None):
+    # Saving through a symlink replaces the file it points to, not the link
+    path = os.path.realpath(path)
+    # Temp file in the target directory so the final rename never crosses filesystems
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".notepd-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            stream = open_compressed(raw, compression, "wb", Path(path).name) if compression else raw
+            file = io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+            # A TextSnapshot streams out in chunks instead of as one big string
+            file.writelines((text,) if isinstance(text, str) else text)
+            file.detach()
+            if stream is not raw:
+                # Writes the stream trailer without closing raw
+                stream.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        # mkstemp creates the file 0600; keep the old mode, or the usual one for a new file
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        try:
+            os.chmod(tmp_path, mode)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SaveSuperseded(Exception):
+    # Handed to on_done for a write that a newer snapshot replaced before it started
+    pass
+
+
+class DiskChanged(Exception):
+    # Handed to on_done instead of writing when the file no longer holds what
+    # the save expected to overwrite
+    pass
+
+
+class SaveEngine:
+    def __init__(self, on_done):
+        self.on_done = on_done
+        self.pending = {}
+        self.writing = None
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, path, text, token=None, on_done=None, compression=None, expect=None):
+        # A newer snapshot for the same path replaces one that has not been written yet.
+        # expect is (stat_key, digest) of the file as last seen; see disk_changed
+        with self.cond:
+            replaced = self.pending.get(path)
+            self.pending[path] = (text, token, on_done or self.on_done, compression, expect)
+            self.cond.notify_all()
+        if replaced is not None:
+            old_text, old_token, old_on_done, _, _ = replaced
+            old_on_done(path, old_text, old_token, SaveSuperseded())
+
+    def busy(self):
+        with self.cond:
+            return bool(self.pending) or self.writing is not None
+
+    def flush(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and self.writing is None, timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                path = next(iter(self.pending))
+                text, token, on_done, compression, expect = self.pending.pop(path)
+                self.writing = path
+            error = None
+            try:
+                if expect is not None and disk_changed(path, *expect):
+                    error = DiskChanged(path)
+                else:
+                    atomic_write(path, text, compression=compression)
+            except Exception as e:
+                error = e
+            with self.cond:
+                self.writing = None
+                self.cond.notify_all()
+            on_done(path, text, token, error)
+
+
+### ====================== Recovery Journal ====================== ###
+
+class RecoveryStore:
+    # Journals of the running session live in their own directory under
+    # RECOVERY_DIR, which a clean exit removes, so any session directory found at
+    # startup was left behind by a crash. All file work happens on one thread
+    def __init__(self):
+        self.directory = None
+        self.counter = 0
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job()
+            except (OSError, ValueError) as e:
+                print("Recovery journal:", e)
+            finally:
+                self.jobs.task_done()
+
+    def journal(self):
+        if self.directory is None:
+            os.makedirs(RECOVERY_DIR, exist_ok=True)
+            self.directory = tempfile.mkdtemp(prefix="session-", dir=RECOVERY_DIR)
+        self.counter += 1
+        return RecoveryJournal(self, os.path.join(self.directory, f"doc{self.counter}"))
+
+    def close(self):
+        self.jobs.join()
+        if self.directory is not None:
+            import shutil
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+class RecoveryJournal:
+    # One document's unsaved edits: a header line naming the base text, then one
+    # [offset, removed, text] record per edit. An edit costs its own size to log;
+    # the whole text is only written again once the log outgrows it (see
+    # Notepad.flush_journal). Records are buffered and written in batches
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path + ".log"
+        self.checkpoint_path = path + ".base"
+        self.generation = 0
+        self.pending = []
+        self.logged = 0
+
+    def begin(self, header, text=None):
+        # New generation based on the file named in the header, or on text
+        self.pending = []
+        self.logged = 0
+        self.generation += 1
+        generation = self.generation
+        header = dict(header, gen=generation, base="file" if text is None else "checkpoint")
+        line = json.dumps(header) + "\n"
+
+        def write():
+            # Checkpoint first: a log whose generation is older than the checkpoint
+            # is ignored when recovering, so a crash in between loses nothing
+            if text is not None:
+                atomic_write(self.checkpoint_path, [json.dumps({"gen": generation}) + "\n", *text], newline="")
+            atomic_write(self.path, line, newline="")
+        self.store.jobs.put(write)
+
+    def record(self, edit):
+        last = self.pending[-1] if self.pending else None
+        if last is not None and not edit.removed and not last[1] and edit.offset == last[0] + len(last[2]):
+            # Typing arrives one character at a time; keep a run as one record
+            last[2] += edit.text
+        elif last is not None and not edit.text and not last[2] and edit.offset + edit.removed == last[0]:
+            last[0] = edit.offset
+            last[1] += edit.removed
+        else:
+            self.pending.append([edit.offset, edit.removed, edit.text])
+
+    def flush(self):
+        if not self.pending:
+            return
+        data = "".join(json.dumps(record) + "\n" for record in self.pending)
+        self.pending = []
+        self.logged += len(data)
+        path = self.path
+
+        def append():
+            with open(path, "a", encoding="ascii", newline="") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+        self.store.jobs.put(append)
+
+    def discard(self):
+        self.pending = []
+        paths = (self.path, self.checkpoint_path)
+
+        def remove():
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        self.store.jobs.put(remove)
+
+
+def find_recovery():
+    # Journals from session directories left behind by a run that did not exit cleanly
+    journals = []
+    try:
+        sessions = sorted(os.listdir(RECOVERY_DIR))
+    except OSError:
+        return [], []
+    sessions = [os.path.join(RECOVERY_DIR, name) for name in sessions if name.startswith("session-")]
+    for session in sessions:
+        try:
+            names = sorted(os.listdir(session), key=lambda name: (len(name), name))
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith(".log"):
+                try:
+                    journals.append(read_journal(os.path.join(session, name)))
+                except (OSError, ValueError):
+                    pass
+    return sessions, journals
+
+
+def read_journal(path):
+    # (path, header, records); records stop at the first line a crash cut short
+    with open(path, "r", encoding="ascii", newline="") as file:
+        header = json.loads(file.readline())
+        records = []
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return path, header, records
+
+
+def journal_base(path, header):
+    # The text the records apply to, or None when it can no longer be recovered
+    if header.get("base") == "checkpoint":
+        with open(path[:-len(".log")] + ".base", "r", encoding="utf-8", newline="") as file:
+            checkpoint = json.loads(file.readline())
+            text = file.read()
+        return text if checkpoint.get("gen") == header.get("gen") else None
+    try:
+        text, _ = read_text_snapshot(header["filename"])
+    except (OSError, UnicodeDecodeError, KeyError, TypeError):
+        return None
+    # Saving appends a final newline that the buffer itself does not have
+    for candidate in (text, text[:-1] if text.endswith("\n") else None):
+        if candidate is not None and content_digest(candidate) == header.get("digest"):
+            return candidate
+    return None
+
+
+def replay_journal(base, records):
+    # Records hold character offsets, so they are applied to a PieceTable
+    # rather than through widget indices
+    buffer = PieceTable(base)
+    for offset, removed, chunk in records:
+        if removed:
+            buffer.delete(offset, removed)
+        if chunk:
+            buffer.insert(offset, chunk)
+    return buffer.text()
+
+
+### ====================== Large File Mode ======================= ###
+
+class MappedDocument:
+    # A read-only file mapped with mmap. The line index only stores a newline
+    # count per LARGE_INDEX_BLOCK bytes, so memory stays flat for any file size
+    def __init__(self, path):
+        import mmap
+        from array import array
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.block_lines = array("q")
+        self.total_lines = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._build_index, daemon=True)
+
+    def start_indexing(self):
+        self.thread.start()
+
+    def close(self):
+        self.cancelled.set()
+        if self.thread.is_alive():
+            self.thread.join(1)
+        self.map.close()
+        self.file.close()
+
+    def _build_index(self):
+        lines = 0
+        try:
+            for start in range(0, self.size, LARGE_INDEX_BLOCK):
+                if self.cancelled.is_set():
+                    return
+                self.block_lines.append(lines)
+                lines += self.map[start:start + LARGE_INDEX_BLOCK].count(b"\n")
+        except ValueError:
+            return
+        self.total_lines = lines + 1
+
+    def progress(self):
+        if not self.size:
+            return 100
+        return min(100, len(self.block_lines) * LARGE_INDEX_BLOCK * 100 // self.size)
+
+    def line_number(self, offset):
+        block = offset // LARGE_INDEX_BLOCK
+        if block >= len(self.block_lines):
+            return None
+        return self.block_lines[block] + self.map[block * LARGE_INDEX_BLOCK:offset].count(b"\n") + 1
+
+    def line_start(self, offset):
+        offset = max(0, min(offset, self.size))
+        lower = max(0, offset - LARGE_RENDER_LIMIT)
+        newline = self.map.rfind(b"\n", lower, offset)
+        return newline + 1 if newline >= 0 else lower
+
+    def next_lines(self, offset, count):
+        for _ in range(count):
+            newline = self.map.find(b"\n", offset, min(self.size, offset + LARGE_RENDER_LIMIT))
+            if newline < 0:
+                return min(self.size, offset + LARGE_RENDER_LIMIT) if offset < self.size else self.size
+            offset = newline + 1
+        return offset
+
+    def previous_lines(self, offset, count):
+        for _ in range(count):
+            if offset <= 0:
+                return 0
+            offset = self.line_start(offset - 1)
+        return offset
+
+    def read_window(self, top, count):
+        # Returns the byte offset of each rendered line start and the decoded text
+        starts = [top]
+        offset = top
+        for _ in range(count - 1):
+            offset = self.next_lines(offset, 1)
+            if offset >= self.size or offset - top >= LARGE_RENDER_LIMIT:
+                break
+            starts.append(offset)
+        end = min(self.next_lines(starts[-1], 1), top + LARGE_RENDER_LIMIT)
+        text = self.decode(top, end)
+        if text.endswith("\n"):
+            text = text[:-1]
+        return starts, end, text
+
+    def decode(self, start, end):
+        return self.map[start:end].decode("utf-8", "replace").replace("\r\n", "\n")
+
+    def find(self, pattern, start, backwards, wrap, cancelled):
+        spans = [(start, self.size), (0, start)] if not backwards else [(0, start), (start, self.size)]
+        if not wrap:
+            spans = spans[:1]
+        for lower, upper in spans:
+            match = self._find_in(pattern, lower, upper, backwards, cancelled)
+            if match or cancelled.is_set():
+                return match
+        return None
+
+    def _find_in(self, pattern, lower, upper, backwards, cancelled):
+        chunks = range(lower, upper, LARGE_SEARCH_CHUNK)
+        for chunk in (reversed(chunks) if backwards else chunks):
+            if cancelled.is_set():
+                return None
+            stop = min(upper, chunk + LARGE_SEARCH_CHUNK)
+            found = None
+            for m in pattern.finditer(self.map, chunk, min(self.size, stop + LARGE_SEARCH_OVERLAP)):
+                if m.start() >= stop:
+                    break
+                if m.end() > m.start():
+                    found = (m.start(), m.end())
+                    if not backwards:
+                        return found
+            if found:
+                return found
+        return None
+
+
+def _large_find_worker(conn, path, source, flags, start, backwards, wrap):
+    # Runs in a child process: re holds the GIL for a whole match, so only
+    # killing the process stops a runaway pattern
+    try:
+        view = MappedDocument(path)
+        try:
+            match = view.find(compile_pattern(source, flags), start, backwards, wrap, threading.Event())
+        finally:
+            view.close()
+        conn.send(("ok", match))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def find_isolated(path, source, flags, start, backwards, wrap, cancelled):
+    # MappedDocument.find in a child process; returns ("ok", match) or
+    # ("error", reason), or None once cancelled is set
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_large_find_worker,
+                              args=(sender, path, source, flags, start, backwards, wrap), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        while not cancelled.is_set():
+            if receiver.poll(0.05):
+                return receiver.recv()
+            if not process.is_alive() and not receiver.poll():
+                return ("error", "Pattern search failed")
+        return None
+    except (EOFError, OSError):
+        return ("error", "Pattern search failed")
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.terminate()
+        process.join(1)
+
+
+### ======================= File Watching ======================== ###
+
+def file_identity(st):
+    return (st.st_dev, st.st_ino)
+
+
+def stat_key(st):
+    return (st.st_size, st.st_mtime_ns, file_identity(st))
+
+
+def read_text_snapshot(path, encoding="utf-8"):
+    # Whole file decoded the way ChunkedFileReader does it, with the stat it was read under
+    with open(path, "rb") as file:
+        st = os.fstat(file.fileno())
+        compression = compression_of(file.read(6))
+        file.seek(0)
+        if compression is None:
+            data = file.read()
+        else:
+            try:
+                with open_compressed(file, compression) as stream:
+                    data = stream.read()
+            except OSError:
+                raise
+            except Exception as e:
+                # Truncated or corrupt streams raise EOFError, zlib.error or LZMAError
+                raise OSError(f"damaged {compression} data ({e})") from e
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+    return decoder.decode(data, final=True), st
+
+
+def disk_changed(path, key, digest):
+    # Whether path no longer holds the text hashed as digest. Only a changed stat
+    # costs a read, and a touch or an identical rewrite does not count
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if stat_key(st) == key:
+        return False
+    try:
+        text, _ = read_text_snapshot(path)
+    except (OSError, UnicodeDecodeError):
+        return True
+    return content_digest(text) != digest
+
+
+def split_lines(text):
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def line_changes(old, new):
+    # Line-level diff of old into new as (start, stop, replacement) text indices,
+    # last region first so applying them in order keeps earlier indices valid
+    import difflib
+    a, b = split_lines(old), split_lines(new)
+    start = 0
+    limit = min(len(a), len(b))
+    while start < limit and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    matcher = difflib.SequenceMatcher(None, a[start:end_a], b[start:end_b], autojunk=False)
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        i1, i2 = start + i1, start + i2
+        stop = f"{i2 + 1}.0" if i2 < len(a) else "end-1c"
+        changes.append((f"{i1 + 1}.0", stop, "".join(b[start + j1:start + j2])))
+    changes.reverse()
+    return changes
+
+
+def _open_inotify(directory):
+    # Raw inotify through ctypes; returns a non-blocking fd or None
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    # Calls on_change(stat or None) on a worker thread whenever the size, mtime or
+    # identity of path changes. inotify on the parent directory wakes it up where
+    # available (so renames and re-creation are seen); otherwise it polls os.stat
+    def __init__(self, path, on_change):
+        self.path = path
+        self.on_change = on_change
+        self.stopped = threading.Event()
+        self.last = self._key()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _key(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None, None
+        return stat_key(st), st
+
+    def _run(self):
+        import select
+        fd = _open_inotify(os.path.dirname(os.path.abspath(self.path)))
+        try:
+            while not self.stopped.is_set():
+                if fd is None:
+                    self.stopped.wait(WATCH_POLL_INTERVAL)
+                else:
+                    ready, _, _ = select.select([fd], [], [], WATCH_SAFETY_INTERVAL)
+                    if ready:
+                        try:
+                            while os.read(fd, 65536):
+                                pass
+                        except BlockingIOError:
+                            pass
+                if self.stopped.is_set():
+                    break
+                key, st = self._key()
+                if key != self.last[0]:
+                    self.last = key, st
+                    self.on_change(st)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+
+class FileFollower:
+    # Tails a file from a byte offset: new bytes are decoded and handed to
+    # on_text, truncation and rotation restart from offset 0 of the current file
+    def __init__(self, path, offset, identity, on_text, on_reset):
+        self.path = path
+        self.offset = offset
+        self.identity = identity
+        self.on_text = on_text
+        self.on_reset = on_reset
+        self.lock = threading.Lock()
+        self.suspended = 0
+        self.decoder = self._new_decoder()
+        self.watcher = FileWatcher(path, self._changed)
+
+    def _new_decoder(self):
+        return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")("replace"), translate=True)
+
+    def start(self):
+        self.watcher.start()
+        # Catch up on anything appended between loading and following
+        threading.Thread(target=self._changed, args=(None,), daemon=True).start()
+
+    def stop(self):
+        self.watcher.stop()
+
+    def suspend(self):
+        # Our own save is about to replace the file, which would look like a rotation
+        with self.lock:
+            self.suspended += 1
+
+    def resume(self, st=None):
+        # st is the file the save wrote; following continues from its end
+        with self.lock:
+            self.suspended -= 1
+            if st is not None:
+                self.offset = st.st_size
+                self.identity = file_identity(st)
+                self.decoder = self._new_decoder()
+
+    def _changed(self, st):
+        with self.lock:
+            if self.suspended:
+                return
+            try:
+                with open(self.path, "rb") as file:
+                    st = os.fstat(file.fileno())
+                    if file_identity(st) != self.identity:
+                        self._reset("rotated", file_identity(st))
+                    elif st.st_size < self.offset:
+                        self._reset("truncated", self.identity)
+                    file.seek(self.offset)
+                    while not self.watcher.stopped.is_set():
+                        data = file.read(LOAD_CHUNK_SIZE)
+                        if not data:
+                            break
+                        self.offset += len(data)
+                        text = self.decoder.decode(data)
+                        if text:
+                            self.on_text(text)
+            except OSError:
+                # Missing for a moment during rotation; the next event picks it up
+                pass
+
+    def _reset(self, reason, identity):
+        self.offset = 0
+        self.identity = identity
+        self.decoder = self._new_decoder()
+        self.on_reset(reason)
+
+
+### ==================== Configuration Store ===================== ###
+
+class ConfigStore:
+    # Settings live in memory; changes are collapsed into one delayed, atomic
+    # write on the save engine's writer thread
+    def __init__(self, path, root, save_engine):
+        self.path = path
+        self.root = root
+        self.save_engine = save_engine
+        self.data = {}
+        self.dirty = False
+        self._job = None
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.data = data
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print("Could not read config, using defaults:", e)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def update(self, **changes):
+        if all(self.data.get(key) == value for key, value in changes.items()):
+            return
+        self.data.update(changes)
+        self.dirty = True
+        if self._job:
+            self.root.after_cancel(self._job)
+        self._job = self.root.after(CONFIG_SAVE_DELAY_MS, self.flush)
+
+    def flush(self):
+        if self._job:
+            self.root.after_cancel(self._job)
+            self._job = None
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        except OSError:
+            pass
+        self.save_engine.submit(self.path, json.dumps(self.data), on_done=self._written)
+
+    def _written(self, path, text, token, error):
+        if error is not None and not isinstance(error, SaveSuperseded):
+            print("Could not save config:", error)
+
+
+### ======================= Text Tracking ======================== ###
+
+# Tk 8.6 stores text as UTF-16 and counts each of these as two index columns
+WIDE_CHAR = re.compile("[\U00010000-\U0010ffff]")
+
+
+def tk_column(text, col):
+    # The Tk 8.6 column of Python column col in line text
+    return col + len(WIDE_CHAR.findall(text, 0, col))
+
+
+class Fenwick:
+    def __init__(self, values):
+        self.n = len(values)
+        tree = [0] + list(values)
+        for i in range(1, self.n + 1):
+            parent = i + (i & -i)
+            if parent <= self.n:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def search(self, target):
+        # Returns (k, prefix(k)) for the slot k whose range covers target
+        pos = 0
+        remaining = target
+        bit = 1 << (self.n.bit_length() - 1) if self.n else 0
+        while bit:
+            nxt = pos + bit
+            if nxt <= self.n and self.tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self.tree[nxt]
+            bit >>= 1
+        return pos, target - remaining
+
+
+class LineIndex:
+    # Line lengths (without the newline) kept in blocks, with Fenwick trees over
+    # the per-block line and character totals for O(log n) offset lookups
+    BLOCK = 512
+
+    def __init__(self, text=""):
+        self.reset(text)
+
+    def reset(self, text=""):
+        # wide: the text may contain characters Tk counts as two columns
+        self.wide = WIDE_CHAR.search(text) is not None
+        self._set_lengths([len(line) for line in text.split("\n")])
+
+    def _set_lengths(self, lengths):
+        size = self.BLOCK
+        self.blocks = [lengths[i:i + size] for i in range(0, len(lengths), size)]
+        self.lines = len(lengths)
+        self._reindex()
+
+    def _reindex(self):
+        self.line_tree = Fenwick([len(block) for block in self.blocks])
+        self.char_tree = Fenwick([sum(block) + len(block) for block in self.blocks])
+
+    def _locate(self, line):
+        k, before = self.line_tree.search(line - 1)
+        return k, line - 1 - before
+
+    def char_count(self):
+        return self.char_tree.prefix(len(self.blocks)) - 1
+
+    def line_length(self, line):
+        k, j = self._locate(max(1, min(line, self.lines)))
+        return self.blocks[k][j]
+
+    def offset(self, line, col):
+        line = max(1, min(line, self.lines))
+        k, j = self._locate(line)
+        block = self.blocks[k]
+        return self.char_tree.prefix(k) + sum(block[:j]) + j + min(col, block[j])
+
+    def position(self, offset):
+        offset = max(0, min(offset, self.char_count()))
+        k, before = self.char_tree.search(offset)
+        remaining = offset - before
+        line = self.line_tree.prefix(k) + 1
+        for length in self.blocks[k]:
+            if remaining <= length:
+                return line, remaining
+            remaining -= length + 1
+            line += 1
+        return self.lines, self.line_length(self.lines)
+
+    def apply_insert(self, line, col, text):
+        if not self.wide:
+            self.wide = WIDE_CHAR.search(text) is not None
+        length = self.line_length(line)
+        parts = text.split("\n")
+        if len(parts) == 1:
+            self._replace_lines(line, 1, [length + len(text)])
+            return
+        lengths = [col + len(parts[0])]
+        lengths.extend(len(part) for part in parts[1:-1])
+        lengths.append(len(parts[-1]) + length - col)
+        self._replace_lines(line, 1, lengths)
+
+    def apply_delete(self, line, col, end_line, end_col):
+        self._replace_lines(line, end_line - line + 1, [col + self.line_length(end_line) - end_col])
+
+    def _replace_lines(self, line, count, lengths):
+        if line == 1 and count >= self.lines:
+            self._set_lengths(list(lengths))
+            return
+        k, j = self._locate(line)
+        block = self.blocks[k]
+        self.lines += len(lengths) - count
+        if j + count <= len(block):
+            removed = sum(block[j:j + count]) + count
+            block[j:j + count] = lengths
+            if len(block) > 2 * self.BLOCK or (len(block) < self.BLOCK // 4 and len(self.blocks) > 1):
+                self._rechunk(max(0, k - 1), k + 1)
+            else:
+                self.line_tree.add(k, len(lengths) - count)
+                self.char_tree.add(k, sum(lengths) + len(lengths) - removed)
+            return
+        end_k, _ = self._locate(line + count - 1)
+        merged = [length for part in self.blocks[k:end_k + 1] for length in part]
+        merged[j:j + count] = lengths
+        self.blocks[k:end_k + 1] = [merged]
+        self._rechunk(k, k + 1)
+
+    def _rechunk(self, start, stop):
+        size = self.BLOCK
+        merged = [length for part in self.blocks[start:stop] for length in part]
+        self.blocks[start:stop] = [merged[i:i + size] for i in range(0, len(merged), size)]
+        self._reindex()
+
+
+# A replacement of `removed` characters at `offset` by `text`; plain inserts and
+# deletes are the cases where one of the two is empty
+TextEdit = namedtuple("TextEdit", "offset removed text line col end_line end_col deleted", defaults=(None,))
+
+
+class TextSnapshot:
+    # The document at one moment, as the piece list of a PieceTable. The strings
+    # it points into are never modified, so any thread can read it while the
+    # widget keeps changing
+    def __init__(self, pieces, length):
+        self.pieces = pieces
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return self.chunks()
+
+    def chunks(self, stop=None, size=SNAPSHOT_CHUNK):
+        remaining = self.length if stop is None else min(stop, self.length)
+        for source, start, length in self.pieces:
+            length = min(length, remaining)
+            for i in range(start, start + length, size):
+                yield source[i:min(i + size, start + length)]
+            remaining -= length
+            if remaining <= 0:
+                return
+
+    def text(self):
+        if len(self.pieces) == 1:
+            source, start, length = self.pieces[0]
+            if start == 0 and length == len(source):
+                return source
+        return "".join(self.chunks())
+
+    def digest(self, stop=None):
+        # content_digest of text()[:stop] without building the string
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in self.chunks(stop):
+            digest.update(chunk.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+
+class PieceTable:
+    # Headless copy of the widget's text: (source, start, length) pieces over
+    # immutable strings, the loaded chunks and every inserted run, plus the
+    # LineIndex over the same text. An edit splits at most one piece, so a
+    # snapshot costs a copy of the piece list rather than of the text. Pieces
+    # are kept in blocks with a Fenwick tree over block lengths, like LineIndex
+    BLOCK = 256
+
+    def __init__(self, text=""):
+        self.lines = LineIndex()
+        self.reset(text)
+
+    def reset(self, text=""):
+        self.lines.reset(text)
+        self._set_pieces([(text, 0, len(text))] if text else [])
+
+    def _set_pieces(self, pieces):
+        size = self.BLOCK
+        self.blocks = [pieces[i:i + size] for i in range(0, len(pieces), size)] or [[]]
+        self.length = sum(piece[2] for piece in pieces)
+        self._reindex()
+
+    def _reindex(self):
+        self.tree = Fenwick([sum(piece[2] for piece in block) for block in self.blocks])
+
+    def __len__(self):
+        return self.length
+
+    def piece_count(self):
+        return sum(len(block) for block in self.blocks)
+
+    def snapshot(self, tail=""):
+        # tail is appended the way Tk's "end" index adds a final newline
+        pieces = [piece for block in self.blocks for piece in block]
+        if tail:
+            pieces.append((tail, 0, len(tail)))
+        return TextSnapshot(pieces, self.length + len(tail))
+
+    def text(self):
+        return self.snapshot().text()
+
+    def insert(self, offset, text):
+        line, col = self.lines.position(offset)
+        self.apply(TextEdit(offset, 0, text, line, col, line, col))
+
+    def delete(self, offset, length):
+        line, col = self.lines.position(offset)
+        end_line, end_col = self.lines.position(offset + length)
+        self.apply(TextEdit(offset, length, "", line, col, end_line, end_col))
+
+    def apply(self, edit):
+        if edit.removed:
+            self.lines.apply_delete(edit.line, edit.col, edit.end_line, edit.end_col)
+        if edit.text:
+            self.lines.apply_insert(edit.line, edit.col, edit.text)
+        self._splice(edit.offset, edit.removed, edit.text)
+
+    def _block_at(self, offset):
+        k, before = self.tree.search(offset)
+        if k >= len(self.blocks):
+            k = len(self.blocks) - 1
+            before = self.tree.prefix(k)
+        return k, before
+
+    def _splice(self, offset, removed, text):
+        k, before = self._block_at(offset)
+        end_k = self._block_at(offset + removed)[0] if removed else k
+        pieces = [piece for block in self.blocks[k:end_k + 1] for piece in block]
+        local = offset - before
+        stop = local + removed
+        out = []
+        pos = 0
+        placed = not text
+        for piece in pieces:
+            source, start, length = piece
+            a, b = pos, pos + length
+            pos = b
+            if b <= local or (a >= stop and placed):
+                out.append(piece)
+                continue
+            if a < local:
+                out.append(self._fragment(source, start, local - a))
+            if not placed:
+                self._place(out, text)
+                placed = True
+            if b > stop:
+                cut = max(stop, a)
+                out.append(self._fragment(source, start + cut - a, b - cut))
+        if not placed:
+            self._place(out, text)
+        self.length += len(text) - removed
+        if len(out) > 2 * self.BLOCK or not out or end_k != k:
+            size = self.BLOCK
+            self.blocks[k:end_k + 1] = [out[i:i + size] for i in range(0, len(out), size)]
+            if not self.blocks:
+                self.blocks = [[]]
+            self._reindex()
+        else:
+            self.blocks[k] = out
+            self.tree.add(k, len(text) - removed)
+
+    def _place(self, out, text):
+        last = out[-1] if out else None
+        if last is not None and last[1] == 0 and last[2] == len(last[0]) and last[2] + len(text) <= PIECE_MERGE_LIMIT:
+            # Typing lands right after the text it just typed; keep one piece
+            merged = last[0] + text
+            out[-1] = (merged, 0, len(merged))
+        else:
+            out.append((text, 0, len(text)))
+
+    def _fragment(self, source, start, length):
+        # A small remainder of a big string would keep all of it alive
+        if len(source) > PIECE_SLICE_MIN and length * 4 < len(source):
+            return (source[start:start + length], 0, length)
+        return (source, start, length)
+
+
+def common_affix(a, b):
+    # Lengths of the shared prefix and suffix, bisecting on slice compares so
+    # the scan runs in C
+    limit = min(len(a), len(b))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+
+def diff_records(offset, old, new):
+    # A replacement of old by new as records holding only what differs
+    prefix, suffix = common_affix(old, new)
+    old = old[prefix:len(old) - suffix]
+    new = new[prefix:len(new) - suffix]
+    offset += prefix
+    if len(old) < UNDO_DIFF_MIN or len(new) < UNDO_DIFF_MIN:
+        return [[offset, old, new]]
+    import difflib
+    a, b = old.splitlines(True), new.splitlines(True)
+    records = []
+    # Records apply in order, so each offset is into text already changed above it
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        chunk = "".join(b[j1:j2])
+        if tag != "equal":
+            records.append([offset, "".join(a[i1:i2]), chunk])
+        offset += len(chunk)
+    return records
+
+
+class UndoHistory:
+    # Stands in for Tk's undo stack, which keeps every step for the life of the
+    # widget. A step is a list of [offset, deleted, inserted] records applied in
+    # order. Typing and backspace runs merge into one record, replacements keep
+    # only what differs, and the oldest steps go once their estimated size
+    # passes the limit
+    def __init__(self, limit):
+        self.limit = limit
+        self.enabled = True
+        self.autoseparators = True
+        self.undo = deque()
+        self.redo = []
+        self.cost = 0           # sealed steps on both stacks, as (records, cost)
+        self.open = None        # step being recorded
+        self.open_cost = 0
+        self.overflow = False
+        self.applying = False
+
+    def wants(self, removed):
+        # Whether deleted text is worth capturing for this edit
+        return self.enabled and not self.applying and not self.overflow and removed <= self.limit
+
+    def reset(self):
+        self.undo.clear()
+        self.redo.clear()
+        self.cost = 0
+        self.open = None
+        self.open_cost = 0
+        self.overflow = False
+
+    def record(self, edit):
+        if not self.enabled or self.applying:
+            return
+        if self.redo:
+            self.cost -= sum(cost for _, cost in self.redo)
+            self.redo.clear()
+        if self.overflow:
+            if not self.autoseparators:
+                return
+            # The step that did not fit is over; history starts again from here
+            self.overflow = False
+        if edit.removed and edit.deleted is None:
+            self._overflow()
+            return
+        deleted = edit.deleted or ""
+        if not (self.open and self._merge(edit.offset, deleted, edit.text)):
+            if self.open and self.autoseparators:
+                self.seal()
+            if self.open is None:
+                self.open = []
+            self.open.append([edit.offset, deleted, edit.text])
+            self.open_cost += UNDO_RECORD_COST
+        self.open_cost += len(deleted) + len(edit.text)
+        self._trim()
+
+    def _merge(self, offset, deleted, inserted):
+        last = self.open[-1]
+        if deleted and inserted:
+            return False
+        if inserted:
+            if last[0] + len(last[2]) != offset:
+                return False
+            if self.autoseparators and (not last[2] or last[2].endswith("\n")):
+                # Each typed line is its own step, and so is a delete before typing
+                return False
+            last[2] += inserted
+            return True
+        if last[2]:
+            return False
+        if offset + len(deleted) == last[0]:
+            # Backspace
+            last[0] = offset
+            last[1] = deleted + last[1]
+            return True
+        if offset == last[0]:
+            # Forward delete
+            last[1] += deleted
+            return True
+        return False
+
+    def seal(self):
+        # Closes the open step, which is what Tk's edit separator does
+        self.overflow = False
+        if not self.open:
+            self.open = None
+            return
+        records = []
+        for offset, deleted, inserted in self.open:
+            if deleted and inserted:
+                records.extend(diff_records(offset, deleted, inserted))
+            else:
+                records.append([offset, deleted, inserted])
+        cost = sum(len(deleted) + len(inserted) + UNDO_RECORD_COST for _, deleted, inserted in records)
+        self.undo.append((records, cost))
+        self.cost += cost
+        self.open = None
+        self.open_cost = 0
+        self._trim()
+
+    def _trim(self):
+        while self.cost + self.open_cost > self.limit and self.undo:
+            _, cost = self.undo.popleft()
+            self.cost -= cost
+        if self.open_cost > self.limit:
+            self._overflow()
+
+    def _overflow(self):
+        # A step bigger than the whole budget is not kept, and nothing older can
+        # be undone past it
+        self.reset()
+        self.overflow = True
+
+    def take(self, redo):
+        # Records that undo (or redo) the latest step, moving it to the other stack
+        self.seal()
+        stack, other = (self.redo, self.undo) if redo else (self.undo, self.redo)
+        if not stack:
+            return None
+        step = stack.pop()
+        other.append(step)
+        if redo:
+            return step[0]
+        return [(offset, inserted, deleted) for offset, deleted, inserted in reversed(step[0])]
+
+
+class TrackedText(tk.Text):
+    # Routes the widget command through Python so every insert/delete, including
+    # the ones made by Tk's own bindings and undo, keeps the line index current.
+    # Undo is answered from an UndoHistory; Tk's own stack stays off
+    HISTORY_COMMANDS = ("undo", "redo", "reset", "separator", "canundo", "canredo")
+
+    def __init__(self, master=None, undo_limit=UNDO_LIMIT_MB * 1024 * 1024, **kw):
+        self.history = UndoHistory(undo_limit)
+        self.history.enabled = bool(kw.pop("undo", False))
+        self.history.autoseparators = bool(kw.pop("autoseparators", True))
+        super().__init__(master, undo=False, **kw)
+        # Columns and offsets on the Python side count characters; Tk 8.6 counts
+        # UTF-16 units, see index_at and _position
+        self.surrogates = self.tk.call("string", "length", "\U0001F600") == 2
+        self.buffer = PieceTable()
+        self.line_index = self.buffer.lines
+        self.edit_listeners = []
+        self._orig = self._w + "_orig"
+        self.tk.call("rename", self._w, self._orig)
+        self.tk.createcommand(self._w, self._dispatch)
+
+    def destroy(self):
+        super().destroy()
+        try:
+            self.tk.deletecommand(self._w)
+        except tk.TclError:
+            pass
+
+    def add_edit_listener(self, listener):
+        self.edit_listeners.append(listener)
+
+    def _dispatch(self, *args):
+        if len(args) > 1:
+            if args[0] == "edit" and args[1] in self.HISTORY_COMMANDS:
+                return self._history_command(args[1])
+            if args[0] == "cget" and args[1] in ("-undo", "-autoseparators"):
+                return int(self.history.enabled if args[1] == "-undo" else self.history.autoseparators)
+            if args[0] in ("configure", "config") and len(args) % 2 == 1:
+                args = self._history_options(args)
+                if len(args) == 1:
+                    return ""
+        edit = None
+        if args and args[0] in ("insert", "delete", "replace"):
+            try:
+                edit = self._describe(args)
+            except tk.TclError:
+                edit = None
+        result = self.tk.call((self._orig,) + args)
+        if edit is not None:
+            self.buffer.apply(edit)
+            self.history.record(edit)
+            for listener in self.edit_listeners:
+                listener(edit)
+        return result
+
+    def _history_options(self, args):
+        rest = [args[0]]
+        for option, value in zip(args[1::2], args[2::2]):
+            if option == "-undo":
+                self.history.enabled = self.tk.getboolean(value)
+            elif option == "-autoseparators":
+                self.history.autoseparators = self.tk.getboolean(value)
+            else:
+                rest += [option, value]
+        return tuple(rest)
+
+    def _history_command(self, command):
+        history = self.history
+        if command == "reset":
+            history.reset()
+        elif command == "separator":
+            history.seal()
+        elif command == "canundo":
+            return int(bool(history.undo or history.open))
+        elif command == "canredo":
+            return int(bool(history.redo))
+        else:
+            records = history.take(command == "redo")
+            if not records:
+                return ""
+            history.applying = True
+            try:
+                for offset, old, new in records:
+                    start = self.index_of(offset)
+                    if old:
+                        self.delete(start, self.index_of(offset + len(old)))
+                    if new:
+                        self.insert(start, new)
+            finally:
+                history.applying = False
+            self.mark_set("insert", self.index_of(offset + len(new)))
+            self.see("insert")
+        return ""
+
+    def _wide(self):
+        return self.surrogates and self.line_index.wide
+
+    def _position(self, index):
+        # Tk index to (line, column) in characters
+        line, col = map(int, self.tk.call(self._orig, "index", index).split("."))
+        if line > self.line_index.lines:
+            # "end" sits after the widget's trailing newline, which cannot be edited
+            line = self.line_index.lines
+            return line, self.line_index.line_length(line)
+        if col and self._wide():
+            col = len(self.tk.call(self._orig, "get", f"{line}.0", f"{line}.{col}"))
+        return line, col
+
+    def index_at(self, line, col):
+        # (line, column) in characters to a Tk index
+        if col and self._wide():
+            col = tk_column(self.tk.call(self._orig, "get", f"{line}.0", f"{line}.0 + {2 * col} chars"), col)
+        return f"{line}.{col}"
+
+    def _describe(self, args):
+        if self.tk.call(self._orig, "cget", "-state") == "disabled":
+            return None
+        command = args[0]
+        if command == "insert":
+            text = "".join(args[2::2])
+            if not text:
+                return None
+            line, col = self._position(args[1])
+            return TextEdit(self.line_index.offset(line, col), 0, text, line, col, line, col)
+        if command == "delete" and len(args) > 3:
+            raise tk.TclError("multi-range delete is passed through untracked")
+        if command == "replace":
+            text = "".join(args[3::2])
+        else:
+            text = ""
+        line, col = self._position(args[1])
+        end_line, end_col = self._position(args[2] if len(args) > 2 else f"{args[1]} +1c")
+        start = self.line_index.offset(line, col)
+        removed = self.line_index.offset(end_line, end_col) - start
+        if removed <= 0:
+            if not text:
+                return None
+            return TextEdit(start, 0, text, line, col, line, col)
+        deleted = None
+        if self.history.wants(removed):
+            deleted = self.tk.call(self._orig, "get", self.index_at(line, col), self.index_at(end_line, end_col))
+        return TextEdit(start, removed, text, line, col, end_line, end_col, deleted)
+
+    def offset_of(self, index):
+        line, col = self._position(index)
+        return self.line_index.offset(line, col)
+
+    def index_of(self, offset):
+        return self.index_at(*self.line_index.position(offset))
+
+    def snapshot(self, tail=""):
+        return self.buffer.snapshot(tail)
+
+    def verify_index(self):
+        # Cheap consistency check; rebuilds the index if anything slipped past the proxy
+        last_line = int(self.tk.call(self._orig, "index", "end-1c").split(".")[0])
+        insert_line, line_end = self._position("insert lineend")
+        if last_line != self.line_index.lines or line_end != self.line_index.line_length(insert_line):
+            self.buffer.reset(self.tk.call(self._orig, "get", "1.0", "end-1c"))
+            return False
+        return True
+
+
+### ======================= Search Engine ======================== ###
+
+@functools.lru_cache(maxsize=64)
+def compile_pattern(source, flags):
+    return re.compile(source, flags)
+
+
+def build_pattern_source(query, regex=False, whole_word=False):
+    source = query if regex else re.escape(query)
+    if whole_word:
+        source = rf"(?<!\w)(?:{source})(?!\w)"
+    return source
+
+
+def collect_matches(matches, base=0, starts=None, ends=None):
+    starts = [] if starts is None else starts
+    ends = [] if ends is None else ends
+    for m in matches:
+        # Empty matches cannot be highlighted or stepped through
+        if m.end() > m.start():
+            starts.append(m.start() + base)
+            ends.append(m.end() + base)
+    return starts, ends
+
+
+def expand_matches(matches, template, base=0):
+    # Like collect_matches, plus the replacement template expanded for each hit
+    matches = [m for m in matches if m.end() > m.start()]
+    return ([m.start() + base for m in matches], [m.end() + base for m in matches],
+            [m.expand(template) for m in matches])
+
+
+def _regex_scan_worker(conn):
+    # Runs in a child process so a runaway pattern can be killed. The process
+    # stays up between scans; each job is (source, flags, windows, template)
+    patterns = {}
+    while True:
+        try:
+            source, flags, windows, template = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            pattern = patterns.get((source, flags))
+            if pattern is None:
+                pattern = patterns[(source, flags)] = compile_pattern(source, flags)
+            if template is None:
+                results = [collect_matches(pattern.finditer(text), base) for base, text in windows]
+            else:
+                results = [expand_matches(pattern.finditer(text), template, base) for base, text in windows]
+            conn.send(("ok", results))
+        except Exception as e:
+            conn.send(("error", f"Pattern failed: {e}"))
+
+
+class RegexWorker:
+    # One long-lived child process for regex scans; spawning an interpreter per
+    # rescan costs well over 100 ms. A scan that is cancelled or runs past its
+    # budget kills the process and the next scan starts a fresh one
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+
+    def _start(self):
+        import multiprocessing
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_regex_scan_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(1)
+        self.conn.close()
+        self.process = self.conn = None
+
+    def run(self, job, cancelled, budget):
+        # ("ok", results) or ("error", reason); None when cancelled
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self.stop()
+                self._start()
+            deadline = time.monotonic() + budget
+            try:
+                self.conn.send(job)
+                while not cancelled.is_set():
+                    if self.conn.poll(0.05):
+                        return self.conn.recv()
+                    if time.monotonic() > deadline:
+                        self.stop()
+                        return ("error", "Pattern took too long and was stopped")
+                    if not self.process.is_alive():
+                        self.stop()
+                        return ("error", "Pattern search failed")
+            except (EOFError, OSError):
+                self.stop()
+                return ("error", "Pattern search failed")
+            self.stop()
+            return None
+
+
+REGEX_WORKER = RegexWorker()
+
+
+class SearchSession:
+    # Every match of one query over the document, kept as sorted offset lists and
+    # patched as the document is edited
+    def __init__(self, query, match_case, regex=False, whole_word=False):
+        self.query = query
+        self.match_case = match_case
+        self.regex = regex
+        self.whole_word = whole_word
+        self.source = build_pattern_source(query, regex, whole_word)
+        self.flags = re.MULTILINE if match_case else re.MULTILINE | re.IGNORECASE
+        self.pattern = compile_pattern(self.source, self.flags)
+        self.starts = []
+        self.ends = []
+        self.ready = False
+        self.error = None
+        self.current = None
+        self.pending_edits = []
+        self.dirty = []
+        self.cancelled = threading.Event()
+
+    def matches_query(self, query, match_case, regex=False, whole_word=False):
+        return (self.query, self.match_case, self.regex, self.whole_word) == (query, match_case, regex, whole_word)
+
+    def scan_isolated(self, windows, template=None):
+        # Regex scans run in the worker process with a time budget. windows are
+        # (base, text) pairs and the result has (starts, ends) for each, plus the
+        # expanded template per hit when one is given; None when the scan was
+        # cancelled, timed out or failed, with the reason in self.error
+        reply = REGEX_WORKER.run((self.source, self.flags, windows, template),
+                                 self.cancelled, REGEX_TIME_BUDGET)
+        if reply is None:
+            return None
+        if reply[0] == "ok":
+            return reply[1]
+        self.error = reply[1]
+        return None
+
+    def scan(self, text, base=0):
+        if self.regex:
+            return collect_matches(self.pattern.finditer(text), base)
+        # Slices keep each regex call short, so the UI thread gets the GIL back often.
+        # The overlap is one longer than a match so whole-word lookaheads see past it
+        starts, ends = [], []
+        overlap = len(self.query)
+        for start in range(0, len(text), SEARCH_SLICE):
+            if self.cancelled.is_set():
+                break
+            stop = start + SEARCH_SLICE
+            matches = self.pattern.finditer(text, start, min(len(text), stop + overlap))
+            collect_matches((m for m in matches if m.start() < stop), base, starts, ends)
+        return starts, ends
+
+    def load(self, starts, ends):
+        self.starts, self.ends = starts, ends
+        self.ready = True
+        edits, self.pending_edits = self.pending_edits, []
+        for edit in edits:
+            self.apply_edit(edit)
+
+    def apply_edit(self, edit):
+        if not self.ready:
+            self.pending_edits.append(edit)
+            return
+        offset, removed, added = edit.offset, edit.removed, len(edit.text)
+        delta = added - removed
+        # Drop hits that overlap the edited span, shift the ones after it
+        i = bisect_right(self.ends, offset)
+        j = bisect_left(self.starts, offset + removed)
+        if self.current is not None:
+            k = bisect_left(self.starts, self.current)
+            if i <= k < j:
+                self.current = None
+            elif self.current >= offset + removed:
+                self.current += delta
+        self.starts[i:] = [start + delta for start in self.starts[j:]]
+        self.ends[i:] = [end + delta for end in self.ends[j:]]
+
+        def shift(point):
+            if point <= offset:
+                return point
+            return point + delta if point >= offset + removed else offset
+
+        spans = [(shift(a), shift(b)) for a, b in self.dirty]
+        spans.append((offset, offset + added))
+        spans.sort()
+        self.dirty = []
+        for a, b in spans:
+            if self.dirty and a <= self.dirty[-1][1]:
+                self.dirty[-1] = (self.dirty[-1][0], max(b, self.dirty[-1][1]))
+            else:
+                self.dirty.append((a, b))
+
+    def dirty_windows(self, text_widget):
+        # Whole lines around each edited span, as (start, end, text)
+        index = text_widget.line_index
+        margin = len(self.query)
+        spans, self.dirty = self.dirty, []
+        windows = []
+        for a, b in spans:
+            first, _ = index.position(a - margin)
+            last, _ = index.position(b + margin)
+            window_start = index.offset(first, 0)
+            window_end = index.offset(last, index.line_length(last))
+            windows.append((window_start, window_end, text_widget.get(f"{first}.0", f"{last}.end")))
+        return windows
+
+    def merge(self, windows, results):
+        for (window_start, window_end, _), (starts, ends) in zip(windows, results):
+            i = bisect_left(self.starts, window_start)
+            j = bisect_left(self.starts, window_end)
+            self.starts[i:j] = starts
+            self.ends[i:j] = ends
+        if self.current is not None and self.number(self.current) is None:
+            self.current = None
+
+    def rescan(self, text_widget):
+        # Literal patterns only; a regex could run away on the UI thread, so those
+        # go through Notepad.rescan_search
+        windows = self.dirty_windows(text_widget)
+        self.merge(windows, [self.scan(text, start) for start, _, text in windows])
+
+    def number(self, offset):
+        i = bisect_left(self.starts, offset)
+        if i < len(self.starts) and self.starts[i] == offset:
+            return i + 1
+        return None
+
+    def nearest(self, offset, backwards, wrap):
+        if not self.starts:
+            return None
+        if backwards:
+            i = bisect_left(self.starts, offset) - 1
+            if i < 0:
+                i = len(self.starts) - 1 if wrap else None
+        else:
+            i = bisect_left(self.starts, offset)
+            if i >= len(self.starts):
+                i = 0 if wrap else None
+        return i
+
+    def visible(self, top, bottom):
+        return bisect_right(self.ends, top), bisect_right(self.starts, bottom)
+
+    def summary(self):
+        if self.error:
+            return self.error
+        if not self.ready:
+            return "Searching..."
+        if not self.starts:
+            return "No matches"
+        number = self.number(self.current) if self.current is not None else None
+        if number:
+            return f"{number} of {len(self.starts)}"
+        return f"{len(self.starts)} matches"
+
+
+class ReplaceAllJob:
+    # spans are (start, end, replacement) in document order
+    def __init__(self, spans):
+        self.spans = spans
+        self.remaining = len(spans)
+        self.count = 0
+
+
+### ======================= Find in Files ======================== ###
+
+def search_files(paths, source, flags):
+    # Pool worker: scans whole lines in binary chunks so no file is ever read
+    # into memory at once. Returns one hit per matching line as
+    # (path, line, column, preview) plus counts for the progress line
+    pattern = compile_pattern(source, flags)
+    hits = []
+    scanned = skipped = total = 0
+    for path in paths:
+        try:
+            with open(path, "rb") as file:
+                found, size = _search_file(file, pattern, path)
+        except OSError:
+            skipped += 1
+            continue
+        if found is None:
+            skipped += 1
+            continue
+        scanned += 1
+        total += size
+        hits.extend(found)
+    return hits, scanned, skipped, total
+
+
+def _search_file(file, pattern, path):
+    hits = []
+    line = 1
+    carry = b""
+    skip = 0        # leading bytes of carry already searched, kept as context
+    lead = 0        # characters of the current line before carry
+    reported = 0    # last line with a hit
+    size = 0
+    first = True
+    while True:
+        chunk = file.read(FILE_SEARCH_CHUNK)
+        if first and b"\0" in chunk[:FILE_SEARCH_SNIFF]:
+            return None, 0
+        first = False
+        size += len(chunk)
+        buf = carry + chunk
+        if not buf:
+            break
+        # Only complete lines are scanned; the partial last one waits for the next chunk
+        cut = len(buf) if not chunk else buf.rfind(b"\n", skip) + 1
+        if cut == 0 and len(buf) < FILE_SEARCH_CHUNK * 4:
+            carry = buf
+            continue
+        # A very long line is searched in windows that overlap by
+        # FILE_SEARCH_OVERLAP; a hit has to start before the cut
+        split = cut == 0
+        if split:
+            cut = len(buf) - FILE_SEARCH_OVERLAP
+        pos = skip
+        line_end = 0
+        for m in pattern.finditer(buf, skip, len(buf) if split else cut):
+            if m.start() >= cut:
+                break
+            if m.start() < line_end or m.end() == m.start():
+                continue
+            line += buf.count(b"\n", pos, m.start())
+            pos = m.start()
+            line_start = buf.rfind(b"\n", 0, m.start()) + 1
+            line_end = buf.find(b"\n", m.start(), cut)
+            line_end = cut if line_end < 0 else line_end + 1
+            if line == reported:
+                continue
+            reported = line
+            column = len(buf[line_start:m.start()].decode("utf-8", "replace")) + 1
+            if line_start == 0:
+                column += lead
+            preview = buf[line_start:min(line_end, line_start + FILE_SEARCH_PREVIEW * 4)]
+            preview = preview.decode("utf-8", "replace").rstrip("\r\n")[:FILE_SEARCH_PREVIEW]
+            hits.append((path, line, column, preview.strip()))
+            if len(hits) >= FILE_SEARCH_FILE_HITS:
+                return hits, size
+        line += buf.count(b"\n", pos, cut)
+        if split:
+            back = cut - FILE_SEARCH_OVERLAP
+            while back and buf[back] & 0xC0 == 0x80:
+                back -= 1
+            line_start = buf.rfind(b"\n", 0, back) + 1
+            lead = (lead if line_start == 0 else 0) + len(buf[line_start:back].decode("utf-8", "replace"))
+            carry, skip = buf[back:], cut - back
+        else:
+            carry, skip, lead = buf[cut:], 0, 0
+        if not chunk:
+            break
+    return hits, size
+
+
+def split_globs(text):
+    return [glob.strip() for glob in re.split(r"[;,]", text) if glob.strip()]
+
+
+class FileSearch:
+    # One Find in Files run. A walker thread batches paths for a process pool
+    # and keeps only a few batches per worker in flight; hits come back to the
+    # UI through a queue
+    def __init__(self, directory, source, flags, include, exclude):
+        self.directory = directory
+        self.source = source
+        self.flags = flags
+        self.include = include
+        self.exclude = exclude
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.scanned = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _excluded(self, name, relative):
+        return any(fnmatch.fnmatch(name, glob) or fnmatch.fnmatch(relative, glob) for glob in self.exclude)
+
+    def _walk(self):
+        stack = [self.directory]
+        while stack and not self.cancelled.is_set():
+            directory = stack.pop()
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name, reverse=True)
+            except OSError:
+                continue
+            for entry in entries:
+                relative = os.path.relpath(entry.path, self.directory)
+                if self._excluded(entry.name, relative):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and (not self.include or any(fnmatch.fnmatch(entry.name, glob) for glob in self.include)):
+                        yield entry.path, entry.stat().st_size
+                except OSError:
+                    continue
+
+    def _batches(self):
+        batch, size = [], 0
+        for path, length in self._walk():
+            batch.append(path)
+            size += length
+            if len(batch) >= FILE_SEARCH_BATCH_FILES or size >= FILE_SEARCH_BATCH_BYTES:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _run(self):
+        import multiprocessing
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        workers = os.cpu_count() or 1
+        error = None
+        # Spawned rather than forked: a forked child would inherit Tk's state
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        pending = set()
+        try:
+            for batch in self._batches():
+                if self.cancelled.is_set():
+                    break
+                pending.add(pool.submit(search_files, batch, self.source, self.flags))
+                while len(pending) >= workers * FILE_SEARCH_INFLIGHT and not self.cancelled.is_set():
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    self._collect(done)
+            while pending and not self.cancelled.is_set():
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                self._collect(done)
+        except Exception as e:
+            error = e
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.results.put(("done", error))
+
+    def _collect(self, futures):
+        for future in futures:
+            hits, scanned, skipped, size = future.result()
+            self.scanned += scanned
+            self.skipped += skipped
+            self.bytes += size
+            if hits:
+                self.results.put(("hits", hits))
+
+
+### ==================== Syntax Highlighting ===================== ###
+
+class RegexLexer:
+    # Tokenizes one line at a time through a single alternation of (tag, pattern)
+    # rules; nothing carries over from one line to the next
+    stateful = False
+
+    def __init__(self, rules, flags=0):
+        self.tags = [tag for tag, _ in rules]
+        self.regex = re.compile("|".join(f"(?P<t{i}>{pattern})" for i, (_, pattern) in enumerate(rules)), flags)
+
+    def lex(self, line, state=0):
+        tokens = []
+        for m in self.regex.finditer(line):
+            if m.end() > m.start():
+                tokens.append((m.start(), m.end(), self.tags[int(m.lastgroup[1:])]))
+        return tokens, 0
+
+
+class PythonLexer(RegexLexer):
+    # Triple-quoted strings run across lines: state 1 is inside ''' and 2 inside """
+    stateful = True
+    QUOTES = {1: "'''", 2: '"""'}
+    CLOSERS = {
+        "'''": re.compile(r"(?:\\.|[^\\])*?'''"),
+        '"""': re.compile(r'(?:\\.|[^\\])*?"""'),
+    }
+
+    def __init__(self):
+        import keyword
+        super().__init__([
+            ("triple", r"\b[rRbBuUfF]{1,2}(?:'''|\"\"\")|'''|\"\"\""),
+            ("hl_comment", r"#.*"),
+            ("hl_string", r"\b[rRbBuUfF]{1,2}(?:'(?:[^'\\]|\\.)*'?|\"(?:[^\"\\]|\\.)*\"?)|'(?:[^'\\]|\\.)*'?|\"(?:[^\"\\]|\\.)*\"?"),
+            ("hl_keyword", r"\b(?:" + "|".join(keyword.kwlist) + r")\b"),
+            ("hl_number", r"\b(?:0[xXoObB][\da-fA-F_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?j?)\b"),
+            ("hl_literal", r"@[\w.]+"),
+        ])
+
+    def lex(self, line, state=0):
+        tokens = []
+        pos = 0
+        if state:
+            end = self._close(line, self.QUOTES[state], 0)
+            if end < 0:
+                return ([(0, len(line), "hl_string")] if line else []), state
+            tokens.append((0, end, "hl_string"))
+            pos = end
+        while True:
+            m = self.regex.search(line, pos)
+            if m is None:
+                return tokens, 0
+            tag = self.tags[int(m.lastgroup[1:])]
+            if tag == "triple":
+                quote = m.group()[-3:]
+                end = self._close(line, quote, m.end())
+                if end < 0:
+                    tokens.append((m.start(), len(line), "hl_string"))
+                    return tokens, 1 if quote == "'''" else 2
+                tokens.append((m.start(), end, "hl_string"))
+                pos = end
+                continue
+            if m.end() > m.start():
+                tokens.append((m.start(), m.end(), tag))
+            pos = max(m.end(), m.start() + 1)
+
+    def _close(self, line, quote, pos):
+        m = self.CLOSERS[quote].match(line, pos)
+        return m.end() if m else -1
+
+
+@functools.lru_cache(maxsize=None)
+def make_lexer(kind):
+    # Built on first use so the patterns cost nothing at startup
+    if kind == "python":
+        return PythonLexer()
+    if kind == "json":
+        return RegexLexer([
+            ("hl_key", r'"(?:[^"\\]|\\.)*"(?=\s*:)'),
+            ("hl_string", r'"(?:[^"\\]|\\.)*"?'),
+            ("hl_number", r"-?\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b"),
+            ("hl_literal", r"\b(?:true|false|null)\b"),
+        ])
+    if kind == "ini":
+        return RegexLexer([
+            ("hl_comment", r"^\s*[;#].*"),
+            ("hl_section", r"^\s*\[[^\]]*\]"),
+            ("hl_key", r"^\s*[^=:\s\[;#][^=:]*?(?=\s*[=:])"),
+            ("hl_string", r'"[^"]*"'),
+            ("hl_number", r"\b\d+(?:\.\d+)?\b"),
+            ("hl_literal", r"\b(?:true|false|yes|no|on|off)\b"),
+        ], re.I)
+    if kind == "log":
+        return RegexLexer([
+            ("hl_number", r"^\[?\d{4}-\d{2}-\d{2}[T ][\d:.,]+(?:Z|[+-]\d{2}:?\d{2})?\]?"),
+            ("hl_error", r"\b(?:ERROR|ERR|FATAL|CRITICAL|SEVERE|Traceback)\b"),
+            ("hl_warning", r"\b(?:WARN|WARNING)\b"),
+            ("hl_info", r"\b(?:INFO|NOTICE)\b"),
+            ("hl_debug", r"\b(?:DEBUG|TRACE|VERBOSE)\b"),
+        ])
+    return None
+
+
+LEXER_KINDS = {
+    ".py": "python", ".pyw": "python",
+    ".json": "json", ".jsonl": "json", ".geojson": "json",
+    ".ini": "ini", ".cfg": "ini", ".conf": "ini", ".inf": "ini",
+    ".log": "log", ".out": "log", ".err": "log",
+}
+
+
+def lexer_for(path):
+    kind = LEXER_KINDS.get(os.path.splitext(path or "")[1].lower())
+    return make_lexer(kind) if kind else None
+
+
+def lex_states(text, lexer):
+    # Start state of every line, for lexers whose state crosses line boundaries
+    states = []
+    state = 0
+    for line in text.split("\n"):
+        states.append(state)
+        state = lexer.lex(line, state)[1]
+    return states
+
+
+class Highlighter:
+    # Tags only the lines on screen plus a margin, and only the ones whose text or
+    # incoming state changed since they were last tagged. Line start states of a
+    # stateful lexer are lexed in bulk on a worker thread, then patched after each
+    # edit until they agree with the old ones again
+    def __init__(self, text, lexer):
+        self.text = text
+        self.lexer = lexer
+        self.clean = set()
+        self.states = None if lexer.stateful else []
+        self.edited_from = None
+        self.resume = None
+        self.resume_until = 0
+        self.closed = False
+        self._job = None
+        for tag, color in HIGHLIGHT_COLORS.items():
+            text.tag_configure(tag, foreground=color)
+            text.tag_lower(tag)
+
+    def start(self):
+        if self.lexer.stateful:
+            snapshot = self.text.snapshot()
+
+            def work():
+                states = lex_states(snapshot.text(), self.lexer)
+                self.text.after(0, lambda: self._states_ready(states))
+            threading.Thread(target=work, daemon=True).start()
+        self.schedule()
+
+    def close(self):
+        self.closed = True
+        if self._job is not None:
+            self.text.after_cancel(self._job)
+            self._job = None
+        for tag in HIGHLIGHT_COLORS:
+            self.text.tag_remove(tag, "1.0", tk.END)
+
+    def _states_ready(self, states):
+        if self.closed:
+            return
+        if self.edited_from is not None:
+            # Edited while the worker ran; its states only hold above the first edit
+            del states[self.edited_from:]
+            self.resume = self.edited_from
+            self.resume_until = self.text.line_index.lines
+        self.states = states
+        self.edited_from = None
+        self.clean.clear()
+        self.schedule()
+
+    def schedule(self):
+        if self._job is None and not self.closed:
+            self._job = self.text.after_idle(self._refresh)
+
+    def on_edit(self, edit):
+        first = edit.line
+        last = edit.end_line if edit.removed else first
+        added = edit.text.count("\n")
+        delta = added - (last - first)
+        self.clean = {n if n < first else n + delta for n in self.clean if n < first or n > last}
+        if self.states is None:
+            self.edited_from = first if self.edited_from is None else min(self.edited_from, first)
+        elif self.lexer.stateful and first <= len(self.states):
+            # Lines after the first edited one get placeholder states until re-lexed
+            self.states[first:last] = [self.states[first - 1]] * added
+            if self.resume is not None and self.resume > last:
+                self.resume += delta
+            self.resume = first if self.resume is None else min(self.resume, first)
+            if self.resume_until > last:
+                self.resume_until += delta
+            self.resume_until = max(self.resume_until, first + added)
+        self.schedule()
+
+    def _settle_states(self):
+        # Re-lex forward from the first edited line until a line past the edits
+        # ends in the state the next line already starts with
+        if self.resume is None:
+            return True
+        states = self.states
+        lines = self.text.line_index.lines
+        start = self.resume
+        stop = min(lines, start + HIGHLIGHT_STATE_SLICE - 1)
+        chunk = self.text.get(f"{start}.0", f"{stop}.end").split("\n")
+        for n, content in enumerate(chunk, start):
+            end_state = self.lexer.lex(content, states[n - 1])[1]
+            if n >= lines:
+                del states[n:]
+                break
+            if n < len(states):
+                if states[n] == end_state and n >= self.resume_until:
+                    break
+                if states[n] != end_state:
+                    states[n] = end_state
+                    self.clean.discard(n + 1)
+            else:
+                states.append(end_state)
+                self.clean.discard(n + 1)
+        else:
+            self.resume = stop + 1
+            return False
+        self.resume = None
+        self.resume_until = 0
+        return True
+
+    def line_state(self, n):
+        if not self.lexer.stateful:
+            return 0
+        if self.states is None or n - 1 >= len(self.states):
+            return None
+        return self.states[n - 1]
+
+    def _refresh(self):
+        self._job = None
+        if self.closed:
+            return
+        settled = self._settle_states()
+        text = self.text
+        top = int(text.index("@0,0").split(".")[0])
+        bottom = int(text.index(f"@0,{text.winfo_height()}").split(".")[0])
+        first = max(1, top - HIGHLIGHT_MARGIN)
+        last = min(text.line_index.lines, bottom + HIGHLIGHT_MARGIN)
+        stale = [n for n in range(first, last + 1) if n not in self.clean]
+        if stale:
+            lines = text.get(f"{stale[0]}.0", f"{stale[-1]}.end").split("\n")
+            ranges = {tag: [] for tag in HIGHLIGHT_COLORS}
+            runs = []
+            for n in stale:
+                if runs and runs[-1][1] == n - 1:
+                    runs[-1][1] = n
+                else:
+                    runs.append([n, n])
+                state = self.line_state(n)
+                line = lines[n - stale[0]]
+                tokens, _ = self.lexer.lex(line, state or 0)
+                wide = text.surrogates and WIDE_CHAR.search(line) is not None
+                for start, end, tag in tokens:
+                    if wide:
+                        start, end = tk_column(line, start), tk_column(line, end)
+                    ranges[tag].extend((f"{n}.{start}", f"{n}.{end}"))
+                if state is not None:
+                    # Lines lexed with a guessed state are redone once states arrive
+                    self.clean.add(n)
+            for tag, spans in ranges.items():
+                for run_first, run_last in runs:
+                    text.tag_remove(tag, f"{run_first}.0", f"{run_last}.end")
+                for i in range(0, len(spans), 2000):
+                    text.tag_add(tag, *spans[i:i + 2000])
+        if len(self.clean) > HIGHLIGHT_CLEAN_LIMIT:
+            self.clean = {n for n in self.clean if first <= n <= last}
+        if not settled:
+            self.schedule()
+
+
+### =================== Single Instance Server =================== ###
+
+class InstanceServer:
+    # Accepts any number of clients at once and delivers their commands in batches,
+    # so fifty files opened together cost one UI update
+    def __init__(self, on_batch):
+        self.on_batch = on_batch
+        self.listener = None
+        self.local_path = None
+
+    def start(self):
+        import selectors
+        self.selector = selectors.DefaultSelector()
+        self.listener = self._listen()
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _listen(self):
+        path = local_socket_path(create=True)
+        if path:
+            try:
+                if os.path.lexists(path):
+                    # Left over from an instance that did not shut down cleanly
+                    os.unlink(path)
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                s.bind(path)
+                s.listen(64)
+                self.local_path = path
+                return s
+            except OSError:
+                pass
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((SINGLETON_HOST, PORT))
+        s.listen(64)
+        return s
+
+    def close(self):
+        if self.local_path:
+            try:
+                os.unlink(self.local_path)
+            except OSError:
+                pass
+
+    def _serve(self):
+        import selectors
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        conn, _ = self.listener.accept()
+                    except OSError:
+                        continue
+                    conn.setblocking(False)
+                    self.selector.register(conn, selectors.EVENT_READ, bytearray())
+                else:
+                    pending.extend(self._read(key.fileobj, key.data))
+            if pending and deadline is None:
+                deadline = time.monotonic() + IPC_BATCH_WINDOW
+            if deadline is not None and time.monotonic() >= deadline:
+                batch, pending, deadline = pending, [], None
+                self.on_batch(batch)
+
+    def _read(self, conn, buffer):
+        try:
+            data = conn.recv(65536)
+        except BlockingIOError:
+            return []
+        except OSError:
+            data = b""
+        buffer.extend(data)
+        messages = []
+        while len(buffer) >= 4:
+            size = int.from_bytes(buffer[:4], "big")
+            if size > MAX_FRAME:
+                # Not our protocol; a bare "SHOW" from an older client lands here
+                if bytes(buffer) == b"SHOW":
+                    messages.append(("SHOW", None))
+                data = b""
+                break
+            if len(buffer) < 4 + size:
+                break
+            command = parse_command(buffer[4:4 + size].decode("utf-8", "replace"))
+            del buffer[:4 + size]
+            if command[0]:
+                messages.append(command)
+        if not data:
+            self.selector.unregister(conn)
+            conn.close()
+        return messages
 
-PORT = 56789
-SINGLETON_HOST = '127.0.0.1'
 
-def notify_existing_instance():
-    try:
-        with socket.create_connection((SINGLETON_HOST, PORT), timeout=1) as s:
-            s.sendall(b"SHOW")
-        return True
-    except Exception:
-        return False
+### ========================= Documents ========================== ###
 
-import json
-import os
-from tkinterdnd2 import DND_FILES, TkinterDnD
-import tkinter as tk
-from tkinter import filedialog, font, ttk
-from pathlib import Path
+class Document:
+    # State of one tab. While a document is shown its STATE fields live on the
+    # Notepad itself (see Notepad.activate); an inactive one keeps them here. An
+    # evicted document has no widget, only a compressed snapshot of its text or,
+    # when it still matched its file, nothing but the path and position
+    STATE = ("filename", "text_area", "revision", "saved_revision", "saved_hash",
+             "file_stat", "large_view", "large_lines", "journal", "compression")
 
+    def __init__(self, filename=None, position=None):
+        self.filename = filename
+        self.text_area = None
+        self.revision = 0
+        self.saved_revision = 0
+        self.saved_hash = content_digest("")
+        self.file_stat = None
+        self.large_view = None
+        self.large_lines = []
+        self.journal = None
+        self.compression = None
+        self.position = position
+        self.loaded = filename is None
+        self.snapshot = None
+        self.yview = 0.0
+        self.size = 0
+        self.last_used = 0
+        self.tab = None
 
-### ================= Configuration & Constants ================== ###
+    def modified(self):
+        return self.revision != self.saved_revision
 
-APP_NAME = "Notepd"
-CONFIG_DIR = os.path.join(os.environ.get("APPDATA", os.path.expanduser("~")), APP_NAME)
-os.makedirs(CONFIG_DIR, exist_ok=True)
-CONFIG_PATH = os.path.join(CONFIG_DIR, "config.json")
+    def name(self):
+        return Path(self.filename).name if self.filename else "Untitled"
 
 
-LIGHTGRAY_BG = "#424242"
-MIDGRAY_BG = "#333333"
-DARKGRAY_BG = "#212121"
-LIGHT_TEXT = "#DEDEDE"
-BUTTON_ACTIVE = "#393939"
+def write_snapshot(directory, snapshot):
+    import zlib
+    fd, path = tempfile.mkstemp(prefix="tab-", suffix=".z", dir=directory)
+    compressor = zlib.compressobj(1)
+    with os.fdopen(fd, "wb") as file:
+        for chunk in snapshot.chunks():
+            file.write(compressor.compress(chunk.encode("utf-8", "surrogatepass")))
+        file.write(compressor.flush())
+    return path
+
+
+def read_snapshot(path):
+    import zlib
+    with open(path, "rb") as file:
+        return zlib.decompress(file.read()).decode("utf-8", "surrogatepass")
 
-FONTS = [
-    "Arial", "Calibri", "Comic Sans", "Courier New", "Garamond",
-    "Georgia", "Helvetica", "Roboto", "Segoe UI", "Times New Roman", "Verdana"
-]
 
 class Notepad:
     def __init__(self, root):
         self.root = root
         self.root.title("Notepd")
         self.filename = None
-        self.last_saved_text = ""
-        self.load_config()
+        self.compression = None
+        self.revision = 0
+        self.saved_revision = 0
+        self.saved_hash = content_digest("")
+        self.loader = None
+        self.large_view = None
+        self.follower = None
+        self.watcher = None
+        self.highlighter = None
+        self._gutter_job = None
+        self._gutter_digits = 0
+        self._layout_job = None
+        self.documents = []
+        self.current = None
+        self.text_setup = []
+        self._tabs_job = None
+        self._use_counter = 0
+        self._snapshot_dir = None
+        self.recovery = RecoveryStore()
+        self.journal = None
+        self.journal_paused = False
+        self._journal_job = None
+        # (bytes read, stat, content digest) of the file as last loaded or saved
+        self.file_stat = None
+        self._saves_in_flight = 0
+        self._disk_prompt = False
+        self.large_lines = []
+        self._large_search = None
+        self._goto_after_load = None
+        self._load_job = None
+        self._status_job = None
+        self._cursor_job = None
+        self.search = None
+        self._search_job = None
+        self._match_tag_job = None
+        self.replacer = None
+        self._find_pending = None
+        self._replace_pending = None
+        self._replace_job = None
+        self.file_panel = None
+        self.file_search = None
+        self.file_hits = []
+        self._file_search_job = None
+        self.save_engine = SaveEngine(self._on_save_done)
+        self.config_store = ConfigStore(CONFIG_PATH, self.root, self.save_engine)
+        with STARTUP.phase("load config"):
+            self.load_config()
 
         self.root.geometry(self.window_size or "900x650")
         self.root.configure(bg=DARKGRAY_BG, highlightbackground=DARKGRAY_BG, highlightcolor=DARKGRAY_BG, highlightthickness=2)
 
+        self.text_font = font.Font(family=self.font_family, size=self.font_size)
+        self.wrap_enabled = self.wrap_state
+
+        self.find_bar_visible = self.find_bar_state
+        self.find_bar = None
+        self.status_label = None
+        self.match_case = tk.IntVar()
+        self.whole_word = tk.IntVar()
+        self.regex_mode = tk.IntVar()
+        self.wrap_around = tk.IntVar(value=1)
+        self.search_direction = tk.StringVar(value="down")
+
+        with STARTUP.phase("create widgets"):
+            self.create_widgets()
+
+        if self.find_bar_visible:
+            self.toggle_find_bar()
+
+        self.update_cursor_position()
+        self.root.protocol("WM_DELETE_WINDOW", self.hide_and_reset)
+
+        # Everything else loads once the window and text area are on screen,
+        # one step per idle cycle so early keystrokes are not held up
+        self._startup_steps = [
+            ("ttk styles", self.apply_styles),
+            ("menus", self.create_menu),
+            ("shortcuts", self.bind_shortcuts),
+            ("drag and drop", self.enable_dnd),
+        ]
+        self.root.after_idle(self._run_startup_step)
+
+    def _run_startup_step(self):
+        if not self._startup_steps:
+            STARTUP.report()
+            return
+        name, step = self._startup_steps.pop(0)
+        with STARTUP.phase(name):
+            step()
+        self.root.after_idle(self._run_startup_step)
+
+    def apply_styles(self):
         style = ttk.Style()
         style.theme_use('clam')
         style.configure("Vertical.TScrollbar",
@@ -74,224 +2865,1322 @@ class Notepad:
         style.map("Horizontal.TScrollbar",
                   background=[("disabled", DARKGRAY_BG)])
 
-        self.text_font = font.Font(family=self.font_family, size=self.font_size)
-        self.wrap_enabled = self.wrap_state
+    def enable_dnd(self):
+        try:
+            from tkinterdnd2 import DND_FILES, TkinterDnD
+            TkinterDnD._require(self.root)
+        except Exception as e:
+            print("Failed to load tkdnd package:", e)
+            return
+        def register(text):
+            text.drop_target_register(DND_FILES)
+            text.dnd_bind('<<Drop>>', self.handle_drop)
+        self.add_text_setup(register)
+
+    def handle_drop(self, event):
+        paths = [path for path in self.root.tk.splitlist(event.data) if os.path.isfile(path)]
+        if paths:
+            self.open_targets([(path, None, None) for path in paths])
+
+    def load_config(self):
+        self.config_store.load()
+        self.font_family = self.config_store.get("font_family", "Consolas")
+        self.font_size = self.config_store.get("font_size", 12)
+        self.window_size = self.config_store.get("window_size")
+        self.find_bar_state = self.config_store.get("find_bar_visible", False)
+        self.wrap_state = self.config_store.get("wrap_enabled", True)
+        self.highlight_enabled = self.config_store.get("highlight_enabled", True)
+        self.line_numbers = self.config_store.get("line_numbers", True)
+        self.tab_memory = self.config_store.get("tab_memory_mb", TAB_MEMORY_MB) * 1024 * 1024
+        self.undo_limit_mb = self.config_store.get("undo_limit_mb", UNDO_LIMIT_MB)
+        self.large_file_threshold = self.config_store.get("large_file_threshold_mb", LARGE_FILE_THRESHOLD_MB) * 1024 * 1024
+
+    def save_config(self):
+        self.config_store.update(
+            font_family=self.font_family,
+            font_size=self.font_size,
+            window_size=self.root.geometry(),
+            find_bar_visible=bool(self.find_bar and self.find_bar.winfo_exists()),
+            wrap_enabled=self.wrap_enabled,
+            highlight_enabled=self.highlight_enabled,
+            line_numbers=self.line_numbers,
+            undo_limit_mb=self.undo_limit_mb,
+        )
+
+
+### ====================== UI Construction ======================= ###
+
+    def create_widgets(self):
+        self.text_frame = tk.Frame(self.root, bg=LIGHTGRAY_BG)
+        self.text_frame.grid(row=0, column=0, sticky="nsew")
+
+        # Shown once there is more than one document, see draw_tabs
+        self.tab_bar = tk.Frame(self.text_frame, bg=DARKGRAY_BG)
+        self.tab_bar.grid(row=0, column=0, columnspan=3, sticky="ew")
+        self.tab_bar.grid_remove()
+
+        # Only the numbers of the lines on screen are ever drawn, see draw_gutter
+        self.gutter = tk.Canvas(self.text_frame, width=0, bg=MIDGRAY_BG, highlightthickness=0, bd=0)
+        self.gutter.grid(row=1, column=0, sticky="ns")
+        if not self.line_numbers:
+            self.gutter.grid_remove()
+
+        self.scroll_y = ttk.Scrollbar(self.text_frame, command=self._on_scrollbar, style="Vertical.TScrollbar")
+        self.scroll_y.grid(row=1, column=2, sticky="ns")
+
+        self.scroll_x = ttk.Scrollbar(self.text_frame, orient="horizontal", command=lambda *args: self.text_area.xview(*args), style="Horizontal.TScrollbar")
+        self.scroll_x.grid(row=2, column=1, sticky="ew")
+        self.scroll_x.grid_remove()
+
+        if not self.wrap_enabled:
+            self.scroll_x.grid()
+
+        self.root.grid_rowconfigure(0, weight=1)
+        self.root.grid_columnconfigure(0, weight=1)
+        self.text_frame.grid_rowconfigure(1, weight=1)
+        self.text_frame.grid_columnconfigure(1, weight=1)
+
+        self.add_text_setup(self.bind_text_area)
+        self.current = Document()
+        self.documents.append(self.current)
+        self.text_area = self.current.text_area = self.make_text_area()
+        self.text_area.grid(row=1, column=1, sticky="nsew")
+
+        self.message_label = tk.Label(self.root, text="", fg=LIGHT_TEXT, bg=DARKGRAY_BG, anchor="w", padx=8)
+        self.message_label.grid(row=3, column=0, columnspan=2, sticky="ew")
+        self.message_label.grid_remove()
+
+    def make_text_area(self):
+        # Every document gets its own widget, created the first time it is shown
+        text = TrackedText(
+            self.text_frame, wrap="word" if self.wrap_enabled else "none", undo=True, font=self.text_font,
+            bg=LIGHTGRAY_BG, fg=LIGHT_TEXT, insertbackground=LIGHT_TEXT,
+            padx=10, pady=5, relief="flat", undo_limit=self.undo_limit_mb * 1024 * 1024
+        )
+        text.configure(yscrollcommand=self._on_text_scroll, xscrollcommand=self.scroll_x.set)
+        for step in self.text_setup:
+            step(text)
+        return text
+
+    def add_text_setup(self, step):
+        self.text_setup.append(step)
+        for doc in self.documents:
+            if doc.text_area is not None:
+                step(doc.text_area)
+
+    def bind_text_area(self, text):
+        text.bind("<KeyRelease>", lambda e: self.update_cursor_position())
+        text.bind("<ButtonRelease>", lambda e: self.update_cursor_position())
+        text.bind("<<Modified>>", lambda e: self._on_modified())
+        text.bind("<Configure>", lambda e: self._on_text_configure())
+        text.add_edit_listener(self._on_text_edit)
+        text.tag_config("match", background=MIDGRAY_BG)
+        text.tag_config("found", background=DARKGRAY_BG)
+        text.tag_raise("found")
+
+        # Block edits while a file is streaming in
+        text.bind("<Key>", self._guard_edit)
+        for sequence in ("<<Paste>>", "<<Cut>>", "<<Clear>>", "<<Undo>>", "<<Redo>>"):
+            text.bind(sequence, self._guard_edit)
+
+        # Navigation that moves the rendered window in large-file mode
+        text.bind("<MouseWheel>", lambda e: self._large_scroll(-3 if e.delta > 0 else 3))
+        text.bind("<Button-4>", lambda e: self._large_scroll(-3))
+        text.bind("<Button-5>", lambda e: self._large_scroll(3))
+        text.bind("<Prior>", lambda e: self._large_scroll(-self._visible_rows()))
+        text.bind("<Next>", lambda e: self._large_scroll(self._visible_rows()))
+        text.bind("<Up>", lambda e: self._large_step(-1))
+        text.bind("<Down>", lambda e: self._large_step(1))
+        text.bind("<Control-Home>", lambda e: self._large_jump(0))
+        text.bind("<Control-End>", lambda e: self._large_jump(None))
+
+    def _on_text_scroll(self, first, last):
+        if self.large_view is not None:
+            # The scrollbar tracks file offsets instead, see render_large
+            return
+        self.scroll_y.set(first, last)
+        self.refresh_match_tags()
+        self.schedule_gutter()
+        if self.highlighter is not None:
+            self.highlighter.schedule()
+
+    def _on_scrollbar(self, *args):
+        if self.large_view is None:
+            self.text_area.yview(*args)
+        else:
+            self._large_yview(*args)
+
+    def _on_text_configure(self):
+        if self.large_view is not None:
+            self.render_large(self.large_lines[0] if self.large_lines else 0)
+        self.refresh_match_tags()
+        self.schedule_gutter()
+        if self.highlighter is not None:
+            self.highlighter.schedule()
+
+    def _on_text_edit(self, edit):
+        if self.search is not None:
+            self.search.apply_edit(edit)
+            self.refresh_match_tags()
+        if self.highlighter is not None:
+            self.highlighter.on_edit(edit)
+        self.journal_edit(edit)
+        if "\n" in edit.text or edit.end_line != edit.line:
+            # Numbering below the edit shifts even when the view does not scroll
+            self.schedule_gutter()
+
+    def schedule_gutter(self):
+        if self._gutter_job is None and self.line_numbers:
+            self._gutter_job = self.root.after_idle(self.draw_gutter)
+
+    def draw_gutter(self):
+        self._gutter_job = None
+        gutter = self.gutter
+        gutter.delete("all")
+        text = self.text_area
+        base = 0
+        if self.large_view is not None:
+            number = self.large_view.line_number(self.large_lines[0]) if self.large_lines else None
+            if number is None:
+                return
+            base = number - 1
+        last_line = text.line_index.lines + base
+        digits = max(3, len(str(last_line)))
+        if digits != self._gutter_digits:
+            self._gutter_digits = digits
+            gutter.configure(width=self.text_font.measure("9" * digits) + 12)
+        right = int(gutter.cget("width")) - 6
+        height = text.winfo_height()
+        # One number per logical line, placed on its first display line; rows that
+        # continue a wrapped line stay blank
+        top = int(text.index("@0,0").split(".")[0])
+        bottom = int(text.index(f"@0,{height}").split(".")[0])
+        for line in range(top, bottom + 1):
+            info = text.dlineinfo(f"{line}.0")
+            if info is not None:
+                gutter.create_text(right, info[1], anchor="ne", text=line + base,
+                                   font=self.text_font, fill=GUTTER_TEXT)
+
+    def toggle_line_numbers(self):
+        self.line_numbers = self.line_numbers_var.get()
+        if self.line_numbers:
+            self.gutter.grid()
+            self.schedule_gutter()
+        else:
+            self.gutter.grid_remove()
+        self.save_config()
+
+    def is_busy(self):
+        return self.loader is not None or self.replacer is not None
+
+    def _guard_edit(self, event):
+        if not self.is_busy():
+            return None
+        if event.type != tk.EventType.KeyPress:
+            return "break"
+        if event.keysym in ("BackSpace", "Delete", "Return", "KP_Enter", "Tab"):
+            return "break"
+        if event.char and event.char.isprintable() and not event.state & 0x4:
+            return "break"
+        return None
+
+    def show_status(self, text, timeout=None):
+        if self._status_job:
+            self.root.after_cancel(self._status_job)
+            self._status_job = None
+        self.message_label.config(text=text)
+        self.message_label.grid()
+        if timeout:
+            self._status_job = self.root.after(timeout, self.clear_status)
+
+    def clear_status(self):
+        self._status_job = None
+        self.message_label.config(text="")
+        self.message_label.grid_remove()
+
+
+### ======================= Menu Creation ======================== ###
+
+    def create_menu(self):
+        menu_bar = tk.Menu(self.root, bg=LIGHTGRAY_BG, fg=DARKGRAY_BG, activebackground=BUTTON_ACTIVE, activeforeground=LIGHT_TEXT, tearoff=0)
+
+        file_menu = tk.Menu(menu_bar, tearoff=0)
+        file_menu.add_command(label="New Tab", command=self.new_file)
+        file_menu.add_command(label="Open...", command=self.open_file)
+        file_menu.add_command(label="Save", command=self.save_file)
+        file_menu.add_command(label="Save As...", command=self.save_file_as)
+        file_menu.add_command(label="Close Tab", command=self.close_tab)
+        file_menu.add_separator()
+        self.follow_var = tk.BooleanVar(value=self.follower is not None)
+        file_menu.add_checkbutton(label="Follow File", variable=self.follow_var, command=self.toggle_follow)
+        file_menu.add_separator()
+        file_menu.add_command(label="Print...", command=self.print_file)
+        file_menu.add_separator()
+        file_menu.add_command(label="Exit", command=self.exit_app)
+        menu_bar.add_cascade(label="File", menu=file_menu)
+
+        font_menu = tk.Menu(menu_bar, tearoff=0)
+        self.wrap_var = tk.BooleanVar(value=self.wrap_enabled)
+        font_menu.add_checkbutton(label="Wrap text", variable=self.wrap_var, command=self.toggle_wrap)
+        self.line_numbers_var = tk.BooleanVar(value=self.line_numbers)
+        font_menu.add_checkbutton(label="Line numbers", variable=self.line_numbers_var, command=self.toggle_line_numbers)
+        self.highlight_var = tk.BooleanVar(value=self.highlight_enabled)
+        font_menu.add_checkbutton(label="Syntax highlighting", variable=self.highlight_var, command=self.toggle_highlighting)
+        font_menu.add_separator()
+
+        self.font_var = tk.StringVar(value=self.font_family)
+        for f in FONTS:
+            font_menu.add_radiobutton(label=f, variable=self.font_var, value=f, command=lambda fam=f: self.set_font(fam))
+        menu_bar.add_cascade(label="Font", menu=font_menu)
+
+        self.root.config(menu=menu_bar)
+
+    def toggle_wrap(self):
+        self.wrap_enabled = self.wrap_var.get()
+        self.request_layout(f"Wrap text {'on' if self.wrap_enabled else 'off'}")
+
+
+### ================== Cursor & Status Updates =================== ###
+
+    def update_cursor_position(self):
+        # Bursts of key events collapse into one update per idle cycle
+        if self._cursor_job is None:
+            self._cursor_job = self.root.after_idle(self._update_cursor)
+
+    def _update_cursor(self):
+        self._cursor_job = None
+        try:
+            index = self.text_area.index("insert")
+            line, col = map(int, index.split("."))
+            if self.large_view is not None:
+                text = self._large_cursor_text(line, col)
+            else:
+                self.text_area.verify_index()
+                pos = self.text_area.offset_of("insert")
+                line, col = self.text_area.line_index.position(pos)
+                text = f"Ln : {line}   Col : {col+1}   Pos : {pos + 1}"
+            if self.search is not None:
+                text = f"{self.search.summary()}      {text}"
+
+            # Only update if the label still exists
+            if self.status_label and self.status_label.winfo_exists():
+                self.status_label.config(text=text)
+
+        except Exception as e:
+            print("Cursor update failed:", e)
+
+    def _sync_revision(self):
+        # Tk sets the modified flag on any edit and only reports the 0 -> 1 change,
+        # so fold it into the counter and re-arm it
+        if self.text_area.edit_modified():
+            self.revision += 1
+            self.text_area.edit_modified(False)
+
+    def mark_saved(self, digest, revision=None):
+        self._sync_revision()
+        self.saved_revision = self.revision if revision is None else revision
+        self.saved_hash = digest
+        if self.journal is not None and self.saved_revision == self.revision:
+            # Everything the journal holds is on disk now
+            self.journal.discard()
+            self.journal = None
+        self.update_tab_title()
+
+    def is_modified(self):
+        if self.loader is not None or self.large_view is not None:
+            return False
+        self._sync_revision()
+        return self.revision != self.saved_revision
+
+    def _on_modified(self):
+        self._sync_revision()
+        self.update_tab_title()
+
+
+### ====================== File Operations ======================= ###
+
+    def new_file(self):
+        doc = Document()
+        self.documents.insert(self.documents.index(self.current) + 1, doc)
+        self.activate(doc)
+
+    def clear_document(self):
+        self.cancel_load()
+        self.stop_follow()
+        self.stop_watch()
+        self.stop_highlighting()
+        self.close_large_view()
+        self.filename = None
+        self.file_stat = None
+        self.text_area.delete(1.0, tk.END)
+        self.mark_saved(content_digest(""))
+
+    def open_file(self):
+        from tkinter import filedialog
+        path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt"), ("Compressed Files", "*.gz *.bz2 *.xz"),
+                                                     ("All Files", "*.*")])
+        if path:
+            self.open_document(path)
+
+    def open_document(self, path, position=None, show=True):
+        doc = self.document_for(path)
+        if doc is not None:
+            if position:
+                doc.position = position
+            if show:
+                self.activate(doc)
+                if position and doc.loaded and self.large_view is None and self.loader is None:
+                    self.goto_position(position)
+            return doc
+        if show and self.filename is None and self.current.loaded and not self.is_modified() \
+                and self.text_area.compare("end-1c", "==", "1.0"):
+            # An empty untitled tab is reused instead of being left behind
+            self.load_file(path, position)
+            self.refresh_tabs()
+            return self.current
+        doc = Document(path, position)
+        self.documents.insert(self.documents.index(self.current) + 1, doc)
+        if show:
+            self.activate(doc)
+        else:
+            self.refresh_tabs()
+        return doc
+
+    def goto_position(self, position):
+        line, col = position
+        self.text_area.mark_set("insert", self.text_area.index_at(line, max(0, col - 1)))
+        self.text_area.see("insert")
+        self.update_cursor_position()
+
+    def load_file(self, path, position=None):
+        self.cancel_load()
+        self.stop_follow()
+        self.stop_watch()
+        self.stop_highlighting()
+        self.close_large_view()
+        self.file_stat = None
+        compression = detect_compression(path)
+        if compression is None and os.path.getsize(path) >= self.large_file_threshold:
+            self.open_large_file(path, position)
+            return
+        self._goto_after_load = position
+        self.filename = path
+        self.compression = compression
+        # Chunks should not pile up on the undo stack while streaming in
+        self.text_area.configure(undo=False)
+        self.text_area.delete("1.0", tk.END)
+        self.reset_search()
+        self.loader = ChunkedFileReader(path, compression=compression)
+        self.loader.start()
+        self.show_status(f"Loading {Path(path).name}...")
+        self._pump_load()
+
+    def _pump_load(self):
+        self._load_job = None
+        loader = self.loader
+        if loader is None:
+            return
+        deadline = time.perf_counter() + LOAD_FRAME_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                kind, payload = loader.chunks.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "data":
+                self.text_area.insert(tk.END, payload)
+            elif kind == "done":
+                self._finish_load()
+                return
+            else:
+                self._fail_load(payload)
+                return
+        expanded = f", {loader.expanded / (1024 * 1024):,.1f} MB expanded" if loader.compression else ""
+        self.show_status(f"Loading {Path(loader.path).name}... {loader.progress()}%{expanded}   (Esc to cancel)")
+        self._load_job = self.root.after(LOAD_POLL_MS, self._pump_load)
+
+    def _finish_load(self):
+        loader = self.loader
+        digest = loader.digest.hexdigest()
+        # Bytes actually read, which is where following picks up
+        self.file_stat = (loader.read_bytes, loader.stat, digest)
+        self.loader = None
+        self.text_area.configure(undo=True)
+        self.text_area.edit_reset()
+        self.mark_saved(digest)
+        self.current.loaded = True
+        self.watch_file()
+        self.start_highlighting()
+        line, col = self._goto_after_load or (1, 1)
+        self.text_area.mark_set("insert", self.text_area.index_at(line, max(0, col - 1)))
+        self.text_area.see("insert")
+        if loader.compression:
+            note = compression_note(loader.compression, loader.read_bytes, loader.expanded)
+            self.show_status(f"Loaded {Path(self.filename).name} ({note})", timeout=5000)
+        else:
+            self.show_status(f"Loaded {Path(self.filename).name}", timeout=2000)
+        self.update_cursor_position()
+
+    def _fail_load(self, error):
+        self._stop_loader()
+        self.filename = None
+        self.text_area.delete("1.0", tk.END)
+        self.mark_saved(content_digest(""))
+        self.current.loaded = True
+        self.show_status(f"Could not open file: {error}", timeout=5000)
+
+    def cancel_task(self, event=None):
+        self.cancel_load()
+        self.cancel_large_search()
+        self.cancel_replace_all()
+        self.cancel_search()
+        self.cancel_file_search()
+
+    def cancel_load(self):
+        if self.loader is None:
+            return
+        self._stop_loader()
+        # Partial content must not be saved over the original file
+        self.filename = None
+        self.current.loaded = True
+        self.mark_saved(None)
+        self.show_status("Loading cancelled, partial content shown", timeout=3000)
+
+    def _stop_loader(self):
+        self.loader.cancel()
+        self.loader = None
+        if self._load_job:
+            self.root.after_cancel(self._load_job)
+            self._load_job = None
+        self.text_area.configure(undo=True)
+        self.text_area.edit_reset()
+
+    def save_file(self, wait=False):
+        if self.large_view is not None:
+            self.show_status("Large files are opened read-only", timeout=3000)
+            return False
+        if self.filename:
+            expect = None
+            if self.follower is None and self.file_stat is not None:
+                expect = (stat_key(self.file_stat[1]), self.file_stat[2])
+            return self.submit_save(self.filename, wait, expect)
+        return self.save_file_as(wait)
+
+    def save_file_as(self, wait=False):
+        if self.large_view is not None:
+            self.show_status("Large files are opened read-only", timeout=3000)
+            return False
+        from tkinter import filedialog
+        path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text Files", "*.txt"),
+                                                                                ("Compressed Files", "*.gz *.bz2 *.xz")])
+        if not path:
+            return False
+        self.filename = path
+        self.compression = target_compression(path)
+        return self.submit_save(path, wait)
+
+    def submit_save(self, path, wait=False, expect=None):
+        # With wait, blocks until this write is on disk and returns whether it succeeded.
+        # With expect, the writer thread first checks the file still matches it
+        self._sync_revision()
+        content = self.text_area.snapshot("\n")
+        compression = self.compression if path == self.filename else target_compression(path)
+        follower = self.follower if path == self.filename else None
+        if follower is not None:
+            follower.suspend()
+        self._saves_in_flight += 1
+        self.show_status(f"Saving {Path(path).name}...")
+        errors = []
+        done = threading.Event()
+
+        def on_done(path, content, revision, error):
+            errors.append(error)
+            self._on_save_done(path, content, revision, error, follower, not wait)
+            done.set()
+        self.save_engine.submit(path, content, self.revision, on_done, compression, expect)
+        if not wait:
+            return True
+        # Set only after the result is recorded; the engine reports idle before on_done
+        done.wait()
+        if isinstance(errors[0], DiskChanged):
+            return self.confirm_overwrite(path, wait)
+        return errors == [None]
+
+    def _on_save_done(self, path, content, revision, error, follower=None, prompt=True):
+        # Called on the writer thread, so hash the snapshot here rather than on the UI
+        digest = disk_digest = st = note = None
+        if error is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                pass
+        if follower is not None:
+            # Before the hashing below, so appends made meanwhile are not held up
+            follower.resume(st)
+        if error is None:
+            digest = content.digest(len(content) - 1)
+            disk_digest = content.digest()
+            compression = detect_compression(path)
+            if compression and st is not None:
+                expanded = sum(len(chunk.encode("utf-8", "surrogatepass")) for chunk in content)
+                note = compression_note(compression, st.st_size, expanded)
+        self.root.after(0, lambda: self._save_finished(path, revision, digest, disk_digest, st, error, note, prompt))
+
+    def _save_finished(self, path, revision, digest, disk_digest, st, error, note=None, prompt=True):
+        self._saves_in_flight -= 1
+        if isinstance(error, SaveSuperseded):
+            return
+        if isinstance(error, DiskChanged):
+            if not prompt:
+                return
+            if path == self.filename:
+                self.confirm_overwrite(path)
+            else:
+                self.show_status(f"{Path(path).name} changed on disk and was not saved", timeout=5000)
+            return
+        if error is not None:
+            self.show_status(f"Could not save {Path(path).name}: {error}", timeout=5000)
+            return
+        if path == self.filename:
+            self.mark_saved(digest, revision)
+            if st is not None:
+                self.file_stat = (st.st_size, st, disk_digest)
+                if self.watcher is None or self.watcher.path != path:
+                    self.watch_file()
+            if self.highlight_enabled and lexer_for(path) is not (self.highlighter and self.highlighter.lexer):
+                # Save As gave the document a different kind of extension
+                self.start_highlighting()
+            self.refresh_tabs()
+        else:
+            # Saved from a tab that has since been switched away from
+            doc = self.document_for(path)
+            if doc is not None and doc is not self.current:
+                doc.saved_revision = revision
+                doc.saved_hash = digest
+                if st is not None:
+                    doc.file_stat = (st.st_size, st, disk_digest)
+                self.refresh_tabs()
+        if not self.save_engine.busy():
+            if note:
+                self.show_status(f"Saved {Path(path).name} ({note})", timeout=5000)
+            else:
+                self.show_status(f"Saved {Path(path).name}", timeout=2000)
+
+
+### ====================== Recovery Journal ====================== ###
+
+    def journal_header(self):
+        return {
+            "filename": self.filename,
+            "name": Path(self.filename).name if self.filename else "Untitled",
+            "digest": self.saved_hash,
+            "time": round(time.time()),
+        }
+
+    def journal_edit(self, edit):
+        # Nothing is journaled while a document is being loaded or torn down; its
+        # text is the file's, or about to be dropped, not the user's
+        if self.journal_paused or self.loader is not None or self.large_view is not None or not self.current.loaded:
+            return
+        if self.journal is None:
+            try:
+                self.journal = self.recovery.journal()
+            except OSError as e:
+                self.show_status(f"Recovery journal unavailable: {e}", timeout=4000)
+                return
+            if self.filename and self.saved_hash and self._file_unchanged():
+                # The text before this edit is the file on disk, so the log starts from it
+                self.journal.begin(self.journal_header())
+            else:
+                # The checkpoint already includes this edit
+                self.journal.begin(self.journal_header(), self.text_area.snapshot())
+                return
+        self.journal.record(edit)
+        if self._journal_job is None:
+            self._journal_job = self.root.after(RECOVERY_FLUSH_MS, self.flush_journal)
+
+    def _file_unchanged(self):
+        if self.file_stat is None:
+            return False
+        try:
+            return stat_key(os.stat(self.filename)) == stat_key(self.file_stat[1])
+        except OSError:
+            return False
+
+    def flush_journal(self):
+        if self._journal_job is not None:
+            self.root.after_cancel(self._journal_job)
+            self._journal_job = None
+        if self.journal is None:
+            return
+        self.journal.flush()
+        if self.journal.logged > max(RECOVERY_COMPACT_BYTES, self.text_area.line_index.char_count()):
+            # Replaying the log would cost more than the text itself, so fold it into a checkpoint
+            self.journal.begin(self.journal_header(), self.text_area.snapshot())
+
+    def offer_recovery(self):
+        sessions, journals = find_recovery()
+        if not sessions:
+            return
+        if journals:
+            names = ", ".join(header.get("name", "Untitled") for _, header, _ in journals)
+            action = self.ask_choice("Unsaved changes were left by a session that did not exit cleanly",
+                                     names, [("Restore", "restore"), ("Discard", "discard")])
+            if action is None:
+                # Dialog closed without an answer; ask again next time
+                return
+            if action == "restore":
+                lost = [header.get("name", "Untitled") for path, header, records in journals
+                        if not self.restore_journal(path, header, records)]
+                if lost:
+                    self.show_status(f"Could not recover {', '.join(lost)}: changed on disk since", timeout=6000)
+        import shutil
+        for session in sessions:
+            shutil.rmtree(session, ignore_errors=True)
+
+    def restore_journal(self, path, header, records):
+        try:
+            base = journal_base(path, header)
+        except (OSError, ValueError):
+            base = None
+        if base is None:
+            return False
+        if self.filename is not None or self.is_modified() or self.text_area.compare("end-1c", "!=", "1.0"):
+            self.new_file()
+        text = self.text_area
+        text.configure(undo=False)
+        self.journal_paused = True
+        text.insert("1.0", replay_journal(base, records))
+        self.journal_paused = False
+        text.configure(undo=True)
+        text.edit_reset()
+        # Saves go back to the original file, which no longer matches the buffer
+        self.filename = header.get("filename")
+        self.compression = detect_compression(self.filename) if self.filename else None
+        self.file_stat = None
+        self._sync_revision()
+        self.saved_hash = None
+        self.saved_revision = self.revision - 1
+        try:
+            self.journal = self.recovery.journal()
+            self.journal.begin(self.journal_header(), text.snapshot())
+        except OSError:
+            pass
+        self.start_highlighting()
+        self.update_cursor_position()
+        self.refresh_tabs()
+        return True
+
+
+### ============================ Tabs ============================ ###
+
+    def document_for(self, path):
+        # The shown document's fields live on self until it is deactivated
+        path = os.path.normcase(os.path.abspath(path))
+        for doc in self.documents:
+            filename = self.filename if doc is self.current else doc.filename
+            if filename and os.path.normcase(os.path.abspath(filename)) == path:
+                return doc
+        return None
+
+    def activate(self, doc):
+        if doc is self.current:
+            return
+        self._deactivate()
+        self.current = doc
+        self._use_counter += 1
+        doc.last_used = self._use_counter
+        for name in Document.STATE:
+            setattr(self, name, getattr(doc, name))
+        if self.text_area is None:
+            self.text_area = doc.text_area = self.make_text_area()
+        wrap_mode = "word" if self.wrap_enabled else "none"
+        if str(self.text_area.cget("wrap")) != wrap_mode:
+            self.text_area.configure(wrap=wrap_mode)
+        self.text_area.grid(row=1, column=1, sticky="nsew")
+        self.text_area.focus_set()
+        if doc.snapshot is not None:
+            self._restore_snapshot(doc)
+        elif not doc.loaded:
+            if os.path.isfile(doc.filename):
+                self.load_file(doc.filename, doc.position)
+            else:
+                doc.loaded = True
+                self.filename = None
+                self.show_status(f"{doc.name()} no longer exists", timeout=4000)
+        else:
+            self.watch_file()
+            self.recheck_disk()
+            self.start_highlighting()
+        self.schedule_gutter()
+        self.update_cursor_position()
+        self.refresh_tabs()
+        self.evict_inactive()
+
+    def _deactivate(self):
+        doc = self.current
+        if doc is None:
+            return
+        if self.loader is not None:
+            # Half-loaded text is dropped; the document loads again when shown.
+            # Cleared before the loader is released so it does not count as an edit
+            self.text_area.delete("1.0", tk.END)
+            self._stop_loader()
+            self.mark_saved(content_digest(""))
+            doc.loaded = False
+            doc.position = self._goto_after_load
+            self._goto_after_load = None
+        elif self.large_view is None:
+            line, col = map(int, self.text_area.index("insert").split("."))
+            doc.position = (line, col + 1)
+        self.cancel_large_search()
+        self.cancel_replace_all()
+        self.reset_search()
+        self.stop_follow()
+        self.stop_watch()
+        self.stop_highlighting()
+        self.flush_journal()
+        self._sync_revision()
+        doc.yview = self.text_area.yview()[0]
+        doc.size = self.text_area.line_index.char_count()
+        for name in Document.STATE:
+            setattr(doc, name, getattr(self, name))
+        self.text_area.grid_remove()
+
+    def evict_inactive(self):
+        # Least recently shown first, until the inactive widgets fit the budget
+        live = sorted((doc for doc in self.documents if doc is not self.current and doc.text_area is not None),
+                      key=lambda doc: doc.last_used)
+        total = sum(doc.size for doc in live)
+        for doc in live:
+            if total <= self.tab_memory:
+                break
+            if self.evict(doc):
+                total -= doc.size
+
+    def evict(self, doc):
+        if doc.large_view is not None:
+            doc.large_view.close()
+            doc.large_view = None
+            doc.large_lines = []
+            doc.loaded = False
+        elif doc.loaded and (doc.modified() or not self._matches_disk(doc)):
+            try:
+                if self._snapshot_dir is None:
+                    self._snapshot_dir = tempfile.mkdtemp(prefix="notepd-tabs-")
+                doc.snapshot = write_snapshot(self._snapshot_dir, doc.text_area.snapshot())
+            except OSError:
+                return False
+        else:
+            # Unchanged since it was read, so the file itself is the snapshot
+            doc.loaded = doc.filename is None
+        doc.text_area.destroy()
+        doc.text_area = None
+        return True
+
+    def _matches_disk(self, doc):
+        if not doc.filename or doc.file_stat is None:
+            return False
+        try:
+            return stat_key(os.stat(doc.filename)) == stat_key(doc.file_stat[1])
+        except OSError:
+            return False
+
+    def _restore_snapshot(self, doc):
+        try:
+            content = read_snapshot(doc.snapshot)
+        except (OSError, ValueError) as e:
+            self.show_status(f"Could not restore {doc.name()}: {e}", timeout=5000)
+            content = ""
+        try:
+            os.unlink(doc.snapshot)
+        except OSError:
+            pass
+        doc.snapshot = None
+        modified = doc.modified()
+        self.text_area.configure(undo=False)
+        # The journal already holds this text
+        self.journal_paused = True
+        self.text_area.insert("1.0", content)
+        self.journal_paused = False
+        self.text_area.configure(undo=True)
+        self.text_area.edit_reset()
+        self._sync_revision()
+        self.saved_revision = self.revision - 1 if modified else self.revision
+        doc.loaded = True
+        if doc.position:
+            self.goto_position(doc.position)
+        self.text_area.yview_moveto(doc.yview)
+        self.watch_file()
+        self.recheck_disk()
+        self.start_highlighting()
+
+    def discard_document(self, doc):
+        if doc.journal is not None:
+            doc.journal.discard()
+        if doc.large_view is not None:
+            doc.large_view.close()
+        if doc.text_area is not None:
+            doc.text_area.destroy()
+        if doc.snapshot is not None:
+            try:
+                os.unlink(doc.snapshot)
+            except OSError:
+                pass
+        self.documents.remove(doc)
+
+    def close_tab(self, doc=None):
+        doc = doc or self.current
+        modified = self.is_modified() if doc is self.current else doc.modified()
+        if modified:
+            self.activate(doc)
+            if not self.confirm_discard_changes():
+                return
+        if len(self.documents) == 1:
+            self.clear_document()
+            return
+        if doc is self.current:
+            i = self.documents.index(doc)
+            self.activate(self.documents[i + 1] if i + 1 < len(self.documents) else self.documents[i - 1])
+        self.discard_document(doc)
+        self.refresh_tabs()
+
+    def cycle_tab(self, step):
+        i = self.documents.index(self.current)
+        self.activate(self.documents[(i + step) % len(self.documents)])
+        return "break"
+
+    def tab_title(self, doc):
+        if doc is self.current:
+            name = Path(self.filename).name if self.filename else "Untitled"
+        else:
+            name = doc.name()
+        if len(name) > TAB_TITLE_LIMIT:
+            name = name[:TAB_TITLE_LIMIT - 1] + "…"
+        modified = self.is_modified() if doc is self.current else doc.modified()
+        return f"{name} ●" if modified else name
 
-        self.find_bar_visible = self.find_bar_state
-        self.find_bar = None
-        self.status_label = None
-        self.match_case = tk.IntVar()
-        self.wrap_around = tk.IntVar(value=1)
-        self.search_direction = tk.StringVar(value="down")
+    def update_tab_title(self):
+        tab = self.current.tab if self.current else None
+        if tab is not None and tab.winfo_exists():
+            tab.configure(text=self.tab_title(self.current))
 
-        self.create_widgets()
-        self.text_area.drop_target_register(DND_FILES)
-        self.text_area.dnd_bind('<<Drop>>', self.handle_drop)
+    def refresh_tabs(self):
+        if self._tabs_job is None:
+            self._tabs_job = self.root.after_idle(self.draw_tabs)
 
-        self.root.after(200, self.create_menu)
-        self.root.after(200, self.bind_shortcuts)
+    def draw_tabs(self):
+        self._tabs_job = None
+        for child in self.tab_bar.winfo_children():
+            child.destroy()
+        if len(self.documents) < 2:
+            self.tab_bar.grid_remove()
+            return
+        self.tab_bar.grid()
+        for doc in self.documents:
+            bg = LIGHTGRAY_BG if doc is self.current else MIDGRAY_BG
+            tab = tk.Frame(self.tab_bar, bg=bg)
+            tab.pack(side="left", padx=(0, 1))
+            label = tk.Label(tab, text=self.tab_title(doc), bg=bg, fg=LIGHT_TEXT, padx=8, pady=2)
+            label.pack(side="left")
+            close = tk.Label(tab, text="✕", bg=bg, fg="#606060", padx=4)
+            close.pack(side="left")
+            for widget in (tab, label):
+                widget.bind("<Button-1>", lambda e, d=doc: self.activate(d))
+                widget.bind("<Button-2>", lambda e, d=doc: self.close_tab(d))
+            close.bind("<Button-1>", lambda e, d=doc: self.close_tab(d))
+            doc.tab = label
 
-        if self.find_bar_visible:
-            self.toggle_find_bar()
 
-        self.update_cursor_position()
-        self.root.protocol("WM_DELETE_WINDOW", self.hide_and_reset)
+### ======================== Follow Mode ========================= ###
 
-    def handle_drop(self, event):
-        path = event.data.strip('{}')
-        if os.path.isfile(path):
-            if self.confirm_discard_changes():
-                self.filename = path
-                with open(path, "r", encoding="utf-8") as file:
-                    content = file.read()
-                    self.text_area.delete("1.0", tk.END)
-                    self.text_area.insert(tk.END, content)
-                    self.last_saved_text = content
+    def toggle_follow(self):
+        if self.follow_var.get():
+            self.start_follow()
+        else:
+            self.stop_follow()
+            self.watch_file()
 
-    def load_config(self):
-        self.font_family = "Consolas"
-        self.font_size = 12
-        self.window_size = None
-        self.find_bar_state = False
-        self.wrap_state = True
+    def start_follow(self):
+        if self.follower is not None:
+            return
+        if not self.filename or self.file_stat is None or self.large_view is not None or self.loader is not None:
+            self.show_status("Follow needs a fully loaded file", timeout=3000)
+            self.follow_var.set(False)
+            return
+        if self.compression:
+            self.show_status("Compressed files cannot be followed", timeout=3000)
+            self.follow_var.set(False)
+            return
+        offset, st, _ = self.file_stat
+        self.follower = FileFollower(
+            self.filename, offset, file_identity(st),
+            lambda text: self.root.after(0, lambda: self._follow_append(text)),
+            lambda reason: self.root.after(0, lambda: self.show_status(f"File was {reason}, following from its start", timeout=4000)),
+        )
+        # The follower reads every change itself; the watcher would re-hash the whole file
+        self.stop_watch()
+        # Appended text is not an edit, so keep it off the undo stack while following
+        self.text_area.configure(undo=False)
+        self.text_area.edit_reset()
+        self.follower.start()
+        self.show_status(f"Following {Path(self.filename).name}", timeout=2000)
 
-        if os.path.exists(CONFIG_PATH):
+    def stop_follow(self):
+        if self.follower is None:
+            return
+        self.follower.stop()
+        if not self.is_modified():
+            # Everything appended so far is in the buffer, so it matches the file again
             try:
-                with open(CONFIG_PATH, "r") as f:
-                    data = json.load(f)
-                    self.font_family = data.get("font_family", self.font_family)
-                    self.font_size = data.get("font_size", self.font_size)
-                    self.window_size = data.get("window_size", self.window_size)
-                    self.find_bar_state = data.get("find_bar_visible", False)
-                    self.wrap_state = data.get("wrap_enabled", True)
-            except Exception:
-                pass
-
-    def save_config(self):
-        data = {
-            "font_family": self.font_family,
-            "font_size": self.font_size,
-            "window_size": self.root.geometry(),
-            "find_bar_visible": bool(self.find_bar and self.find_bar.winfo_exists()),
-            "wrap_enabled": self.wrap_enabled
-        }
-        try:
-            with open(CONFIG_PATH, "w") as f:
-                json.dump(data, f)
-        except Exception:
+                self.file_stat = (self.follower.offset, os.stat(self.filename),
+                                  self.text_area.snapshot().digest())
+            except OSError:
                 pass
+        self.follower = None
+        self.text_area.configure(undo=True)
+        if getattr(self, "follow_var", None) is not None:
+            self.follow_var.set(False)
 
-    def save_config(self):
-        data = {
-            "font_family": self.font_family,
-            "font_size": self.font_size,
-            "window_size": self.root.geometry(),
-            "find_bar_visible": bool(self.find_bar and self.find_bar.winfo_exists()),
-            "wrap_enabled": self.wrap_enabled
-        }
-        try:
-            with open(CONFIG_PATH, "w") as f:
-                json.dump(data, f)
-        except Exception:
-            pass
+    def _follow_append(self, text):
+        if self.follower is None:
+            return
+        clean = not self.is_modified()
+        at_bottom = self.text_area.yview()[1] >= 1.0
+        # Appends to a clean buffer only repeat the file, so they are not journaled
+        self.journal_paused = clean
+        self.text_area.insert(tk.END, text)
+        self.journal_paused = False
+        if clean:
+            # Buffer still matches the file on disk; the old digest no longer does
+            self.mark_saved(None)
+        if at_bottom:
+            self.text_area.see(tk.END)
 
 
-### ====================== UI Construction ======================= ###
+### ==================== Syntax Highlighting ===================== ###
 
-    def create_widgets(self):
-        self.text_frame = tk.Frame(self.root, bg=LIGHTGRAY_BG)
-        self.text_frame.grid(row=0, column=0, sticky="nsew")
+    def toggle_highlighting(self):
+        self.highlight_enabled = self.highlight_var.get()
+        if self.highlight_enabled:
+            self.start_highlighting()
+        else:
+            self.stop_highlighting()
+        self.save_config()
 
-        wrap_mode = "word" if self.wrap_enabled else "none"
+    def start_highlighting(self):
+        self.stop_highlighting()
+        if not self.highlight_enabled or self.large_view is not None or self.loader is not None:
+            return
+        lexer = lexer_for(self.filename)
+        if lexer is not None:
+            self.highlighter = Highlighter(self.text_area, lexer)
+            self.highlighter.start()
 
-        self.text_area = tk.Text(
-            self.text_frame, wrap=wrap_mode, undo=True, font=self.text_font,
-            bg=LIGHTGRAY_BG, fg=LIGHT_TEXT, insertbackground=LIGHT_TEXT,
-            padx=10, pady=5, relief="flat"
-        )
-        self.text_area.grid(row=0, column=0, sticky="nsew")
+    def stop_highlighting(self):
+        if self.highlighter is not None:
+            self.highlighter.close()
+            self.highlighter = None
 
-        self.scroll_y = ttk.Scrollbar(self.text_frame, command=self.text_area.yview, style="Vertical.TScrollbar")
-        self.scroll_y.grid(row=0, column=1, sticky="ns")
-        self.text_area.configure(yscrollcommand=self.scroll_y.set)
 
-        self.scroll_x = ttk.Scrollbar(self.text_frame, orient="horizontal", command=self.text_area.xview, style="Horizontal.TScrollbar")
-        self.scroll_x.grid(row=1, column=0, sticky="ew")
-        self.text_area.configure(xscrollcommand=self.scroll_x.set)
-        self.scroll_x.grid_remove()
+### ====================== External Changes ====================== ###
 
-        if not self.wrap_enabled:
-            self.scroll_x.grid()
+    def watch_file(self):
+        self.stop_watch()
+        if not self.filename or self.file_stat is None or self.follower is not None:
+            return
+        path = self.filename
+        self.watcher = FileWatcher(path, lambda st: self._check_disk(path, st))
+        self.watcher.start()
 
-        self.root.grid_rowconfigure(0, weight=1)
-        self.root.grid_columnconfigure(0, weight=1)
-        self.text_frame.grid_rowconfigure(0, weight=1)
-        self.text_frame.grid_columnconfigure(0, weight=1)
+    def stop_watch(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
 
-        self.text_area.bind("<KeyRelease>", lambda e: self.update_cursor_position())
-        self.text_area.bind("<ButtonRelease>", lambda e: self.update_cursor_position())
+    def recheck_disk(self):
+        # Inactive documents are not watched, so catch up on what happened meanwhile
+        if not self.filename or self.file_stat is None:
+            return
+        path = self.filename
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is None or stat_key(st) != stat_key(self.file_stat[1]):
+            threading.Thread(target=self._check_disk, args=(path, st), daemon=True).start()
 
+    def _check_disk(self, path, st):
+        # Watcher thread: hash the new contents here so a touch or an identical
+        # rewrite never reaches the UI
+        digest = None
+        if st is not None:
+            try:
+                text, st = read_text_snapshot(path)
+            except (OSError, UnicodeDecodeError):
+                return
+            digest = content_digest(text)
+        self.root.after(0, lambda: self._external_change(path, st, digest))
 
-### ======================= Menu Creation ======================== ###
+    def _external_change(self, path, st, digest):
+        if path != self.filename or self.file_stat is None or self.follower is not None:
+            return
+        if self._saves_in_flight or self._disk_prompt:
+            # Our own write; _save_finished records what it produced
+            return
+        if st is None:
+            self.show_status(f"{Path(path).name} was deleted or moved on disk", timeout=5000)
+            return
+        if digest == self.file_stat[2]:
+            self.file_stat = (st.st_size, st, digest)
+            return
+        self._disk_prompt = True
+        try:
+            lead = "Changed on disk, reload and discard your edits in" if self.is_modified() else "Changed on disk, reload"
+            action = self.ask_choice(lead, Path(path).name, [("Reload", "reload"), ("Keep Mine", "keep")])
+        finally:
+            self._disk_prompt = False
+        if action == "reload":
+            self.reload_from_disk()
+        else:
+            # Acknowledged; a later save overwrites without asking again
+            self.file_stat = (st.st_size, st, digest)
 
-    def create_menu(self):
-        menu_bar = tk.Menu(self.root, bg=LIGHTGRAY_BG, fg=DARKGRAY_BG, activebackground=BUTTON_ACTIVE, activeforeground=LIGHT_TEXT, tearoff=0)
+    def confirm_overwrite(self, path, wait=False):
+        # The save found the file changed on disk and did not write it
+        self._disk_prompt = True
+        try:
+            action = self.ask_choice("Changed on disk since it was opened, overwrite",
+                                     Path(path).name,
+                                     [("Overwrite", "overwrite"), ("Reload", "reload"), ("Cancel", "cancel")])
+        finally:
+            self._disk_prompt = False
+        if action == "overwrite":
+            return self.submit_save(path, wait)
+        if action == "reload":
+            self.reload_from_disk()
+        else:
+            self.clear_status()
+        return False
 
-        file_menu = tk.Menu(menu_bar, tearoff=0)
-        file_menu.add_command(label="New", command=self.new_file)
-        file_menu.add_command(label="Open...", command=self.open_file)
-        file_menu.add_command(label="Save", command=self.save_file)
-        file_menu.add_command(label="Save As...", command=self.save_file_as)
-        file_menu.add_separator()
-        file_menu.add_command(label="Print...", command=self.print_file)
-        file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.exit_app)
-        menu_bar.add_cascade(label="File", menu=file_menu)
+    def reload_from_disk(self):
+        # Diff off the UI thread against a snapshot, then patch only the changed lines
+        # so the cursor, scroll position and undo history stay put
+        path = self.filename
+        self._sync_revision()
+        revision = self.revision
+        old = self.text_area.snapshot()
+        self.show_status(f"Reloading {Path(path).name}...")
 
-        font_menu = tk.Menu(menu_bar, tearoff=0)
-        self.wrap_var = tk.BooleanVar(value=self.wrap_enabled)
-        font_menu.add_checkbutton(label="Wrap text", variable=self.wrap_var, command=self.toggle_wrap)
-        font_menu.add_separator()
+        def work():
+            try:
+                new, st = read_text_snapshot(path)
+            except (OSError, UnicodeDecodeError) as e:
+                error = e
+                self.root.after(0, lambda: self.show_status(f"Could not reload: {error}", timeout=5000))
+                return
+            changes = line_changes(old.text(), new)
+            digest = content_digest(new)
+            self.root.after(0, lambda: self._apply_reload(path, revision, changes, digest, st))
+        threading.Thread(target=work, daemon=True).start()
 
-        self.font_var = tk.StringVar(value=self.font_family)
-        for f in FONTS:
-            font_menu.add_radiobutton(label=f, variable=self.font_var, value=f, command=lambda fam=f: self.set_font(fam))
-        menu_bar.add_cascade(label="Font", menu=font_menu)
+    def _apply_reload(self, path, revision, changes, digest, st):
+        if path != self.filename or self.large_view is not None:
+            return
+        self._sync_revision()
+        if self.revision != revision:
+            # Edited while the diff ran; start over from the current buffer
+            self.reload_from_disk()
+            return
+        text = self.text_area
+        text.configure(autoseparators=False)
+        text.edit_separator()
+        # The buffer ends up matching the file, which mark_saved below records
+        self.journal_paused = True
+        for start, stop, replacement in changes:
+            text.delete(start, stop)
+            if replacement:
+                text.insert(start, replacement)
+        self.journal_paused = False
+        text.edit_separator()
+        text.configure(autoseparators=True)
+        self.mark_saved(digest)
+        self.file_stat = (st.st_size, st, digest)
+        self.show_status(f"Reloaded {Path(path).name}, {len(changes)} changed region(s)", timeout=3000)
 
-        self.root.config(menu=menu_bar)
 
-    def toggle_wrap(self):
-        self.wrap_enabled = self.wrap_var.get()
-        wrap_mode = "word" if self.wrap_enabled else "none"
-        self.text_area.configure(wrap=wrap_mode)
-        if self.wrap_enabled:
-            self.scroll_x.grid_remove()
-        else:
-            self.scroll_x.grid()
-        self.save_config()
+### ====================== Large File Mode ======================= ###
 
+    def open_large_file(self, path, position=None):
+        try:
+            view = MappedDocument(path)
+        except (OSError, ValueError) as e:
+            self.show_status(f"Could not open file: {e}", timeout=5000)
+            return
+        self.reset_search()
+        self.large_view = view
+        self.filename = path
+        self.current.loaded = True
+        view.start_indexing()
+        self.text_area.configure(undo=False)
+        self.text_area.edit_reset()
+        top = 0
+        if position and position[0] > 1:
+            top = view.next_lines(0, position[0] - 1)
+        self.render_large(top)
+        size_mb = view.size / (1024 * 1024)
+        self.show_status(f"{Path(path).name} ({size_mb:,.0f} MB) opened read-only in large-file mode", timeout=5000)
 
-### ================== Cursor & Status Updates =================== ###
+    def close_large_view(self):
+        view = self.large_view
+        if view is None:
+            return
+        self.cancel_large_search()
+        self.large_view = None
+        self.large_lines = []
+        self.text_area.configure(state="normal")
+        self.text_area.delete("1.0", tk.END)
+        self.text_area.configure(undo=True)
+        self.text_area.edit_reset()
+        self.mark_saved(content_digest(""))
+        view.close()
 
-    def update_cursor_position(self):
-        self.root.after_idle(self._update_cursor)
+    def _visible_rows(self):
+        linespace = max(1, self.text_font.metrics("linespace"))
+        return max(10, self.text_area.winfo_height() // linespace + 1)
 
-    def _update_cursor(self):
-        try:
-            index = self.text_area.index("insert")
-            line, col = map(int, index.split("."))
-            count = self.text_area.count("1.0", "insert", "chars")
-            pos = count[0] + 1 if count else 1
+    def render_large(self, top):
+        view = self.large_view
+        starts, end, text = view.read_window(top, self._visible_rows())
+        self.large_lines = starts
+        self.text_area.configure(state="normal")
+        self.text_area.delete("1.0", tk.END)
+        self.text_area.insert("1.0", text)
+        self.text_area.configure(state="disabled")
+        self.text_area.mark_set("insert", "1.0")
+        if view.size:
+            self.scroll_y.set(top / view.size, end / view.size)
+        self.update_cursor_position()
+        self.schedule_gutter()
 
-            # Only update if the label still exists
-            if self.status_label and self.status_label.winfo_exists():
-                self.status_label.config(text=f"Ln : {line}   Col : {col+1}   Pos : {pos}")
+    def _large_yview(self, *args):
+        view = self.large_view
+        if args[0] == "moveto":
+            self.render_large(view.line_start(int(float(args[1]) * view.size)))
+        elif args[0] == "scroll":
+            count = int(args[1])
+            self._large_scroll(count if args[2] == "units" else count * self._visible_rows())
 
-        except Exception as e:
-            print("Cursor update failed:", e)
+    def _large_scroll(self, lines):
+        view = self.large_view
+        if view is None:
+            return None
+        top = self.large_lines[0] if self.large_lines else 0
+        if lines > 0:
+            top = min(view.next_lines(top, lines), view.line_start(view.size))
+        else:
+            top = view.previous_lines(top, -lines)
+        self.render_large(top)
+        return "break"
 
-    def is_modified(self):
-        current = self.text_area.get("1.0", tk.END).strip()
-        return current != self.last_saved_text.strip()
+    def _large_step(self, direction):
+        if self.large_view is None:
+            return None
+        line = int(self.text_area.index("insert").split(".")[0])
+        if direction < 0 and line == 1:
+            return self._large_scroll(-1)
+        if direction > 0 and line >= len(self.large_lines):
+            self._large_scroll(1)
+            self.text_area.mark_set("insert", f"{len(self.large_lines)}.0")
+            return "break"
+        return None
 
+    def _large_jump(self, offset):
+        view = self.large_view
+        if view is None:
+            return None
+        if offset is None:
+            offset = view.previous_lines(view.size, self._visible_rows() - 1)
+        self.render_large(offset)
+        return "break"
 
-### ====================== File Operations ======================= ###
+    def _large_offset_of(self, index):
+        line, col = map(int, self.text_area.index(index).split("."))
+        line = min(line, len(self.large_lines))
+        text = self.text_area.get(f"{line}.0", f"{line}.{col}")
+        return self.large_lines[line - 1] + len(text.encode("utf-8"))
 
-    def new_file(self):
-        if self.confirm_discard_changes():
-            self.filename = None
-            self.text_area.delete(1.0, tk.END)
-            self.last_saved_text = ""
+    def _large_cursor_text(self, line, col):
+        offset = self._large_offset_of("insert")
+        number = self.large_view.line_number(offset)
+        if number is None:
+            number = f"? (indexing {self.large_view.progress()}%)"
+        return f"Ln : {number}   Col : {col+1}   Byte : {offset + 1}"
 
-    def open_file(self):
-        if not self.confirm_discard_changes():
+    def _find_in_large(self, backwards):
+        view = self.large_view
+        options = (bool(self.regex_mode.get()), bool(self.whole_word.get()))
+        flags = re.MULTILINE if self.match_case.get() else re.MULTILINE | re.IGNORECASE
+        source = build_pattern_source(self.find_entry.get(), *options).encode("utf-8")
+        try:
+            pattern = compile_pattern(source, flags)
+        except re.error as e:
+            self.show_status(f"Invalid pattern: {e}", timeout=4000)
             return
-        path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt")])
-        if path:
-            self.filename = path
-            with open(path, "r", encoding="utf-8") as file:
-                content = file.read()
-                self.text_area.delete("1.0", tk.END)
-                self.text_area.insert(tk.END, content)
-                self.last_saved_text = content
-
-    def save_file(self):
-        if self.filename:
-            content = self.text_area.get("1.0", tk.END)
-            with open(self.filename, "w", encoding="utf-8") as file:
-                file.write(content)
-            self.last_saved_text = content
+        self.cancel_large_search()
+        cancelled = threading.Event()
+        self._large_search = cancelled
+        if self.text_area.tag_ranges("found"):
+            start = self._large_offset_of("found.first" if backwards else "found.last")
         else:
-            self.save_file_as()
+            start = self._large_offset_of("insert")
+        wrap = bool(self.wrap_around.get())
+        self.show_status("Searching...   (Esc to cancel)")
 
-    def save_file_as(self):
-        path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text Files", "*.txt")])
-        if path:
-            self.filename = path
-            content = self.text_area.get("1.0", tk.END)
-            with open(path, "w", encoding="utf-8") as file:
-                file.write(content)
-            self.last_saved_text = content
+        def work():
+            error = None
+            if options[0]:
+                result = find_isolated(view.path, source, flags, start, backwards, wrap, cancelled)
+                if result is None:
+                    return
+                match, error = (result[1], None) if result[0] == "ok" else (None, result[1])
+            else:
+                try:
+                    match = view.find(pattern, start, backwards, wrap, cancelled)
+                except ValueError:
+                    return
+            if not cancelled.is_set():
+                self.root.after(0, lambda: self._large_found(view, match, error))
+        threading.Thread(target=work, daemon=True).start()
+
+    def _large_found(self, view, match, error=None):
+        self._large_search = None
+        if view is not self.large_view:
+            return
+        if error is not None:
+            self.show_status(f"Pattern failed: {error}", timeout=4000)
+            return
+        if match is None:
+            self.show_status("No matches", timeout=2000)
+            return
+        self.clear_status()
+        start, end = match
+        # Leave a few lines of context above the hit
+        self.render_large(view.previous_lines(view.line_start(start), 3))
+        line = bisect_right(self.large_lines, start)
+        col = len(view.decode(self.large_lines[line - 1], start))
+        length = len(view.decode(start, end))
+        first = self.text_area.index_at(line, col)
+        last = self.text_area.index_of(self.text_area.offset_of(first) + length)
+        self.text_area.tag_add("found", first, last)
+        self.text_area.mark_set("insert", last if self.search_direction.get() == "down" else first)
+        self.text_area.see(first)
+        self.update_cursor_position()
+
+    def cancel_large_search(self):
+        if self._large_search is not None:
+            self._large_search.set()
+            self._large_search = None
+            self.show_status("Search cancelled", timeout=2000)
 
 
 ### ======================= Exit Handling ======================== ###
@@ -299,9 +4188,25 @@ class Notepad:
     def confirm_discard_changes(self):
         if not self.is_modified():
             return True
-        if not self.text_area.get("1.0", tk.END).strip():
+        if not self.text_area.search(r"\S", "1.0", tk.END, regexp=True):
+            return True
+        # Edits that were undone back to the saved text leave the revision behind
+        if self.saved_hash and self.text_area.snapshot().digest() == self.saved_hash:
+            self.mark_saved(self.saved_hash)
+            return True
+
+        file_display = Path(self.filename).name if self.filename else "Untitled"
+        action = self.ask_choice("Do you want to save changes to", file_display,
+                                 [("Save", "save"), ("Don't Save", "discard"), ("Cancel", "cancel")])
+        if action == "save":
+            # The document goes away once this returns, so the write has to have
+            # succeeded first; a failure is reported by _save_finished
+            return self.save_file(wait=True)
+        elif action == "discard":
             return True
+        return False
 
+    def ask_choice(self, message, file_display, buttons):
         dialog = tk.Toplevel(self.root)
         dialog.title("Notepd")
         dialog.configure(bg=DARKGRAY_BG)
@@ -329,10 +4234,8 @@ class Notepad:
         dialog.geometry(f"+{x}+{y}")
 
 
-        file_display = Path(self.filename).name if self.filename else "Untitled"
-
         # Main message
-        tk.Label(dialog, text="Do you want to save changes to",
+        tk.Label(dialog, text=message,
                  bg=DARKGRAY_BG, fg=LIGHT_TEXT, font=("Segoe UI", 12)
         ).pack(pady=(20, 0), padx=12, anchor="w")
 
@@ -350,52 +4253,93 @@ class Notepad:
         btn_frame = tk.Frame(dialog, bg=DARKGRAY_BG)
         btn_frame.pack(side="bottom", fill="x", padx=10, pady=10)
 
-        tk.Frame(btn_frame, width=140, bg=DARKGRAY_BG).pack(side="left")  # spacer
+        tk.Frame(btn_frame, width=140 + 107 * (3 - len(buttons)), bg=DARKGRAY_BG).pack(side="left")  # spacer
         def styled_btn(txt, act):
             return tk.Button(btn_frame, text=txt, width=10, command=lambda: do(act),
                              bg=LIGHTGRAY_BG, fg=LIGHT_TEXT, relief="flat", padx=10, pady=3)
 
-        styled_btn("Save", "save").pack(side="left", padx=5)
-        styled_btn("Don't Save", "discard").pack(side="left", padx=5)
-        styled_btn("Cancel", "cancel").pack(side="left", padx=5)
+        for txt, act in buttons:
+            styled_btn(txt, act).pack(side="left", padx=5)
 
         dialog.transient(self.root)
         dialog.grab_set()
         self.root.wait_window(dialog)
+        return result["action"]
 
-        if result["action"] == "save":
-            self.save_file()
-            return True
-        elif result["action"] == "discard":
-            return True
-        return False
+    def confirm_discard_all(self):
+        for doc in list(self.documents):
+            modified = self.is_modified() if doc is self.current else doc.modified()
+            if modified:
+                self.activate(doc)
+                if not self.confirm_discard_changes():
+                    return False
+        return True
 
     def hide_and_reset(self):
-        if self.confirm_discard_changes():
-            self.filename = None
-            self.text_area.delete("1.0", tk.END)
-            self.last_saved_text = ""
+        if self.confirm_discard_all():
+            for doc in list(self.documents):
+                if doc is not self.current:
+                    self.discard_document(doc)
+            self.clear_document()
+            self.refresh_tabs()
             self.root.withdraw()
 
     def exit_app(self):
         self.save_config()
-        if self.confirm_discard_changes():
+        if self.confirm_discard_all():
+            if self.loader:
+                self.loader.cancel()
+            self.stop_follow()
+            self.stop_watch()
+            self.cancel_file_search()
+            self.config_store.flush()
+            self.save_engine.flush()
+            self.recovery.close()
+            if self._snapshot_dir:
+                import shutil
+                shutil.rmtree(self._snapshot_dir, ignore_errors=True)
             self.root.destroy()
 
     def set_font(self, family):
         self.font_family = family
         self.font_var.set(family)
-        self.text_font.config(family=family)
-        self.save_config()
+        self.request_layout(f"Font {family}")
 
     def zoom_with_scroll(self, event):
         if event.delta > 0:
             self.font_size += 1
         else:
             self.font_size = max(8, self.font_size - 1)
-        self.text_font.configure(size=self.font_size)
+        self.request_layout(f"Zoom {self.font_size} pt")
+
+    def request_layout(self, preview):
+        # Each font or wrap change relayouts the whole text, so a burst of them
+        # (a zoom gesture) is applied once, after input goes quiet
+        self.show_status(preview, timeout=RELAYOUT_DELAY_MS + 1000)
+        if self._layout_job is not None:
+            self.root.after_cancel(self._layout_job)
+        self._layout_job = self.root.after(RELAYOUT_DELAY_MS, self.apply_layout)
         self.save_config()
 
+    def apply_layout(self):
+        if self._layout_job is not None:
+            self.root.after_cancel(self._layout_job)
+            self._layout_job = None
+        # The line at the top of the window stays there
+        anchor = self.text_area.index("@0,0")
+        wrap_mode = "word" if self.wrap_enabled else "none"
+        if str(self.text_area.cget("wrap")) != wrap_mode:
+            self.text_area.configure(wrap=wrap_mode)
+        if self.wrap_enabled:
+            self.scroll_x.grid_remove()
+        else:
+            self.scroll_x.grid()
+        if self.text_font.cget("family") != self.font_family or self.text_font.cget("size") != self.font_size:
+            self.text_font.configure(family=self.font_family, size=self.font_size)
+        self.text_area.yview(anchor)
+        self._gutter_digits = 0
+        self.schedule_gutter()
+
 
 ### ===================== Find/Replace Logic ===================== ###
   
@@ -412,6 +4356,7 @@ class Notepad:
 
         self.find_entry = tk.Entry(self.find_bar, bg=LIGHTGRAY_BG, fg=LIGHT_TEXT, insertbackground=LIGHT_TEXT)
         self.find_entry.grid(row=0, column=0, padx=5, pady=(0, 0), sticky="ew")
+        self.find_entry.bind("<KeyRelease>", lambda e: self.schedule_search())
 
         find_btn = tk.Button(self.find_bar, text="Find Next", command=self.do_find,
                              bg=MIDGRAY_BG, fg=LIGHT_TEXT, activebackground=BUTTON_ACTIVE,
@@ -442,24 +4387,195 @@ class Notepad:
 
         tk.Checkbutton(self.find_bar, text="Wrap around", variable=self.wrap_around,
                        bg=DARKGRAY_BG, fg=LIGHT_TEXT, selectcolor=DARKGRAY_BG, activebackground=MIDGRAY_BG).grid(row=1, column=0, sticky="w", padx=5)
-        tk.Checkbutton(self.find_bar, text="Match case", variable=self.match_case,
+        tk.Checkbutton(self.find_bar, text="Match case", variable=self.match_case, command=self.schedule_search,
                        bg=DARKGRAY_BG, fg=LIGHT_TEXT, selectcolor=DARKGRAY_BG, activebackground=MIDGRAY_BG).grid(row=1, column=0, sticky="w", padx=(120, 5))
+        tk.Checkbutton(self.find_bar, text="Whole word", variable=self.whole_word, command=self.schedule_search,
+                       bg=DARKGRAY_BG, fg=LIGHT_TEXT, selectcolor=DARKGRAY_BG, activebackground=MIDGRAY_BG).grid(row=1, column=0, sticky="w", padx=(230, 5))
+        tk.Checkbutton(self.find_bar, text="Regex", variable=self.regex_mode, command=self.schedule_search,
+                       bg=DARKGRAY_BG, fg=LIGHT_TEXT, selectcolor=DARKGRAY_BG, activebackground=MIDGRAY_BG).grid(row=1, column=0, sticky="w", padx=(345, 5))
+
+        tk.Button(self.find_bar, text="Find in Files...", command=self.toggle_file_panel,
+                  bg=MIDGRAY_BG, fg=LIGHT_TEXT, activebackground=BUTTON_ACTIVE,
+                  relief="flat", padx=4, pady=0).grid(row=1, column=2, padx=5, pady=(2, 0), sticky="e")
 
         self.status_label = tk.Label(self.find_bar, text="", fg=LIGHT_TEXT, bg=DARKGRAY_BG, anchor="e")
         self.status_label.grid(row=1, column=4, padx=10, sticky="e")
-        tk.Button(self.find_bar, text="✕", command=self.find_bar.destroy,
+        tk.Button(self.find_bar, text="✕", command=self.close_find_bar,
           bg=DARKGRAY_BG, fg="#606060", relief="flat", padx=6, pady=2,
           activebackground=BUTTON_ACTIVE).grid(row=0, column=4, sticky="ne", padx=0, pady=0)
         self.update_cursor_position()
 
+    def close_find_bar(self):
+        self.reset_search()
+        self.find_bar.destroy()
+
+    def schedule_search(self):
+        if self._search_job:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(SEARCH_DEBOUNCE_MS, self._start_pending_search)
+
+    def _start_pending_search(self):
+        self._search_job = None
+        if self.find_bar and self.find_bar.winfo_exists():
+            self.ensure_search(self.find_entry.get())
+
+    def ensure_search(self, query):
+        options = (bool(self.match_case.get()), bool(self.regex_mode.get()), bool(self.whole_word.get()))
+        if self.search is not None and self.search.matches_query(query, *options):
+            return self.search
+        self.reset_search()
+        if not query:
+            return None
+        try:
+            session = SearchSession(query, *options)
+        except re.error as e:
+            self.show_status(f"Invalid pattern: {e}", timeout=4000)
+            return None
+        self.search = session
+        snapshot = self.text_area.snapshot()
+
+        def work():
+            text = snapshot.text()
+            if session.regex:
+                result = session.scan_isolated([(0, text)])
+                result = result and result[0]
+            else:
+                result = session.scan(text)
+            if result is not None:
+                self.root.after(0, lambda: self._search_finished(session, *result))
+            elif session.error:
+                self.root.after(0, lambda: self._search_failed(session))
+        threading.Thread(target=work, daemon=True).start()
+        self.update_cursor_position()
+        return session
+
+    def _search_finished(self, session, starts, ends):
+        if session is not self.search:
+            return
+        session.load(starts, ends)
+        self._search_ready(session)
+
+    def rescan_search(self, session):
+        # True once the hits are current. A regex rescan goes to the worker
+        # process like the first scan; until it lands the session is not ready, edits
+        # queue up, and _search_ready picks up whatever was waiting for it
+        if not session.dirty:
+            return True
+        if not session.regex:
+            session.rescan(self.text_area)
+            return True
+        windows = session.dirty_windows(self.text_area)
+        session.ready = False
+
+        def work():
+            results = session.scan_isolated([(start, text) for start, _, text in windows])
+            if results is not None:
+                self.root.after(0, lambda: self._rescan_finished(session, windows, results))
+            elif session.error:
+                self.root.after(0, lambda: self._search_failed(session))
+        threading.Thread(target=work, daemon=True).start()
+        self.update_cursor_position()
+        return False
+
+    def _rescan_finished(self, session, windows, results):
+        if session is not self.search:
+            return
+        session.merge(windows, results)
+        session.load(session.starts, session.ends)
+        self._search_ready(session)
+
+    def _search_ready(self, session):
+        if not self.rescan_search(session):
+            return
+        if self._replace_pending is session:
+            self._start_replace_all(session)
+            return
+        if self._find_pending is not None:
+            self._find_in_session(session, self._find_pending)
+        self.refresh_match_tags()
+        self.update_cursor_position()
+
+    def _search_failed(self, session):
+        if session is not self.search:
+            return
+        self._find_pending = None
+        if self._replace_pending is session:
+            self._replace_pending = None
+        self.show_status(session.error, timeout=4000)
+        self.update_cursor_position()
+
+    def cancel_search(self):
+        session = self.search
+        if session is None or session.ready or session.error:
+            return
+        session.cancelled.set()
+        session.error = "Search cancelled"
+        self._search_failed(session)
+
+    def reset_search(self):
+        self._find_pending = None
+        self._replace_pending = None
+        if self.search is not None:
+            self.search.cancelled.set()
+            self.search = None
+        self.text_area.tag_remove("match", "1.0", tk.END)
+        self.text_area.tag_remove("found", "1.0", tk.END)
+        self.update_cursor_position()
+
+    def refresh_match_tags(self):
+        if self._match_tag_job is None:
+            self._match_tag_job = self.root.after_idle(self._refresh_match_tags)
+
+    def _refresh_match_tags(self):
+        self._match_tag_job = None
+        session = self.search
+        self.text_area.tag_remove("match", "1.0", tk.END)
+        if session is None or not session.ready or session.error:
+            return
+        if session.dirty:
+            if not self.rescan_search(session):
+                return
+            self.update_cursor_position()
+        top = self.text_area.offset_of("@0,0")
+        bottom = self.text_area.offset_of(f"@{self.text_area.winfo_width()},{self.text_area.winfo_height()} lineend")
+        i, j = session.visible(top, bottom)
+        ranges = []
+        for k in range(i, min(j, i + VISIBLE_MATCH_LIMIT)):
+            ranges.append(self.text_area.index_of(session.starts[k]))
+            ranges.append(self.text_area.index_of(session.ends[k]))
+        if ranges:
+            self.text_area.tag_add("match", *ranges)
+
     def do_find(self):
         self.text_area.tag_remove("found", "1.0", tk.END)
         query = self.find_entry.get()
         if not query:
+            self.reset_search()
             return
 
         direction = self.search_direction.get()
         backwards = direction == "up"
+        if self.large_view is not None:
+            self._find_in_large(backwards)
+            return
+        session = self.ensure_search(query)
+        if session is None:
+            return
+        if session.error:
+            self.show_status(session.error, timeout=4000)
+            return
+        if session.ready:
+            self._find_in_session(session, backwards)
+            self.refresh_match_tags()
+            self.update_cursor_position()
+            return
+        if session.regex or session.whole_word:
+            # Tk's regex engine would run on the UI thread and its plain search has
+            # no word boundaries, so wait for the scan
+            self._find_pending = backwards
+            return
+
+        # The background scan has not finished yet, so fall back to a direct search
         start = self.text_area.index("insert")
         stop = "1.0" if backwards else tk.END
 
@@ -469,7 +4585,6 @@ class Notepad:
         if idx:
             end = f"{idx}+{len(query)}c"
             self.text_area.tag_add("found", idx, end)
-            self.text_area.tag_config("found", background=DARKGRAY_BG)
             self.text_area.mark_set("insert", idx if backwards else end)
             self.text_area.see(idx)
         elif self.wrap_around.get():
@@ -479,33 +4594,322 @@ class Notepad:
             if idx:
                 end = f"{idx}+{len(query)}c"
                 self.text_area.tag_add("found", idx, end)
-                self.text_area.tag_config("found", background=DARKGRAY_BG)
                 self.text_area.mark_set("insert", idx if backwards else end)
                 self.text_area.see(idx)
 
+    def _find_in_session(self, session, backwards):
+        self._find_pending = None
+        if not self.rescan_search(session):
+            self._find_pending = backwards
+            return
+        i = session.nearest(self.text_area.offset_of("insert"), backwards, self.wrap_around.get())
+        if i is None:
+            session.current = None
+            return
+        session.current = session.starts[i]
+        idx = self.text_area.index_of(session.starts[i])
+        end = self.text_area.index_of(session.ends[i])
+        self.text_area.tag_add("found", idx, end)
+        self.text_area.mark_set("insert", idx if backwards else end)
+        self.text_area.see(idx)
+
     def do_replace(self):
+        if self.large_view is not None:
+            self.show_status("Large files are opened read-only", timeout=3000)
+            return
         if self.text_area.tag_ranges("found"):
             try:
+                replacement = self._replacement_for_found(self.replace_entry.get())
+                if replacement is None:
+                    return
                 replace_pos = self.text_area.index("found.first")
                 self.text_area.delete("found.first", "found.last")
-                self.text_area.insert(replace_pos, self.replace_entry.get())
+                self.text_area.insert(replace_pos, replacement)
             except tk.TclError:
                 pass
         self.do_find()
 
+    def _replacement_for_found(self, template):
+        # Regex replacements expand group references against the found match
+        session = self.search
+        if session is None or not session.regex or "\\" not in template:
+            return template
+        first = int(self.text_area.index("found.first").split(".")[0])
+        last = int(self.text_area.index("found.last").split(".")[0])
+        base = self.text_area.offset_of(f"{first}.0")
+        window = self.text_area.get(f"{first}.0", f"{last}.end")
+        match = session.pattern.match(window, self.text_area.offset_of("found.first") - base)
+        if match is None:
+            return template
+        try:
+            return match.expand(template)
+        except (re.error, IndexError) as e:
+            self.show_status(f"Invalid replacement: {e}", timeout=4000)
+            return None
+
     def do_replace_all(self):
         query = self.find_entry.get()
-        replace = self.replace_entry.get()
+        if not query or self.is_busy():
+            return
+        if self.large_view is not None:
+            self.show_status("Large files are opened read-only", timeout=3000)
+            return
+        session = self.ensure_search(query)
+        if session is None or session.error:
+            return
+        if session.ready:
+            self._start_replace_all(session)
+        else:
+            # Spans come from the background scan; pick up once it lands
+            self._replace_pending = session
+            self.show_status("Replace All: finding matches...   (Esc to cancel)")
+
+    def _start_replace_all(self, session):
+        self._replace_pending = None
+        if not self.rescan_search(session):
+            self._replace_pending = session
+            self.show_status("Replace All: finding matches...   (Esc to cancel)")
+            return
+        template = self.replace_entry.get()
+        if session.regex and "\\" in template:
+            self._expand_replace_all(session, template)
+            return
+        self._run_replace_all([(start, end, template) for start, end in zip(session.starts, session.ends)])
+
+    def _expand_replace_all(self, session, template):
+        # Group references differ per match, so the matches are found again in
+        # the scan process with the template expanded for each
+        self._replace_pending = session
+        self._sync_revision()
+        revision = self.revision
+        snapshot = self.text_area.snapshot()
+        self.show_status("Replace All: finding matches...   (Esc to cancel)")
+
+        def work():
+            results = session.scan_isolated([(0, snapshot.text())], template)
+            if results is not None:
+                self.root.after(0, lambda: self._replace_all_expanded(session, revision, results[0]))
+            elif session.error:
+                self.root.after(0, lambda: self._search_failed(session))
+        threading.Thread(target=work, daemon=True).start()
+
+    def _replace_all_expanded(self, session, revision, result):
+        if session is not self.search or self._replace_pending is not session:
+            return
+        self._sync_revision()
+        if self.revision != revision:
+            # Edited while the matches were found; find them again
+            self._start_replace_all(session)
+            return
+        self._replace_pending = None
+        self._run_replace_all(list(zip(*result)))
+
+    def _run_replace_all(self, spans):
+        # The session would shift its offsets on every replacement, so detach it
+        self.reset_search()
+        if not spans:
+            self.show_status("Replace All: no matches", timeout=2000)
+            return
+        self.replacer = ReplaceAllJob(spans)
+        # One undo step for the whole run
+        self.text_area.edit_separator()
+        self.text_area.configure(autoseparators=False)
+        self._pump_replace()
+
+    def _pump_replace(self):
+        self._replace_job = None
+        job = self.replacer
+        if job is None:
+            return
+        deadline = time.perf_counter() + LOAD_FRAME_BUDGET
+        # Work from the end so offsets of the spans still to do stay valid
+        while job.remaining and time.perf_counter() < deadline:
+            job.remaining -= 1
+            start, end, text = job.spans[job.remaining]
+            self.text_area.replace(self.text_area.index_of(start), self.text_area.index_of(end), text)
+            job.count += 1
+        if job.remaining:
+            self.show_status(f"Replacing... {job.count} of {len(job.spans)}   (Esc to cancel)")
+            self._replace_job = self.root.after(LOAD_POLL_MS, self._pump_replace)
+        else:
+            self._finish_replace_all(f"Replaced {job.count} occurrences")
+
+    def cancel_replace_all(self):
+        if self._replace_pending is not None:
+            self.reset_search()
+            self.show_status("Replace All cancelled", timeout=3000)
+            return
+        if self.replacer is None:
+            return
+        if self._replace_job:
+            self.root.after_cancel(self._replace_job)
+        self._finish_replace_all(f"Replace All cancelled after {self.replacer.count} replacements")
+
+    def _finish_replace_all(self, message):
+        self._replace_job = None
+        self.replacer = None
+        self.text_area.configure(autoseparators=True)
+        self.text_area.edit_separator()
+        self.show_status(message, timeout=3000)
+        if self.find_bar and self.find_bar.winfo_exists():
+            self.ensure_search(self.find_entry.get())
+
+    def toggle_file_panel(self):
+        if self.file_panel is not None and self.file_panel.winfo_exists():
+            self.file_dir_entry.focus_set()
+            return
+        panel = self.file_panel = tk.Frame(self.root, bg=DARKGRAY_BG, bd=2)
+        panel.grid(row=2, column=0, columnspan=2, sticky="ew")
+        panel.grid_columnconfigure(1, weight=1)
+
+        def label(text, column):
+            tk.Label(panel, text=text, bg=DARKGRAY_BG, fg=LIGHT_TEXT).grid(row=0, column=column, padx=(5, 2), sticky="w")
+
+        def entry(column, value, width=None):
+            widget = tk.Entry(panel, bg=LIGHTGRAY_BG, fg=LIGHT_TEXT, insertbackground=LIGHT_TEXT, width=width)
+            widget.insert(0, value)
+            widget.grid(row=0, column=column, padx=2, sticky="ew")
+            widget.bind("<Return>", lambda e: self.start_file_search())
+            return widget
+
+        label("In", 0)
+        directory = os.path.dirname(os.path.abspath(self.filename)) if self.filename else os.getcwd()
+        self.file_dir_entry = entry(1, directory)
+        tk.Button(panel, text="...", command=self.browse_search_dir,
+                  bg=MIDGRAY_BG, fg=LIGHT_TEXT, activebackground=BUTTON_ACTIVE,
+                  relief="flat", padx=4, pady=0).grid(row=0, column=2, padx=(0, 5))
+        label("Include", 3)
+        self.file_include_entry = entry(4, "", 14)
+        label("Exclude", 5)
+        self.file_exclude_entry = entry(6, FILE_SEARCH_EXCLUDE, 28)
+        self.file_search_btn = tk.Button(panel, text="Search", command=self.start_file_search,
+                                         bg=MIDGRAY_BG, fg=LIGHT_TEXT, activebackground=BUTTON_ACTIVE,
+                                         relief="flat", width=10, padx=4, pady=0)
+        self.file_search_btn.grid(row=0, column=7, padx=(3, 8), pady=2)
+        tk.Button(panel, text="✕", command=self.close_file_panel,
+                  bg=DARKGRAY_BG, fg="#606060", relief="flat", padx=6, pady=2,
+                  activebackground=BUTTON_ACTIVE).grid(row=0, column=8, sticky="ne")
+
+        self.file_list = tk.Listbox(panel, height=10, bg=LIGHTGRAY_BG, fg=LIGHT_TEXT, relief="flat",
+                                    selectbackground=MIDGRAY_BG, highlightthickness=0, activestyle="none")
+        self.file_list.grid(row=1, column=0, columnspan=8, padx=(5, 0), pady=(2, 0), sticky="ew")
+        scroll = ttk.Scrollbar(panel, command=self.file_list.yview, style="Vertical.TScrollbar")
+        scroll.grid(row=1, column=8, sticky="ns", pady=(2, 0))
+        self.file_list.configure(yscrollcommand=scroll.set)
+        self.file_list.bind("<Double-Button-1>", lambda e: self.open_file_hit())
+        self.file_list.bind("<Return>", lambda e: self.open_file_hit())
+
+        self.file_status = tk.Label(panel, text="", bg=DARKGRAY_BG, fg=LIGHT_TEXT, anchor="w")
+        self.file_status.grid(row=2, column=0, columnspan=9, padx=5, sticky="ew")
+        self.file_hits = []
+        self.file_dir_entry.focus_set()
+
+    def close_file_panel(self):
+        # The walker winds down on its own once cancelled; nothing reads its results
+        self.cancel_file_search()
+        self.file_search = None
+        if self._file_search_job:
+            self.root.after_cancel(self._file_search_job)
+            self._file_search_job = None
+        if self.file_panel is not None:
+            self.file_panel.destroy()
+            self.file_panel = None
+        self.file_hits = []
+
+    def browse_search_dir(self):
+        from tkinter import filedialog
+        directory = filedialog.askdirectory(initialdir=self.file_dir_entry.get() or None)
+        if directory:
+            self.file_dir_entry.delete(0, tk.END)
+            self.file_dir_entry.insert(0, directory)
+
+    def start_file_search(self):
+        if self.file_search is not None:
+            self.cancel_file_search()
+            return
+        query = self.find_entry.get() if self.find_bar and self.find_bar.winfo_exists() else ""
+        directory = self.file_dir_entry.get().strip()
         if not query:
+            self.file_status.configure(text="Type what to find in the find bar")
             return
-        content = self.text_area.get("1.0", tk.END)
-        if self.match_case.get():
-            new_content = content.replace(query, replace)
+        if not os.path.isdir(directory):
+            self.file_status.configure(text=f"Not a directory: {directory}")
+            return
+        # Files are searched as bytes, the same way large-file mode does it
+        options = (bool(self.regex_mode.get()), bool(self.whole_word.get()))
+        flags = re.MULTILINE if self.match_case.get() else re.MULTILINE | re.IGNORECASE
+        source = build_pattern_source(query, *options).encode("utf-8")
+        try:
+            compile_pattern(source, flags)
+        except re.error as e:
+            self.file_status.configure(text=f"Invalid pattern: {e}")
+            return
+        self.file_list.delete(0, tk.END)
+        self.file_hits = []
+        self.file_search = FileSearch(directory, source, flags,
+                                      split_globs(self.file_include_entry.get()),
+                                      split_globs(self.file_exclude_entry.get()))
+        self.file_search.start()
+        self.file_search_btn.configure(text="Stop")
+        self.file_status.configure(text="Searching...")
+        self._pump_file_search()
+
+    def _pump_file_search(self):
+        self._file_search_job = None
+        search = self.file_search
+        if search is None:
+            return
+        deadline = time.perf_counter() + LOAD_FRAME_BUDGET
+        rows = []
+        finished = False
+        error = None
+        while time.perf_counter() < deadline:
+            try:
+                kind, payload = search.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "done":
+                finished, error = True, payload
+                break
+            for path, line, col, preview in payload:
+                self.file_hits.append((path, line, col))
+                rows.append(f"{os.path.relpath(path, search.directory)}:{line}:  {preview}")
+        if rows:
+            self.file_list.insert(tk.END, *rows)
+        count = len(self.file_hits)
+        if count >= FILE_SEARCH_MAX_HITS:
+            search.cancel()
+        elapsed = time.perf_counter() - search.started
+        summary = (f"{count:,} hits in {search.scanned:,} files ({search.bytes / (1024 * 1024):,.0f} MB), "
+                   f"{search.skipped:,} skipped, {elapsed:.1f}s")
+        if not finished:
+            state = "Stopping" if search.cancelled.is_set() else "Searching"
+            self.file_status.configure(text=f"{state}... {summary}   (Esc to stop)")
+            self._file_search_job = self.root.after(FILE_SEARCH_POLL_MS, self._pump_file_search)
+            return
+        self.file_search = None
+        self.file_search_btn.configure(text="Search")
+        if error is not None:
+            self.file_status.configure(text=f"Search failed: {error}")
+        elif search.cancelled.is_set():
+            limit = " at the result limit" if count >= FILE_SEARCH_MAX_HITS else ""
+            self.file_status.configure(text=f"Stopped{limit}: {summary}")
         else:
-            import re
-            new_content = re.sub(re.escape(query), replace, content, flags=re.IGNORECASE)
-        self.text_area.delete("1.0", tk.END)
-        self.text_area.insert("1.0", new_content)
+            self.file_status.configure(text=f"Done: {summary}")
+
+    def cancel_file_search(self):
+        if self.file_search is not None:
+            self.file_search.cancel()
+
+    def open_file_hit(self):
+        selection = self.file_list.curselection()
+        if not selection:
+            return
+        path, line, col = self.file_hits[selection[0]]
+        if os.path.isfile(path):
+            self.open_document(path, (line, col))
+        else:
+            self.file_status.configure(text=f"{os.path.basename(path)} no longer exists")
 
     def insert_datetime(self):
         from datetime import datetime
@@ -518,11 +4922,10 @@ class Notepad:
             from tempfile import NamedTemporaryFile
             win32api = __import__('win32api')
 
-            text = self.text_area.get("1.0", "end-1c")
-            if not text.strip():
+            if not self.text_area.search(r"\S", "1.0", tk.END, regexp=True):
                 return
             with NamedTemporaryFile(delete=False, suffix=".txt", mode="w", encoding="utf-8") as tmp:
-                tmp.write(text)
+                tmp.writelines(self.text_area.snapshot())
                 tmp_path = tmp.name
             win32api.ShellExecute(0, "print", tmp_path, None, ".", 0)
         except Exception as e:
@@ -547,21 +4950,31 @@ class Notepad:
 ### ======================== Key Bindings ======================== ###
 
     def singleton_server(self):
-        def listen():
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind((SINGLETON_HOST, PORT))
-                s.listen(1)
-                while True:
-                    conn, _ = s.accept()
-                    with conn:
-                        msg = conn.recv(1024).decode()
-                        if msg == "SHOW":
-                            self.root.after(0, lambda: self.root.deiconify())
-        threading.Thread(target=listen, daemon=True).start()
+        self.instance_server = InstanceServer(lambda batch: self.root.after(0, lambda: self.handle_commands(batch)))
+        try:
+            self.instance_server.start()
+        except OSError as e:
+            print("Single-instance server unavailable:", e)
+
+    def handle_commands(self, batch):
+        targets = [arg for command, arg in batch if command == "OPEN"]
+        if any(command == "SHOW" for command, _ in batch) or targets:
+            self.root.deiconify()
+            self.root.lift()
+            self.root.focus_force()
+        if targets:
+            self.open_targets(targets)
+
+    def open_targets(self, targets):
+        # Every file gets a tab, but only the last one is read now; the others
+        # load when they are first shown
+        targets = [target for target in targets if os.path.isfile(target[0])]
+        for i, (path, line, col) in enumerate(targets):
+            self.open_document(path, (line, col) if line else None, show=i == len(targets) - 1)
+        if len(targets) > 1:
+            self.show_status(f"Opened {len(targets)} files", timeout=3000)
 
     def bind_shortcuts(self):
-        self.text_area.bind("<Control-MouseWheel>", self.zoom_with_scroll)
         def handle_ctrl_f(event):
             try:
                 selection = self.text_area.selection_get()
@@ -577,6 +4990,13 @@ class Notepad:
 
         self.root.bind("<Control-f>", handle_ctrl_f)
 
+        def handle_ctrl_shift_f(event):
+            self.toggle_find_bar()
+            self.toggle_file_panel()
+            return "break"
+
+        self.root.bind("<Control-F>", handle_ctrl_shift_f)
+
         # Ctrl+H override on the text widget itself
         def handle_ctrl_h(event):
             try:
@@ -591,13 +5011,20 @@ class Notepad:
             self.toggle_find_bar()
             return "break"
 
-        self.text_area.bind("<Control-h>", handle_ctrl_h)
-        self.root.bind("<Control-h>", handle_ctrl_h)
-
-
-        self.text_area.bind("<Control-h>", handle_ctrl_h)  # override text widget's backspace
+        def bind_text(text):
+            text.bind("<Control-MouseWheel>", self.zoom_with_scroll)
+            text.bind("<Control-h>", handle_ctrl_h)  # override text widget's backspace
+            # Text's class bindings would move the focus on Ctrl+Tab
+            text.bind("<Control-Tab>", lambda e: self.cycle_tab(1))
+            text.bind("<Control-Shift-Tab>", lambda e: self.cycle_tab(-1))
+            if self.root._windowingsystem == "x11":
+                text.bind("<Control-ISO_Left_Tab>", lambda e: self.cycle_tab(-1))
+        self.add_text_setup(bind_text)
         self.root.bind("<Control-h>", handle_ctrl_h)       # catch it at root level too
 
+        self.root.bind("<Escape>", self.cancel_task)
+        self.root.bind("<Control-n>", lambda e: (self.new_file(), "break"))
+        self.root.bind("<Control-w>", lambda e: (self.close_tab(), "break"))
         self.root.bind("<Control-o>", lambda e: (self.open_file(), "break"))
         self.root.bind("<Control-s>", lambda e: (self.save_file(), "break"))
         self.root.bind("<F5>", lambda e: self.insert_datetime())
@@ -608,15 +5035,17 @@ class Notepad:
 ### ================== Application Entry Point =================== ###
 
 if __name__ == "__main__":
-    if notify_existing_instance():
-        sys.exit()
-
-    root = TkinterDnD.Tk()
-    try:
-        root.tk.eval('package require tkdnd')
-    except tk.TclError as e:
-        print("Failed to load tkdnd package:", e)
-    app = Notepad(root)
+    with STARTUP.phase("tk root"):
+        root = tk.Tk()
+    INSTRUMENT.install(root)
+    with STARTUP.phase("Notepad.__init__"):
+        app = Notepad(root)
     app.singleton_server()
+    app.offer_recovery()
+    targets = [parse_open_target(arg) for arg in sys.argv[1:] if not arg.startswith("--")]
+    if targets:
+        app.open_targets(targets)
     root.mainloop()
+    app.instance_server.close()
+    INSTRUMENT.close()
 
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# Headless benchmarks for Notepd's hot paths.
+#
+#   python notepd_bench.py --sizes 1M,10M --variants short,long,unicode --repeat 5
+#   python notepd_bench.py --compare old.json new.json
+#
+# Every generated document runs in its own child process against a real Notepad
+# instance, under Xvfb when there is no display. Results (latency percentiles in
+# milliseconds, peak RSS per operation in KiB) go to bench_output.txt as JSON.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = "1M,10M,100M,1G"
+DEFAULT_VARIANTS = "short,long,unicode"
+OPERATIONS = ["open", "save", "find", "replace_all", "update_cursor", "is_modified", "snapshot", "zoom"]
+MICRO_SAMPLES = 200               # samples for operations that take microseconds
+NEEDLE = "needle-7f3a"            # planted once near the end so a find has to scan everything
+WORD = "lorem"                    # common enough for Replace All to touch every line
+ZOOM_TICKS = 6                    # wheel ticks in one zoom gesture
+WAIT_TIMEOUT = 1800               # seconds one operation may take before it is abandoned
+
+
+### ==================== Document Generation ===================== ###
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, scale in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{unit}"
+    return str(size)
+
+
+def short_lines(rnd):
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+    while True:
+        yield " ".join(rnd.choice(words) for _ in range(rnd.randint(2, 8))) + "\n"
+
+
+def long_lines(rnd):
+    # Minified-JSON style lines of 100k+ characters
+    while True:
+        parts = [f'"{WORD}{i}":{rnd.randint(0, 10**9)}' for i in range(6000)]
+        yield "{" + ",".join(parts) + "}\n"
+
+
+def unicode_lines(rnd):
+    words = ["lorem", "Ünïcödé", "ταχύτητα", "速度测试", "скорость", "اختبار", "テキスト", "é̂"]
+    while True:
+        yield " ".join(rnd.choice(words) for _ in range(rnd.randint(3, 10))) + "\n"
+
+
+VARIANTS = {"short": short_lines, "long": long_lines, "unicode": unicode_lines}
+
+
+def generate(path, variant, size):
+    if os.path.exists(path) and os.path.getsize(path) >= size:
+        return
+    rnd = random.Random(size)
+    lines = VARIANTS[variant](rnd)
+    written = 0
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as file:
+        buffer = []
+        pending = 0
+        while written + pending < size:
+            line = next(lines)
+            buffer.append(line)
+            pending += len(line.encode("utf-8"))
+            if pending >= 1 << 20:
+                file.write("".join(buffer))
+                written += pending
+                buffer, pending = [], 0
+        buffer.append(f"{NEEDLE}\n")
+        file.write("".join(buffer))
+    os.replace(tmp_path, path)
+
+
+### ======================== Measurement ========================= ###
+
+def reset_peak_rss():
+    # Linux lets a process reset its own high-water mark; elsewhere peaks only grow
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[rank]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "samples": len(ordered),
+        "p50": percentile(ordered, 0.50),
+        "p90": percentile(ordered, 0.90),
+        "p99": percentile(ordered, 0.99),
+        "min": ordered[0] if ordered else None,
+        "max": ordered[-1] if ordered else None,
+        "mean": sum(ordered) / len(ordered) if ordered else None,
+    }
+
+
+### =========================== Worker =========================== ###
+
+class Event:
+    def __init__(self, delta):
+        self.delta = delta
+
+
+class Worker:
+    # Drives one Notepad instance through the requested operations on one document
+    def __init__(self, path, withdrawn):
+        sys.path.insert(0, HERE)
+        import tkinter as tk
+        import notepd
+        self.tk = tk
+        self.path = path
+        self.root = tk.Tk()
+        if withdrawn:
+            self.root.withdraw()
+        self.app = notepd.Notepad(self.root)
+        self.wait(lambda: not self.app._startup_steps)
+        self.out_path = os.path.join(tempfile.mkdtemp(prefix="notepd-bench-"), "saved.txt")
+        self.rnd = random.Random(0)
+
+    def wait(self, done, timeout=WAIT_TIMEOUT):
+        deadline = time.perf_counter() + timeout
+        while not done():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("operation did not finish in time")
+            self.root.update()
+            time.sleep(0.0005)
+
+    def timed(self, start, done):
+        t0 = time.perf_counter()
+        start()
+        self.wait(done)
+        return (time.perf_counter() - t0) * 1000
+
+    def loaded(self):
+        app = self.app
+        if app.large_view is not None:
+            return app.large_view.total_lines is not None
+        return app.loader is None
+
+    def ensure_open(self):
+        if self.app.filename != self.path or not self.loaded():
+            self.app.load_file(self.path)
+            self.wait(self.loaded)
+
+    def run(self, op, repeat):
+        reset_peak_rss()
+        extra = {}
+        if op in ("save", "replace_all", "snapshot") and self.app.large_view is not None:
+            return {"skipped": "large files are opened read-only"}
+        samples = getattr(self, "bench_" + op)(repeat, extra)
+        result = summarize(samples)
+        result["peak_rss_kb"] = peak_rss_kb()
+        result.update(extra)
+        return result
+
+    def bench_open(self, repeat, extra):
+        app = self.app
+        samples, first_paint = [], []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            app.load_file(self.path)
+            self.wait(lambda: app.large_view is not None or app.text_area.index("end-1c") != "1.0" or app.loader is None)
+            first_paint.append((time.perf_counter() - t0) * 1000)
+            self.wait(self.loaded)
+            samples.append((time.perf_counter() - t0) * 1000)
+        extra["first_paint"] = summarize(first_paint)
+        extra["mode"] = "large" if app.large_view is not None else "text"
+        return samples
+
+    def bench_save(self, repeat, extra):
+        app = self.app
+        return [self.timed(lambda: app.submit_save(self.out_path), lambda: app._saves_in_flight == 0)
+                for _ in range(repeat)]
+
+    def find_ready(self):
+        app = self.app
+        if app.large_view is not None:
+            return app._large_search is None
+        session = app.search
+        return session is None or ((session.ready or session.error) and app._find_pending is None)
+
+    def bench_find(self, repeat, extra):
+        app = self.app
+        app.toggle_find_bar()
+        app.find_entry.delete(0, self.tk.END)
+        app.find_entry.insert(0, NEEDLE)
+        samples = []
+        for _ in range(repeat):
+            # Cold search from the top every time, the scan included
+            app.reset_search()
+            if app.large_view is None:
+                app.text_area.mark_set("insert", "1.0")
+            else:
+                app._large_jump(0)
+            samples.append(self.timed(app.do_find, self.find_ready))
+        return samples
+
+    def bench_replace_all(self, repeat, extra):
+        app = self.app
+        app.toggle_find_bar()
+        app.find_entry.delete(0, self.tk.END)
+        app.find_entry.insert(0, WORD)
+        app.replace_entry.delete(0, self.tk.END)
+        app.replace_entry.insert(0, WORD.upper())
+        samples = []
+        for _ in range(repeat):
+            app.reset_search()
+            samples.append(self.timed(app.do_replace_all,
+                                      lambda: app.replacer is None and app._replace_pending is None))
+            app.reset_search()
+            app.text_area.edit_undo()
+        return samples
+
+    def bench_update_cursor(self, repeat, extra):
+        app = self.app
+        if app.large_view is None:
+            lines = int(app.text_area.index("end-1c").split(".")[0])
+        samples = []
+        for _ in range(max(repeat, MICRO_SAMPLES)):
+            if app.large_view is None:
+                app.text_area.mark_set("insert", f"{self.rnd.randint(1, lines)}.0")
+            t0 = time.perf_counter()
+            app._update_cursor()
+            samples.append((time.perf_counter() - t0) * 1000)
+        return samples
+
+    def bench_is_modified(self, repeat, extra):
+        app = self.app
+        samples = []
+        for _ in range(max(repeat, MICRO_SAMPLES)):
+            t0 = time.perf_counter()
+            app.is_modified()
+            samples.append((time.perf_counter() - t0) * 1000)
+        return samples
+
+    def bench_snapshot(self, repeat, extra):
+        # One typed character, then the snapshot a save or search would take
+        app = self.app
+        lines = int(app.text_area.index("end-1c").split(".")[0])
+        samples = []
+        for _ in range(max(repeat, MICRO_SAMPLES)):
+            index = f"{self.rnd.randint(1, lines)}.0"
+            app.text_area.insert(index, "x")
+            t0 = time.perf_counter()
+            app.text_area.snapshot("\n")
+            samples.append((time.perf_counter() - t0) * 1000)
+            app.text_area.delete(index)
+        extra["pieces"] = app.text_area.buffer.piece_count()
+        return samples
+
+    def bench_zoom(self, repeat, extra):
+        # One sample is a whole gesture, from its first tick until the relayout
+        # has run; the quiet period before it is included
+        app = self.app
+        samples, ticks = [], []
+        for i in range(repeat):
+            event = Event(120 if i % 2 == 0 else -120)
+            t0 = time.perf_counter()
+            for _ in range(ZOOM_TICKS):
+                t1 = time.perf_counter()
+                app.zoom_with_scroll(event)
+                self.root.update_idletasks()
+                ticks.append((time.perf_counter() - t1) * 1000)
+            self.wait(lambda: app._layout_job is None)
+            self.root.update_idletasks()
+            samples.append((time.perf_counter() - t0) * 1000)
+        extra["tick"] = summarize(ticks)
+        return samples
+
+    def close(self):
+        self.app.stop_watch()
+        self.root.destroy()
+        shutil.rmtree(os.path.dirname(self.out_path), ignore_errors=True)
+
+
+def run_worker(args):
+    # Anything the editor prints must not end up in the JSON on stdout
+    out, sys.stdout = sys.stdout, sys.stderr
+    worker = Worker(args.worker, args.withdrawn)
+    results = {"tk": worker.tk.TkVersion}
+    try:
+        for op in args.ops.split(","):
+            if op != "open":
+                worker.ensure_open()
+            try:
+                results[op] = worker.run(op, args.repeat)
+            except TimeoutError as e:
+                results[op] = {"error": str(e)}
+    finally:
+        worker.close()
+    json.dump(results, out)
+
+
+### ======================= Orchestration ======================== ###
+
+def start_xvfb():
+    # Returns the Xvfb process (or None when a display is already available)
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    binary = shutil.which("Xvfb")
+    if not binary:
+        sys.exit("No DISPLAY and Xvfb is not installed; run under a display or install Xvfb")
+    for number in range(99, 140):
+        if os.path.exists(f"/tmp/.X11-unix/X{number}") or os.path.exists(f"/tmp/.X{number}-lock"):
+            continue
+        proc = subprocess.Popen([binary, f":{number}", "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(50):
+            if os.path.exists(f"/tmp/.X11-unix/X{number}"):
+                os.environ["DISPLAY"] = f":{number}"
+                return proc
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+        proc.terminate()
+    sys.exit("Could not start Xvfb")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(args):
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "notepd-bench")
+    os.makedirs(data_dir, exist_ok=True)
+    # Keep the benchmark's config writes away from the user's settings
+    config_dir = tempfile.mkdtemp(prefix="notepd-bench-config-")
+    env = dict(os.environ, APPDATA=config_dir)
+    xvfb = start_xvfb()
+    if xvfb is not None:
+        env["DISPLAY"] = os.environ["DISPLAY"]
+    report = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": [],
+    }
+    try:
+        for variant in args.variants.split(","):
+            for size in [parse_size(s) for s in args.sizes.split(",")]:
+                path = os.path.join(data_dir, f"{variant}-{format_size(size)}.txt")
+                print(f"{variant} {format_size(size)}: generating", file=sys.stderr, flush=True)
+                generate(path, variant, size)
+                print(f"{variant} {format_size(size)}: running {args.ops}", file=sys.stderr, flush=True)
+                command = [sys.executable, os.path.abspath(__file__), "--worker", path,
+                           "--ops", args.ops, "--repeat", str(args.repeat)]
+                if args.withdrawn:
+                    command.append("--withdrawn")
+                entry = {"variant": variant, "size": size, "bytes": os.path.getsize(path)}
+                try:
+                    proc = subprocess.run(command, env=env, capture_output=True, text=True,
+                                          timeout=args.timeout)
+                    if proc.returncode == 0:
+                        entry["operations"] = json.loads(proc.stdout)
+                    else:
+                        lines = proc.stderr.strip().splitlines()
+                        entry["error"] = lines[-1] if lines else f"exit status {proc.returncode}"
+                except subprocess.TimeoutExpired:
+                    entry["error"] = f"timed out after {args.timeout}s"
+                report["results"].append(entry)
+                if not args.keep_data:
+                    os.unlink(path)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+        shutil.rmtree(config_dir, ignore_errors=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+def compare(base_path, new_path):
+    # p50 of every operation in new relative to base; > 1.00 is slower
+    def index(path):
+        with open(path) as f:
+            report = json.load(f)
+        rows = {}
+        for entry in report["results"]:
+            for op, result in entry.get("operations", {}).items():
+                if isinstance(result, dict) and result.get("p50") is not None:
+                    rows[(entry["variant"], format_size(entry["size"]), op)] = result
+        return report.get("revision"), rows
+
+    base_rev, base = index(base_path)
+    new_rev, new = index(new_path)
+    print(f"{'variant':<9}{'size':>6}  {'operation':<15}{base_rev or 'base':>12}{new_rev or 'new':>12}{'ratio':>8}")
+    for key in sorted(base.keys() & new.keys()):
+        old_p50, new_p50 = base[key]["p50"], new[key]["p50"]
+        ratio = new_p50 / old_p50 if old_p50 else float("inf")
+        print(f"{key[0]:<9}{key[1]:>6}  {key[2]:<15}{old_p50:>12.3f}{new_p50:>12.3f}{ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Notepd on generated documents")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated, e.g. 1M,10M,1G")
+    parser.add_argument("--variants", default=DEFAULT_VARIANTS, help="short, long and/or unicode")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="operations to run, in order")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per operation")
+    parser.add_argument("--output", default="bench_output.txt")
+    parser.add_argument("--data-dir", help="where generated documents are cached")
+    parser.add_argument("--keep-data", action="store_true", help="keep generated documents for the next run")
+    parser.add_argument("--timeout", type=int, default=WAIT_TIMEOUT * 2, help="seconds per document")
+    parser.add_argument("--withdrawn", action="store_true", help="keep the Tk root withdrawn")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.worker:
+        run_worker(args)
+    else:
+        unknown = set(args.ops.split(",")) - set(OPERATIONS)
+        if unknown:
+            parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+        run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
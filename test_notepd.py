@@ -0,0 +1,294 @@
+import os
+import re
+import tkinter as tk
+
+import pytest
+
+import notepd
+
+
+EMOJI_LINE = "😀abc"
+
+
+@pytest.fixture
+def text():
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("needs a display")
+    root.withdraw()
+    widget = notepd.TrackedText(root, undo=True)
+    yield widget
+    root.destroy()
+
+
+def test_tk_column_counts_utf16_units():
+    tcl = tk.Tcl()
+    line = "a😀b😀😀c"
+    for col in range(len(line) + 1):
+        assert notepd.tk_column(line, col) == tcl.call("string", "length", line[:col])
+
+
+def test_line_index_notices_wide_characters():
+    index = notepd.LineIndex("plain\ntext")
+    assert not index.wide
+    index.apply_insert(2, 0, EMOJI_LINE)
+    assert index.wide
+    assert not notepd.LineIndex("plain").wide
+    assert notepd.LineIndex(EMOJI_LINE).wide
+
+
+def test_offsets_after_wide_character(text):
+    text.insert("1.0", f"{EMOJI_LINE}\nnext")
+    assert text.offset_of("1.end") == len(EMOJI_LINE)
+    assert text.get(text.index_of(3), text.index_of(4)) == "c"
+    assert text.verify_index()
+
+
+
+def test_expand_matches_fills_group_references():
+    pattern = re.compile(r"(\w+)@(?P<host>\w+)")
+    starts, ends, texts = notepd.expand_matches(pattern.finditer("a@b c@d"), r"\g<host>@\1", base=10)
+    assert (starts, ends, texts) == ([10, 14], [13, 17], ["b@a", "d@c"])
+
+
+def test_undo_typing_after_wide_character(text):
+    text.insert("1.0", EMOJI_LINE)
+    text.edit_separator()
+    text.insert("end-1c", "X")
+    text.edit_undo()
+    assert text.get("1.0", "end-1c") == EMOJI_LINE
+    text.edit_redo()
+    assert text.get("1.0", "end-1c") == EMOJI_LINE + "X"
+
+
+def test_undo_deletion_of_wide_character(text):
+    text.insert("1.0", f"x{EMOJI_LINE}y")
+    text.edit_separator()
+    text.delete(text.index_of(1), text.index_of(3))
+    assert text.get("1.0", "end-1c") == "xbcy"
+    text.edit_undo()
+    assert text.get("1.0", "end-1c") == f"x{EMOJI_LINE}y"
+    assert text.offset_of("insert") == 3
+
+
+def test_replay_journal_on_wide_characters():
+    base = f"{EMOJI_LINE}\nsecond"
+    records = [[4, 0, "X"], [0, 1, ""], [4, 1, "\n"], [len(base) - 1, 0, "😀"]]
+    text = base
+    for offset, removed, chunk in records:
+        text = text[:offset] + chunk + text[offset + removed:]
+    assert notepd.replay_journal(base, records) == text
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX modes and symlinks")
+def test_atomic_write_new_file_mode_and_symlink(tmp_path):
+    new = tmp_path / "new.txt"
+    notepd.atomic_write(str(new), "text")
+    assert new.stat().st_mode & 0o777 == 0o666 & ~notepd.UMASK
+    real = tmp_path / "real.txt"
+    real.write_text("old")
+    real.chmod(0o640)
+    link = tmp_path / "link.txt"
+    link.symlink_to(real)
+    notepd.atomic_write(str(link), "new")
+    assert link.is_symlink()
+    assert real.read_text() == "new"
+    assert real.stat().st_mode & 0o777 == 0o640
+
+
+def test_regex_worker_is_reused_and_restarted_after_timeout():
+    import threading
+    worker = notepd.RegexWorker()
+    cancelled = threading.Event()
+    try:
+        job = ("b+", 0, [(5, "abba")], None)
+        assert worker.run(job, cancelled, 30) == ("ok", [([6], [8])])
+        pid = worker.process.pid
+        assert worker.run(job, cancelled, 30)[0] == "ok"
+        assert worker.process.pid == pid
+        slow = ("(a+)+$", 0, [(0, "a" * 40 + "b")], None)
+        assert worker.run(slow, cancelled, 0.5)[0] == "error"
+        assert worker.process is None
+        assert worker.run(job, cancelled, 30)[0] == "ok"
+    finally:
+        worker.stop()
+
+
+def edit_at(text, offset, removed, chunk):
+    # A TextEdit for replacing text[offset:offset + removed] by chunk
+    index = notepd.LineIndex(text)
+    line, col = index.position(offset)
+    end_line, end_col = index.position(offset + removed)
+    return notepd.TextEdit(offset, removed, chunk, line, col, end_line, end_col, text[offset:offset + removed])
+
+
+def apply_records(text, records):
+    for offset, deleted, inserted in records:
+        assert text[offset:offset + len(deleted)] == deleted
+        text = text[:offset] + inserted + text[offset + len(deleted):]
+    return text
+
+
+class FakeText:
+    # The parts of TrackedText that SearchSession.rescan reads
+    def __init__(self, text):
+        self.table = notepd.PieceTable(text)
+        self.line_index = self.table.lines
+
+    def edit(self, edit):
+        self.table.apply(edit)
+
+    def get(self, start, end):
+        first = int(start.split(".")[0])
+        last = int(end.split(".")[0])
+        index = self.line_index
+        return self.table.text()[index.offset(first, 0):index.offset(last, index.line_length(last))]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_piece_table_matches_string_under_random_edits(seed):
+    import random
+    rng = random.Random(seed)
+    text = "first line\nsecond 😀 line\n\nlast"
+    table = notepd.PieceTable(text)
+    snapshots = []
+    for _ in range(300):
+        offset = rng.randint(0, len(text))
+        if rng.random() < 0.5:
+            chunk = rng.choice(["x", "ab\ncd", "\n", "😀", "long run of text " * 3])
+            table.insert(offset, chunk)
+            text = text[:offset] + chunk + text[offset:]
+        else:
+            length = rng.randint(0, min(8, len(text) - offset))
+            table.delete(offset, length)
+            text = text[:offset] + text[offset + length:]
+        if rng.random() < 0.05:
+            snapshots.append((table.snapshot(), text))
+    assert table.text() == text
+    assert len(table) == len(text)
+    assert table.lines.char_count() == len(text)
+    assert table.lines.lines == text.count("\n") + 1
+    for offset in range(0, len(text) + 1, 7):
+        line, col = table.lines.position(offset)
+        assert table.lines.offset(line, col) == offset
+        assert text[:offset].count("\n") == line - 1
+    for snapshot, expected in snapshots:
+        assert snapshot.text() == expected
+        assert snapshot.digest() == notepd.content_digest(expected)
+
+
+def test_line_index_across_blocks():
+    lines = [str(i) * (i % 7) for i in range(3 * notepd.LineIndex.BLOCK)]
+    text = "\n".join(lines)
+    index = notepd.LineIndex(text)
+    assert index.lines == len(lines)
+    assert index.char_count() == len(text)
+    index.apply_delete(2, 0, 2 * notepd.LineIndex.BLOCK, 0)
+    text = "\n".join(lines[:1] + lines[2 * notepd.LineIndex.BLOCK - 1:])
+    assert index.lines == text.count("\n") + 1
+    assert index.char_count() == len(text)
+    assert index.offset(3, 1) == text.index("\n", text.index("\n") + 1) + 2
+
+
+def test_undo_history_round_trip():
+    history = notepd.UndoHistory(1 << 20)
+    text = "hello world"
+    steps = [text]
+    for offset, removed, chunk in [(5, 0, ","), (6, 0, " big"), (0, 5, "HELLO"), (len("HELLO, big world"), 0, "😀!")]:
+        history.record(edit_at(text, offset, removed, chunk))
+        history.seal()
+        text = text[:offset] + chunk + text[offset + removed:]
+        steps.append(text)
+    for expected in reversed(steps[:-1]):
+        text = apply_records(text, history.take(redo=False))
+        assert text == expected
+    assert history.take(redo=False) is None
+    for expected in steps[1:]:
+        text = apply_records(text, history.take(redo=True))
+        assert text == expected
+
+
+def test_undo_history_merges_typing():
+    history = notepd.UndoHistory(1 << 20)
+    text = ""
+    for ch in "abc":
+        history.record(edit_at(text, len(text), 0, ch))
+        text += ch
+    history.record(edit_at(text, 2, 1, ""))
+    text = text[:2]
+    assert apply_records(text, history.take(redo=False)) == "abc"
+    assert apply_records("abc", history.take(redo=False)) == ""
+
+
+def test_search_session_patches_and_rescans():
+    doc = FakeText("cat dog cat\nbird cat\n😀cat")
+    session = notepd.SearchSession("cat", match_case=True)
+    session.load(*session.scan(doc.table.text()))
+    assert session.starts == [0, 8, 17, 22]
+    for offset, removed, chunk in [(4, 3, "cat"), (0, 0, "😀 "), (19, 4, "")]:
+        edit = edit_at(doc.table.text(), offset, removed, chunk)
+        doc.edit(edit)
+        session.apply_edit(edit)
+    session.rescan(doc)
+    text = doc.table.text()
+    assert session.starts == [m.start() for m in re.finditer("cat", text)]
+    assert session.ends == [m.end() for m in re.finditer("cat", text)]
+
+
+def test_search_file_splits_long_lines_without_losing_hits(monkeypatch):
+    import io
+    monkeypatch.setattr(notepd, "FILE_SEARCH_CHUNK", 64)
+    monkeypatch.setattr(notepd, "FILE_SEARCH_OVERLAP", 16)
+    pattern = re.compile(b"needle")
+    long_line = "é" * 150 + "needle" + "x" * 400
+    data = f"a needle\n{long_line}needle\nlast needle\n".encode()
+    for offset in range(0, 40):
+        padded = b"." * offset + data
+        hits, size = notepd._search_file(io.BytesIO(padded), pattern, "f")
+        assert size == len(padded)
+        assert [(line, column) for _, line, column, _ in hits] == [(1, 3 + offset), (2, 151), (3, 6)]
+    hits, _ = notepd._search_file(io.BytesIO(("y" * 1000 + "needle").encode()), pattern, "f")
+    assert [(line, column) for _, line, column, _ in hits] == [(1, 1001)]
+
+
+def test_save_engine_refuses_to_overwrite_changed_file(tmp_path):
+    import threading
+    path = tmp_path / "doc.txt"
+    path.write_text("original")
+    expect = (notepd.stat_key(os.stat(path)), notepd.content_digest("original"))
+    engine = notepd.SaveEngine(None)
+    results = []
+    done = threading.Event()
+
+    def on_done(path, text, token, error):
+        results.append(error)
+        done.set()
+    path.write_text("original")
+    os.utime(path, ns=(0, 0))
+    engine.submit(str(path), "mine", on_done=on_done, expect=expect)
+    assert done.wait(5) and results[-1] is None
+    assert path.read_text() == "mine"
+    expect = (notepd.stat_key(os.stat(path)), notepd.content_digest("mine"))
+    path.write_text("theirs")
+    done.clear()
+    engine.submit(str(path), "mine again", on_done=on_done, expect=expect)
+    assert done.wait(5) and isinstance(results[-1], notepd.DiskChanged)
+    assert path.read_text() == "theirs"
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX owners and modes")
+def test_local_socket_needs_private_directory(tmp_path, monkeypatch):
+    directory = tmp_path / "notepd"
+    path = str(directory / "instance.sock")
+    monkeypatch.setattr(notepd, "SINGLETON_SOCKET", path)
+    assert notepd.local_socket_path() is None
+    assert notepd.local_socket_path(create=True) == path
+    assert directory.stat().st_mode & 0o777 == 0o700
+    directory.chmod(0o755)
+    assert notepd.local_socket_path(create=True) is None
+    directory.chmod(0o700)
+    link = tmp_path / "link"
+    link.symlink_to(directory)
+    monkeypatch.setattr(notepd, "SINGLETON_SOCKET", str(link / "instance.sock"))
+    assert notepd.local_socket_path(create=True) is None